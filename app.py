@@ -8,7 +8,15 @@ from langchain.schema import SystemMessage, HumanMessage, AIMessage
 
 # Importar módulos del backend
 from backend.utils.llm_config import LLMConfig
-from backend.utils.database import DatabaseManager
+from backend.utils.storage import StorageBackend, create_storage
+from backend.utils.memory_compaction import MemoryCompactor
+from backend.utils.prompt_budget import PromptAssembler
+from backend.utils.prompt_cache import PromptCache
+from backend.utils.conversation_window import ConversationWindow
+from backend.utils.rule_consolidation import RuleConsolidator
+from backend.utils.knowledge_base import KnowledgeBase
+from backend.utils.rule_usage import ActiveRuleSet, RuleUsageTracker
+from backend.utils.topic_router import TopicRouter
 from backend.agents.main_agent import MainAgent
 from backend.agents.summarizer_agent import SummarizerAgent
 from backend.agents.optimizer_agent import OptimizerAgent
@@ -21,6 +29,9 @@ from frontend.ui.components import (
     render_bot_message,
     render_feedback_buttons,
     render_metrics_sidebar,
+    render_database_metrics_sidebar,
+    render_prompt_cache_sidebar,
+    render_llm_usage_sidebar,
     render_info_sidebar,
     render_welcome_message,
     render_thinking_animation
@@ -41,6 +52,71 @@ st.set_page_config(
 )
 
 
+@st.cache_resource
+def get_db_manager() -> StorageBackend:
+    """
+    Gestor de BD compartido por todas las sesiones de Streamlit.
+    Usa write-behind para que un único hilo escritor agrupe el feedback
+    de sesiones concurrentes en lugar de competir por el lock de SQLite.
+    """
+    return create_storage(write_behind=True)
+
+
+@st.cache_resource
+def get_memory_compactor() -> MemoryCompactor:
+    """
+    Compactador de memorias compartido; consolida en segundo plano
+    a los usuarios que acumulan demasiadas memorias.
+    """
+    llm = LLMConfig.create_default().get_llm()
+    return MemoryCompactor(get_db_manager(), SummarizerAgent(llm))
+
+
+@st.cache_resource
+def get_prompt_cache() -> PromptCache:
+    """
+    Caché de prompts del sistema compartida por todas las sesiones:
+    un prompt con las mismas reglas y la misma memoria se construye una vez.
+    """
+    return PromptCache()
+
+
+@st.cache_resource
+def get_rule_consolidator() -> RuleConsolidator:
+    """
+    Consolidador de reglas compartido: fusiona cada regla nueva con sus
+    casi duplicadas antes de que llegue al prompt.
+    """
+    return RuleConsolidator(get_db_manager())
+
+
+@st.cache_resource
+def get_rule_usage_tracker() -> RuleUsageTracker:
+    """
+    Contador de uso de reglas compartido: agrupa las inyecciones y el
+    feedback de todas las sesiones en escrituras por lotes.
+    """
+    return RuleUsageTracker(get_db_manager())
+
+
+@st.cache_resource
+def get_active_rules() -> ActiveRuleSet:
+    """
+    Conjunto activo de reglas compartido: las de mayor valor compiten
+    por entrar al prompt de cada pregunta.
+    """
+    return ActiveRuleSet()
+
+
+@st.cache_resource
+def get_knowledge_base() -> KnowledgeBase:
+    """
+    Base de conocimiento compartida: el índice BM25 se carga de disco
+    (o se construye) una sola vez por proceso.
+    """
+    return KnowledgeBase().load()
+
+
 def initialize_session_state():
     """
     Inicializa el estado de la sesión de Streamlit.
@@ -48,12 +124,21 @@ def initialize_session_state():
     if 'initialized' not in st.session_state:
         # Inicializar componentes del backend
         llm_config = LLMConfig.create_default()
+        st.session_state.llm_config = llm_config
         st.session_state.llm = llm_config.get_llm()
         
-        st.session_state.db_manager = DatabaseManager()
-        st.session_state.main_agent = MainAgent(st.session_state.llm)
-        st.session_state.summarizer_agent = SummarizerAgent(st.session_state.llm)
-        st.session_state.optimizer_agent = OptimizerAgent(st.session_state.llm)
+        st.session_state.db_manager = get_db_manager()
+        # Un mismo presupuesto de tokens para los tres agentes
+        assembler = PromptAssembler()
+        st.session_state.main_agent = MainAgent(
+            st.session_state.llm, assembler=assembler, prompt_cache=get_prompt_cache(),
+            active_rules=get_active_rules(), topic_router=TopicRouter(),
+            knowledge_base=get_knowledge_base()
+        )
+        st.session_state.summarizer_agent = SummarizerAgent(st.session_state.llm, assembler=assembler)
+        st.session_state.optimizer_agent = OptimizerAgent(st.session_state.llm, assembler=assembler)
+        # Últimos turnos textuales; los anteriores se resumen en segundo plano
+        st.session_state.conversation_window = ConversationWindow(st.session_state.summarizer_agent)
         
         # Flag de inicialización
         st.session_state.initialized = True
@@ -68,13 +153,16 @@ def initialize_session_state():
         st.session_state.messages = []
 
 
-def rebuild_system_prompt():
+def rebuild_system_prompt(query: str = None):
     """
     Reconstruye el prompt del sistema con reglas y memoria actualizadas.
+    
+    Args:
+        query: Pregunta del usuario, para inyectar solo las reglas y el conocimiento relevantes
     """
-    rules = st.session_state.db_manager.get_all_rules()
-    memory = st.session_state.db_manager.get_user_memory(st.session_state.user_id)
-    system_prompt = st.session_state.main_agent.build_system_prompt(rules, memory)
+    system_prompt = st.session_state.main_agent.build_user_prompt(
+        st.session_state.db_manager, st.session_state.user_id, query=query
+    )
     
     # Actualizar historial con nuevo prompt
     if st.session_state.chat_history:
@@ -90,6 +178,9 @@ def handle_user_input(user_input: str):
     Args:
         user_input: Texto ingresado por el usuario
     """
+    # Reglas relevantes para esta pregunta
+    rebuild_system_prompt(user_input)
+    
     # Agregar mensaje del usuario al historial
     st.session_state.chat_history.append(HumanMessage(content=user_input))
     st.session_state.messages.append({"role": "user", "content": user_input})
@@ -97,14 +188,21 @@ def handle_user_input(user_input: str):
     # Generar respuesta del bot
     with st.spinner(""):
         try:
-            ai_response = st.session_state.main_agent.respond(st.session_state.chat_history)
+            window = st.session_state.conversation_window
+            history, summary = window.view(st.session_state.chat_history)
+            ai_response = st.session_state.main_agent.respond(history, summary=summary)
+            rule_ids = st.session_state.main_agent.last_rule_ids
+            get_rule_usage_tracker().record_injection(rule_ids)
             
-            # Agregar respuesta al historial
+            # Agregar respuesta al historial y resumir lo que salió de la ventana
             st.session_state.chat_history.append(AIMessage(content=ai_response))
+            window.update(st.session_state.chat_history)
             st.session_state.messages.append({
                 "role": "assistant", 
                 "content": ai_response,
-                "feedback": None
+                "feedback": None,
+                # Reglas del prompt de esta respuesta, para contar su feedback
+                "rule_ids": rule_ids
             })
         except Exception as e:
             st.error(f"❌ Error al comunicarse con la IA: {str(e)}")
@@ -120,6 +218,9 @@ def handle_feedback(message_index: int, feedback_type: str):
     """
     # Marcar feedback en el mensaje
     st.session_state.messages[message_index]['feedback'] = feedback_type
+    get_rule_usage_tracker().record_feedback(
+        st.session_state.messages[message_index].get('rule_ids', ()), positive=feedback_type == 'up'
+    )
     
     if feedback_type == 'up':
         # Feedback positivo: guardar memoria
@@ -128,6 +229,8 @@ def handle_feedback(message_index: int, feedback_type: str):
                 st.session_state.chat_history
             )
             st.session_state.db_manager.save_user_memory(st.session_state.user_id, summary)
+            # Consolidar memorias antiguas fuera del flujo del chat
+            get_memory_compactor().schedule(st.session_state.user_id)
             st.success("✅ ¡Gracias! Memoria guardada para mejorar futuras conversaciones.")
         except Exception as e:
             st.error(f"Error al guardar memoria: {str(e)}")
@@ -141,7 +244,7 @@ def handle_feedback(message_index: int, feedback_type: str):
                 )
                 
                 if validation_score >= 0.5:
-                    st.session_state.db_manager.save_rule(rule_text, error_category, validation_score)
+                    get_rule_consolidator().save_rule(rule_text, error_category, validation_score)
                     rebuild_system_prompt()
                     st.success(f"✅ ¡Gracias! El sistema aprendió una nueva regla (categoría: {error_category})")
                 else:
@@ -172,6 +275,7 @@ def main():
             # Inicializar chat para este usuario
             st.session_state.chat_history = []
             st.session_state.messages = []
+            st.session_state.conversation_window.reset()
             
             # Construir prompt inicial con memoria del usuario
             rebuild_system_prompt()
@@ -188,6 +292,11 @@ def main():
     # Sidebar con métricas y usuario
     stats = st.session_state.db_manager.get_system_stats()
     render_metrics_sidebar(stats)
+    db_report = st.session_state.db_manager.get_instrumentation_report()
+    if db_report is not None:
+        render_database_metrics_sidebar(db_report)
+    render_prompt_cache_sidebar(get_prompt_cache().stats())
+    render_llm_usage_sidebar(st.session_state.llm_config.get_usage_report())
     render_user_info_sidebar(st.session_state.user_id)
     render_info_sidebar()
     
@@ -0,0 +1,85 @@
+"""
+Script de retención de datos
+Aplica la política de retención (antigüedad y límites de memorias y
+reglas) en una sola pasada y libera el espacio del archivo. La
+aplicación hace lo mismo en segundo plano si la política está
+configurada por variables de entorno.
+"""
+
+import argparse
+import time
+
+from backend.utils.retention import RetentionPolicy, RetentionSweeper
+from backend.utils.storage import create_storage
+
+
+def main():
+    """
+    Ejecuta una pasada de retención.
+    """
+    env_policy = RetentionPolicy.from_env()
+
+    parser = argparse.ArgumentParser(description="Elimina memorias y reglas vencidas")
+    parser.add_argument('--memory-max-age-days', type=float, default=env_policy.memory_max_age_days,
+                        help="Eliminar memorias con más de N días")
+    parser.add_argument('--memory-max-per-user', type=int, default=env_policy.memory_max_per_user,
+                        help="Conservar solo las N memorias más recientes de cada usuario")
+    parser.add_argument('--rule-min-score', type=float, default=env_policy.rule_min_score,
+                        help="Eliminar reglas con validation_score menor a este valor")
+    parser.add_argument('--rule-max-age-days', type=float, default=env_policy.rule_max_age_days,
+                        help="...que además tengan más de N días")
+    parser.add_argument('--rule-min-age-days', type=float, default=env_policy.rule_min_age_days,
+                        help="No eliminar por score reglas con menos de N días")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="Filas por lote (cada lote es una transacción)")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="Convertir una BD antigua a auto_vacuum incremental (VACUUM completo)")
+    args = parser.parse_args()
+
+    policy = RetentionPolicy(
+        memory_max_age_days=args.memory_max_age_days,
+        memory_max_per_user=args.memory_max_per_user,
+        rule_min_score=args.rule_min_score,
+        rule_max_age_days=args.rule_max_age_days,
+        rule_min_age_days=args.rule_min_age_days,
+    )
+
+    print("\n" + "="*60)
+    print("RETENCIÓN DE MEMORIAS Y REGLAS")
+    print("="*60)
+    print(f"\n{policy}")
+
+    # Sin retention= el gestor arrancaría su propio barrido en segundo
+    # plano, que competiría con esta pasada por el bloqueo de escritura
+    db_manager = create_storage(retention=RetentionPolicy())
+
+    if args.enable_incremental_vacuum:
+        print("\n⚠️  Detén la aplicación antes de continuar: VACUUM bloquea la BD.")
+        if db_manager.enable_incremental_vacuum():
+            print("✓ auto_vacuum incremental activado")
+        else:
+            print("auto_vacuum incremental ya estaba activo")
+
+    if not policy.enabled:
+        print("\nNo hay límites configurados. No se eliminó nada.")
+        db_manager.close()
+        return
+
+    before = db_manager.get_system_stats()
+    start = time.perf_counter()
+    result = RetentionSweeper(db_manager, policy, batch_size=args.batch_size, pause=0).run_once()
+    elapsed = time.perf_counter() - start
+    after = db_manager.get_system_stats()
+    db_manager.close()
+
+    print()
+    for reason, count in result.items():
+        print(f"   {reason}: {count}")
+    print(f"\n   Reglas: {before['total_rules']} → {after['total_rules']}")
+    print(f"   Memorias: {before['total_memories']} → {after['total_memories']}")
+    print(f"   Tiempo: {elapsed:.1f} s")
+    print("\n✅ Retención aplicada")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,35 +3,42 @@ Agente Principal (Chatbot de Kavak)
 Responde preguntas de usuarios sobre Kavak
 """
 
-from typing import List
+import hashlib
+import heapq
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
 
+from ..utils.knowledge_base import KNOWLEDGE_HEADER, KnowledgeBase
+from ..utils.prompt_budget import PromptAssembler, PromptSection
+from ..utils.prompt_cache import PromptCache
+from ..utils.rule_usage import ActiveRuleSet
+from ..utils.text_search import BM25Index
+from ..utils.topic_router import TopicRouter
 
 
+# Variable de entorno con el número de reglas a inyectar (0 = todas)
+RULES_TOP_K_ENV_VAR = 'KAVAK_RULES_TOP_K'
+DEFAULT_RULES_TOP_K = 8
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Variable de entorno con la disposición del prompt ('default' o 'stable')
+PROMPT_LAYOUT_ENV_VAR = 'KAVAK_PROMPT_LAYOUT'
+PROMPT_LAYOUTS = ('default', 'stable')
 
 
 class MainAgent:
     """
     Agente Principal que responde preguntas usando el prompt base,
     reglas aprendidas y memoria del usuario.
+    
+    Con la disposición 'stable' el prompt va de lo más estable a lo menos
+    estable, para aprovechar la caché de prompts del proveedor (que reutiliza
+    el prefijo idéntico más largo): base, reglas fijas en orden de id,
+    memoria e historial. Lo que cambia en cada turno (las reglas y las
+    secciones de conocimiento elegidas para la pregunta y el resumen de la
+    conversación) va en un mensaje del sistema aparte, justo antes de la
+    última pregunta.
     """
     
     # Prompt base MÍNIMO - Los agentes Optimizer y Summarizer mejorarán el sistema
@@ -43,45 +50,261 @@ Tu trabajo es ayudar a los usuarios con sus preguntas sobre autos.
 
 Sé amigable y haz preguntas para entender mejor lo que necesitan."""
     
-    def __init__(self, llm: ChatOpenAI):
+    def __init__(self, llm: ChatOpenAI, rules_top_k: Optional[int] = None,
+                 assembler: Optional[PromptAssembler] = None,
+                 prompt_cache: Optional[PromptCache] = None,
+                 prompt_layout: Optional[str] = None,
+                 active_rules: Optional[ActiveRuleSet] = None,
+                 topic_router: Optional[TopicRouter] = None,
+                 knowledge_base: Optional[KnowledgeBase] = None):
         """
         Inicializa el Agente Principal.
         
         Args:
             llm: Instancia del LLM configurado
+            rules_top_k: Reglas a inyectar por pregunta, las más relevantes
+                (por defecto KAVAK_RULES_TOP_K o 8; 0 = todas)
+            assembler: Ensamblador con el presupuesto de tokens del prompt
+            prompt_cache: Caché de prompts (compartirla entre sesiones para
+                reutilizar los prompts ya construidos)
+            prompt_layout: 'default' o 'stable' (por defecto KAVAK_PROMPT_LAYOUT o 'default')
+            active_rules: Conjunto activo que limita las reglas candidatas
+                de build_user_prompt (None = todas las reglas)
+            topic_router: Enrutador por tema: solo compiten las reglas del
+                tema de la pregunta y un pequeño conjunto global
+            knowledge_base: Base de conocimiento: se inyectan las secciones
+                relevantes a la pregunta después del prompt base
         """
         self.llm = llm
+        self.assembler = assembler or PromptAssembler()
+        self.prompt_cache = prompt_cache or PromptCache()
+        if rules_top_k is None:
+            rules_top_k = int(os.getenv(RULES_TOP_K_ENV_VAR) or DEFAULT_RULES_TOP_K)
+        self.rules_top_k = rules_top_k
+        if prompt_layout is None:
+            prompt_layout = os.getenv(PROMPT_LAYOUT_ENV_VAR) or 'default'
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"prompt_layout debe ser uno de {PROMPT_LAYOUTS}")
+        self.prompt_layout = prompt_layout
+        self.active_rules = active_rules
+        self.topic_router = topic_router
+        self.knowledge_base = knowledge_base
+        
+        # Índice BM25 del último snapshot de reglas: (snapshot, índice)
+        self._rules_index = None
+        # Último prompt construido, sus secciones y las de cola, para recortarlo en respond
+        self._last_prompt: Optional[Tuple[str, List[PromptSection], List[PromptSection]]] = None
+        # Reporte del presupuesto de la última respuesta
+        self.last_prompt_report: Optional[Dict] = None
+        # IDs de las reglas del último prompt construido (para RuleUsageTracker)
+        self.last_rule_ids: Tuple[int, ...] = ()
+        # IDs de las secciones de conocimiento del último prompt construido
+        self.last_section_ids: Tuple[int, ...] = ()
     
-    def build_system_prompt(self, rules: str, memory: str) -> str:
+    def build_system_prompt(self, rules: Union[str, Sequence[Dict]], memory: str,
+                            query: Optional[str] = None) -> str:
         """
-        Construye el prompt del sistema combinando base, reglas y memoria.
+        Construye el prompt del sistema combinando base, conocimiento
+        relevante (con knowledge_base), reglas y memoria.
         
         Args:
-            rules: Reglas aprendidas de la BD
+            rules: Reglas aprendidas de la BD: el texto completo, o el
+                snapshot (get_rules_snapshot) para seleccionar las relevantes
             memory: Memoria del usuario
+            query: Último mensaje del usuario, para elegir las reglas y el conocimiento
         
         Returns:
             str: Prompt completo del sistema
         """
-        prompt = self.PROMPT_BASE
+        knowledge = self._retrieve_knowledge(query)
+        selected = False
+        self.last_rule_ids = ()
+        if not isinstance(rules, str):
+            positions = self._select_positions(rules, query)
+            selected = positions is not None
+            picked = self._pick(rules, positions)
+            self.last_rule_ids = tuple(rule['id'] for rule in picked if 'id' in rule)
+            rules = '\n'.join(rule['rule_text'] for rule in picked)
         
-        if rules:
-            prompt += f"\n\nREGLAS ADICIONALES:\n{rules}"
+        self._last_prompt = self._render(rules, memory, selected, knowledge)
+        return self._last_prompt[0]
+    
+    def build_user_prompt(self, db_manager, user_id: str, query: Optional[str] = None) -> str:
+        """
+        Igual que build_system_prompt, leyendo reglas y memoria del backend
+        a través de la caché de prompts. La clave es (hash del prompt base,
+        versión de las reglas, IDs de las reglas elegidas, secciones de
+        conocimiento elegidas, versión de la memoria del usuario): mientras
+        no cambien, el prompt no se vuelve a construir ni se vuelven a leer
+        las memorias. Con active_rules solo compiten las reglas del
+        conjunto activo.
+        
+        Args:
+            db_manager: Backend de almacenamiento
+            user_id: ID del usuario
+            query: Último mensaje del usuario, para elegir las reglas y el conocimiento
+        
+        Returns:
+            str: Prompt completo del sistema
+        """
+        # Versiones antes que los datos: una entrada nunca es más vieja que su clave
+        rules_version = db_manager.get_rules_version()
+        memory_version = db_manager.get_user_memory_version(user_id)
+        
+        snapshot = (self.active_rules.rules(db_manager) if self.active_rules is not None
+                    else db_manager.get_rules_snapshot())
+        positions = self._select_positions(snapshot, query)
+        picked = self._pick(snapshot, positions)
+        self.last_rule_ids = tuple(rule['id'] for rule in picked)
+        knowledge = self._retrieve_knowledge(query)
+        knowledge_key = ((self.knowledge_base.version, self.last_section_ids)
+                         if self.knowledge_base is not None else None)
         
+        # Sin memorias el prompt no depende del usuario y se comparte
+        memory_key = ('memory', user_id, memory_version) if memory_version else None
+        memory = (self.prompt_cache.get_or_build(memory_key, lambda: db_manager.get_user_memory(user_id))
+                  if memory_key else '')
+        
+        base_hash = hashlib.sha1(self.PROMPT_BASE.encode('utf-8')).hexdigest()
+        # IDs y no posiciones: el conjunto activo puede cambiar sin cambiar la versión
+        selected = positions is not None
+        prompt_key = ('prompt', self.prompt_layout, base_hash, rules_version, selected,
+                      self.last_rule_ids, knowledge_key, memory_key)
+        self._last_prompt = self.prompt_cache.get_or_build(prompt_key, lambda: self._render(
+            '\n'.join(rule['rule_text'] for rule in picked), memory, selected, knowledge
+        ))
+        return self._last_prompt[0]
+    
+    def _retrieve_knowledge(self, query: Optional[str]) -> List[str]:
+        """Texto de las secciones de conocimiento relevantes a la pregunta."""
+        self.last_section_ids = ()
+        if self.knowledge_base is None or not query:
+            return []
+        sections = self.knowledge_base.retrieve(query)
+        self.last_section_ids = tuple(section['id'] for section in sections)
+        return self.knowledge_base.render(sections)
+    
+    def _render(self, rules: str, memory: str, selected: bool = False,
+                knowledge: Sequence[str] = ()) -> Tuple[str, List[PromptSection], List[PromptSection]]:
+        """
+        Texto del prompt del sistema, sus secciones recortables
+        (conocimiento, reglas y memoria) y las secciones de cola
+        (disposición 'stable': el conocimiento y las reglas elegidos para
+        la pregunta, que cambian en cada turno).
+        """
+        sections, tail = [], []
+        if knowledge:
+            knowledge_section = PromptSection('knowledge', knowledge, header=KNOWLEDGE_HEADER)
+            (tail if self.prompt_layout == 'stable' else sections).append(knowledge_section)
+        if rules:
+            rules_section = PromptSection('rules', rules.split('\n'), header="REGLAS ADICIONALES:")
+            (tail if selected and self.prompt_layout == 'stable' else sections).append(rules_section)
         if memory:
-            prompt += f"\n\n{memory}"
+            header, _, body = memory.partition('\n')
+            if not header.endswith(':') or not body:
+                header, body = '', memory
+            sections.append(PromptSection('memory', body.split('\n'), header=header, keep_latest=True))
+        
+        prompt = '\n\n'.join([self.PROMPT_BASE] + [section.render(section.items) for section in sections])
+        return prompt, sections, tail
+    
+    def select_rules(self, rules: Sequence[Dict], query: Optional[str] = None) -> str:
+        """
+        Elige las rules_top_k reglas más relevantes para la pregunta
+        (BM25 sobre las raíces de rule_text, con un índice local que se
+        reconstruye solo cuando cambia el snapshot). Si la pregunta no
+        alcanza k reglas, se completa con las de mayor validation_score.
+        Las elegidas se devuelven en el orden del snapshot, para que el
+        prompt sea estable.
+        
+        Args:
+            rules: Snapshot de reglas (dicts con id, rule_text y validation_score)
+            query: Último mensaje del usuario (opcional)
         
-        return prompt
+        Returns:
+            str: Texto de las reglas elegidas, una por línea
+        """
+        positions = self._select_positions(rules, query)
+        return '\n'.join(rule['rule_text'] for rule in self._pick(rules, positions))
     
-    def respond(self, chat_history: List) -> str:
+    @staticmethod
+    def _pick(rules: Sequence[Dict], positions: Optional[Tuple[int, ...]]) -> Sequence[Dict]:
+        return rules if positions is None else [rules[position] for position in positions]
+    
+    def _select_positions(self, rules: Sequence[Dict], query: Optional[str]) -> Optional[Tuple[int, ...]]:
+        """
+        Posiciones en el snapshot de las reglas elegidas, ordenadas
+        (None = todas las reglas). Ver select_rules.
+        
+        Con topic_router, si la pregunta tiene tema compiten solo las
+        reglas de sus grupos (las rules_top_k más relevantes si son más)
+        y se agrega el conjunto global; sin tema se elige entre todas.
+        """
+        k = self.rules_top_k
+        routed = self.topic_router.route(rules, query) if self.topic_router is not None and query else None
+        if routed is not None:
+            bucket, global_positions = routed
+            if k and len(bucket) > k:
+                bucket = self._rank(rules, query, bucket, k)
+            return tuple(sorted(set(bucket).union(global_positions)))
+        
+        if not k or len(rules) <= k:
+            return None
+        return tuple(sorted(self._rank(rules, query, range(len(rules)), k)))
+    
+    def _rank(self, rules: Sequence[Dict], query: Optional[str],
+              candidates: Iterable[int], k: int) -> List[int]:
+        """
+        Las k posiciones candidatas más relevantes para la pregunta (BM25
+        sobre las raíces de rule_text); sin coincidencias, las de mayor
+        validation_score.
+        """
+        if self._rules_index is None or self._rules_index[0] is not rules:
+            index = BM25Index(
+                ((position, rule['rule_text']) for position, rule in enumerate(rules)), stemmed=True
+            )
+            self._rules_index = (rules, index)
+        index = self._rules_index[1]
+        
+        scores = index.scores(query) if query else {}
+        return heapq.nsmallest(k, candidates, key=lambda position: (
+            -scores.get(position, 0.0), -(rules[position]['validation_score'] or 0.0), position
+        ))
+    
+    def respond(self, chat_history: List, summary: Optional[str] = None) -> str:
         """
         Genera una respuesta a la pregunta del usuario.
+        El prompt se ajusta al presupuesto de tokens: si el prompt del
+        sistema es el último de build_system_prompt se recortan reglas y
+        memoria por separado; el historial antiguo se descarta primero.
+        Lo recortado queda en last_prompt_report.
+        Con la disposición 'stable', las reglas elegidas y el resumen van
+        en un mensaje del sistema antes de la última pregunta.
         
         Args:
-            chat_history: Historial de la conversación
+            chat_history: Historial de la conversación (o su ventana reciente)
+            summary: Resumen de los turnos anteriores a la ventana (ConversationWindow)
         
         Returns:
             str: Respuesta del agente
         """
-        response = self.llm.invoke(chat_history)
+        history = list(chat_history)
+        base, sections, tail = '', [], []
+        if history and isinstance(history[0], SystemMessage):
+            system = history.pop(0).content
+            if self._last_prompt is not None and self._last_prompt[0] == system:
+                base, sections, tail = self.PROMPT_BASE, self._last_prompt[1], self._last_prompt[2]
+            else:
+                base = system
+        if summary:
+            summary_section = PromptSection(
+                'summary', summary.split('\n'), header="RESUMEN DE LA CONVERSACIÓN HASTA AHORA:"
+            )
+            if self.prompt_layout == 'stable':
+                tail = list(tail) + [summary_section]
+            else:
+                sections = list(sections) + [summary_section]
+        
+        messages, self.last_prompt_report = self.assembler.assemble(base, sections, history, tail)
+        response = self.llm.invoke(messages)
         return response.content
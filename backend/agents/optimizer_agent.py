@@ -3,10 +3,12 @@ Agente Optimizador
 Analiza errores, categoriza y genera reglas de mejora validadas
 """
 
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
 
+from ..utils.prompt_budget import PromptAssembler
+
 
 class OptimizerAgent:
     """
@@ -14,14 +16,19 @@ class OptimizerAgent:
     y generar reglas de mejora validadas.
     """
     
-    def __init__(self, llm: ChatOpenAI):
+    # Tokens máximos de la pregunta y de la respuesta que se analizan
+    EXCERPT_MAX_TOKENS = 800
+    
+    def __init__(self, llm: ChatOpenAI, assembler: Optional[PromptAssembler] = None):
         """
         Inicializa el Agente Optimizador.
         
         Args:
             llm: Instancia del LLM configurado
+            assembler: Ensamblador con el presupuesto de tokens del prompt
         """
         self.llm = llm
+        self.assembler = assembler or PromptAssembler()
     
     def categorize_error(self, question: str, answer: str) -> str:
         """
@@ -181,6 +188,11 @@ Responde SOLO: "si" o "no"."""
         if not last_human_message or not last_ai_message:
             raise ValueError("No se pudo extraer la conversación para optimizar")
         
+        # Los prompts de análisis incluyen ambos textos: acotarlos al presupuesto
+        excerpt_tokens = min(self.EXCERPT_MAX_TOKENS, self.assembler.max_tokens // 4)
+        last_human_message = self.assembler.truncate(last_human_message, excerpt_tokens)
+        last_ai_message = self.assembler.truncate(last_ai_message, excerpt_tokens)
+        
         # PASO 1: Categorizar el error
         print("\n[Sistema: Analizando tipo de error...]")
         error_category = self.categorize_error(last_human_message, last_ai_message)
@@ -3,10 +3,12 @@ Agente Resumidor
 Genera resúmenes de conversaciones para memoria del usuario
 """
 
-from typing import List
+from typing import Dict, List, Optional
 from langchain.schema import SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 
+from ..utils.prompt_budget import TOKENS_PER_MESSAGE, TOKENS_PER_REPLY, PromptAssembler
+
 
 class SummarizerAgent:
     """
@@ -50,29 +52,68 @@ Malo: "Usuario busca auto."
 
 Genera el resumen COMPLETO:"""
     
-    def __init__(self, llm: ChatOpenAI):
+    CONSOLIDATION_PROMPT = """Eres un agente resumidor experto. Estas son memorias acumuladas de un mismo usuario, de la más antigua a la más reciente.
+
+Fusiónalas en UNA sola memoria que conserve TODA la información útil:
+- Necesidad principal y preferencias (tipo de vehículo, marcas, presupuesto, uso)
+- Temas sobre los que preguntó y dudas pendientes
+- Si algo cambió con el tiempo, conserva lo más reciente
+
+No repitas datos. Responde en 3-5 frases concisas pero COMPLETAS.
+
+MEMORIAS:
+{memories}
+
+Genera la memoria consolidada:"""
+    
+    ROLLING_PROMPT = """Eres un agente resumidor experto. Mantienes el resumen de una conversación en curso entre un usuario y el asistente de Kavak.
+
+RESUMEN ACTUAL:
+{summary}
+
+Actualiza el resumen con los turnos nuevos que siguen. Conserva:
+- Lo que busca el usuario y sus preferencias (vehículo, marcas, presupuesto, uso)
+- Datos concretos que ya se le dieron (precios, plazos, tasas, requisitos)
+- Preguntas pendientes o compromisos del asistente
+
+Si algo cambió, conserva lo más reciente. Responde SOLO con el resumen actualizado, en 3-6 frases concisas.
+
+Resumen actualizado:"""
+    
+    def __init__(self, llm: ChatOpenAI, assembler: Optional[PromptAssembler] = None):
         """
         Inicializa el Agente Resumidor.
         
         Args:
             llm: Instancia del LLM configurado
+            assembler: Ensamblador con el presupuesto de tokens del prompt
         """
         self.llm = llm
+        self.assembler = assembler or PromptAssembler()
+        # Reporte del presupuesto del último resumen
+        self.last_prompt_report: Optional[Dict] = None
     
     def summarize_conversation(self, chat_history: List) -> str:
         """
         Resume la conversación en una frase concisa.
         
+        Solo se resumen los turnos del usuario y del asistente: los
+        SystemMessage del historial (el prompt del chatbot, que ya incluye
+        reglas, conocimiento y las memorias anteriores del usuario) se
+        descartan, así cada memoria nueva no copia las anteriores ni el
+        catálogo. Si la conversación no cabe se descartan los turnos antiguos.
+        
         Args:
             chat_history: Historial completo de la conversación
         
         Returns:
             str: Resumen conciso de la conversación
         """
-        # Preparar mensajes para el LLM
-        messages_for_summary = [
-            SystemMessage(content=self.MEMORY_PROMPT)
-        ] + chat_history
+        # Preparar mensajes para el LLM sin el prompt del chatbot
+        turns = [message for message in chat_history if not isinstance(message, SystemMessage)]
+        messages_for_summary, self.last_prompt_report = self.assembler.assemble(
+            self.MEMORY_PROMPT, history=turns
+        )
         
         # Generar resumen
         response = self.llm.invoke(messages_for_summary)
@@ -80,6 +121,65 @@ Genera el resumen COMPLETO:"""
         
         return summary_text
     
+    def consolidate_memories(self, memories: List[str]) -> str:
+        """
+        Fusiona varias memorias del usuario en una sola.
+        Si no caben todas en el presupuesto del ensamblador se fusionan por
+        tandas, en orden: cada tanda parte de la memoria consolidada de la
+        anterior. Una memoria que sola no cabe se recorta.
+        
+        Args:
+            memories: Memorias en orden cronológico
+        
+        Returns:
+            str: Memoria consolidada
+        """
+        counter = self.assembler.counter
+        budget = (self.assembler.max_tokens - TOKENS_PER_REPLY - TOKENS_PER_MESSAGE
+                  - counter.count(self.CONSOLIDATION_PROMPT.format(memories='')))
+        items = [f"- {memory}" for memory in memories]
+        
+        consolidated = None
+        position = 0
+        while consolidated is None or position < len(items):
+            batch = [] if consolidated is None else [f"- {consolidated}"]
+            used = sum(counter.count(item) + 1 for item in batch)
+            while position < len(items):
+                item = items[position]
+                tokens = counter.count(item) + 1  # salto de línea
+                if used + tokens > budget:
+                    if len(batch) > (0 if consolidated is None else 1):
+                        break
+                    item = counter.truncate(item, max(budget - used - 1, 1))
+                    tokens = counter.count(item) + 1
+                batch.append(item)
+                used += tokens
+                position += 1
+            
+            response = self.llm.invoke([
+                HumanMessage(content=self.CONSOLIDATION_PROMPT.format(memories='\n'.join(batch)))
+            ])
+            consolidated = response.content.strip()
+        return consolidated
+    
+    def update_conversation_summary(self, summary: str, messages: List) -> str:
+        """
+        Incorpora turnos nuevos al resumen acumulado de la conversación.
+        
+        Args:
+            summary: Resumen actual (vacío al principio)
+            messages: Turnos que salen de la ventana de historial, en orden
+        
+        Returns:
+            str: Resumen actualizado
+        """
+        prompt = self.ROLLING_PROMPT.format(summary=summary or "(todavía no hay resumen)")
+        turns = [message for message in messages if not isinstance(message, SystemMessage)]
+        messages_for_summary, _ = self.assembler.assemble(prompt, history=turns)
+        
+        response = self.llm.invoke(messages_for_summary)
+        return response.content.strip()
+    
     def extract_key_interests(self, chat_history: List) -> List[str]:
         """
         Extrae los intereses clave de la conversación.
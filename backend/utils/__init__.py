@@ -3,8 +3,27 @@ Módulo de Utilidades
 Contiene funciones auxiliares para database, métricas y configuración
 """
 
+from .storage import StorageBackend, create_storage
 from .database import DatabaseManager
+from .memory_storage import InMemoryStorage
+from .sharding import ShardedDatabaseManager
 from .metrics import MetricsCalculator
 from .llm_config import LLMConfig
+from .llm_cache import ResponseCache
+from .memory_compaction import MemoryCompactor
+from .retention import RetentionPolicy
+from .prompt_budget import PromptAssembler
+from .conversation_window import ConversationWindow
+from .prompt_cache import PromptCache
+from .rule_consolidation import RuleConsolidator
+from .rule_usage import ActiveRuleSet, RuleUsageTracker
+from .topic_router import TopicClassifier, TopicRouter
+from .knowledge_base import KnowledgeBase
 
-__all__ = ['DatabaseManager', 'MetricsCalculator', 'LLMConfig']
+__all__ = [
+    'StorageBackend', 'create_storage', 'DatabaseManager', 'InMemoryStorage',
+    'ShardedDatabaseManager', 'MetricsCalculator', 'LLMConfig', 'MemoryCompactor',
+    'RetentionPolicy', 'PromptAssembler', 'ConversationWindow',
+    'PromptCache', 'RuleConsolidator', 'ActiveRuleSet', 'RuleUsageTracker',
+    'TopicClassifier', 'TopicRouter', 'KnowledgeBase', 'ResponseCache'
+]
@@ -0,0 +1,192 @@
+"""
+Ventana de Historial de la Conversación
+Conserva textuales los últimos turnos y resume los anteriores en un
+resumen acumulado, que se actualiza en segundo plano fuera del flujo
+del chat. Así el contexto de cada respuesta deja de crecer con la sesión.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from langchain.schema import HumanMessage, SystemMessage
+
+
+# Variable de entorno con los turnos que se envían textuales (0 = historial completo)
+HISTORY_WINDOW_ENV_VAR = 'KAVAK_HISTORY_WINDOW_TURNS'
+DEFAULT_HISTORY_WINDOW_TURNS = 6
+
+
+class ConversationWindow:
+    """
+    Historial en ventana de una conversación: los últimos window_turns
+    turnos (pregunta + respuesta) van textuales y los anteriores se
+    incorporan al resumen con SummarizerAgent.update_conversation_summary.
+
+    El resumen se actualiza en un hilo aparte; mientras una actualización
+    está en curso, los turnos que aún no entraron al resumen siguen
+    enviándose textuales, de modo que nunca se pierde contexto.
+    """
+
+    def __init__(self, summarizer_agent, window_turns: Optional[int] = None,
+                 background: bool = True):
+        """
+        Inicializa la ventana.
+
+        Args:
+            summarizer_agent: Instancia de SummarizerAgent
+            window_turns: Turnos textuales (por defecto KAVAK_HISTORY_WINDOW_TURNS o 6;
+                0 = sin ventana, se envía todo el historial)
+            background: Resumir en un hilo aparte (False = en la misma llamada)
+        """
+        if window_turns is None:
+            window_turns = int(os.getenv(HISTORY_WINDOW_ENV_VAR) or DEFAULT_HISTORY_WINDOW_TURNS)
+        if window_turns < 0:
+            raise ValueError("window_turns no puede ser negativo")
+
+        self.summarizer_agent = summarizer_agent
+        self.window_turns = window_turns
+        self.background = background
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Optional[Future] = None
+
+        # Resumen de los primeros _summarized mensajes (sin el prompt del sistema)
+        self.summary = ''
+        self._summarized = 0
+        # Cambia en cada reinicio, para descartar resúmenes de la conversación anterior
+        self._generation = 0
+        # Actualizaciones del resumen realizadas
+        self.updates = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_turns > 0
+
+    @staticmethod
+    def _split(chat_history: List) -> Tuple[List, List]:
+        """Separa el prompt del sistema (si lo hay) de los turnos."""
+        if chat_history and isinstance(chat_history[0], SystemMessage):
+            return list(chat_history[:1]), list(chat_history[1:])
+        return [], list(chat_history)
+
+    def _window_start(self, turns: List) -> int:
+        """Índice del primer mensaje de los últimos window_turns turnos."""
+        seen = 0
+        for i in range(len(turns) - 1, -1, -1):
+            if isinstance(turns[i], HumanMessage):
+                seen += 1
+                if seen == self.window_turns:
+                    return i
+        return 0
+
+    def view(self, chat_history: List) -> Tuple[List, str]:
+        """
+        Historial a enviar al Agente Principal.
+
+        Args:
+            chat_history: Historial completo de la conversación
+
+        Returns:
+            Tuple[List, str]: Prompt del sistema + turnos textuales, y el
+                resumen de los turnos anteriores (vacío si no hay)
+        """
+        if not self.enabled:
+            return list(chat_history), ''
+
+        system, turns = self._split(chat_history)
+        with self._lock:
+            summary, summarized = self.summary, self._summarized
+        if summarized > len(turns):
+            # El historial se reinició sin llamar a reset()
+            return system + turns, ''
+
+        start = min(self._window_start(turns), summarized)
+        return system + turns[start:], summary
+
+    def update(self, chat_history: List) -> Optional[Future]:
+        """
+        Incorpora al resumen los turnos que salieron de la ventana.
+        Se llama después de añadir la respuesta del bot; si ya hay una
+        actualización en curso no hace nada (la siguiente recoge todo lo
+        pendiente de una vez).
+
+        Args:
+            chat_history: Historial completo de la conversación
+
+        Returns:
+            Future: Actualización en curso, o None si no hizo falta
+        """
+        if not self.enabled:
+            return None
+
+        _, turns = self._split(chat_history)
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return None
+            if self._summarized > len(turns):
+                self._clear()
+
+            end = self._window_start(turns)
+            if end <= self._summarized:
+                return None
+            summary, generation = self.summary, self._generation
+            new_turns = turns[self._summarized:end]
+
+            if self.background:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-summary')
+                self._pending = self._executor.submit(self._summarize, summary, new_turns, end, generation)
+                return self._pending
+
+        self._summarize(summary, new_turns, end, generation)
+        return None
+
+    def _summarize(self, summary: str, new_turns: List, end: int, generation: int):
+        """Genera el resumen nuevo y lo publica si nadie reinició la ventana."""
+        try:
+            updated = self.summarizer_agent.update_conversation_summary(summary, new_turns)
+        except Exception as e:
+            # Sin resumen nuevo, los turnos siguen yendo textuales
+            print(f"[Sistema: no se pudo actualizar el resumen de la conversación: {str(e)}]")
+            return
+
+        with self._lock:
+            if self._generation == generation:
+                self.summary, self._summarized = updated, end
+                self.updates += 1
+
+    def wait(self, timeout: float = None):
+        """
+        Espera a que termine la actualización en curso (si la hay).
+
+        Args:
+            timeout: Segundos máximos de espera (None = sin límite)
+        """
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout)
+
+    def reset(self):
+        """Olvida el resumen (nueva conversación)."""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.summary, self._summarized = '', 0
+        self._generation += 1
+
+    def shutdown(self, wait: bool = True):
+        """
+        Detiene el hilo de resúmenes.
+
+        Args:
+            wait: Esperar a que termine la actualización en curso
+        """
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -3,11 +3,39 @@ Gestor de Base de Datos
 Maneja todas las operaciones con SQLite
 """
 
+import atexit
+import gzip
+import itertools
+import json
+import os
 import sqlite3
-from typing import List, Dict, Tuple, Optional
+import threading
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Dict, Tuple, Optional
 
+from .db_instrumentation import (
+    INSTRUMENT_ENV_VAR, DatabaseInstrumentation, InstrumentedConnection, instrumented
+)
+from .retention import LEGACY_CREATED_AT, SWEEP_INTERVAL_ENV_VAR, RetentionPolicy, RetentionSweeper
+from .storage import StorageBackend
+from .text_search import search_terms
+from .write_queue import WriteBehindQueue
 
-class DatabaseManager:
+
+# Gestores vivos, para cerrar sus conexiones al terminar el proceso
+_OPEN_MANAGERS = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_managers():
+    """Cierra las conexiones de todos los gestores al salir del intérprete."""
+    for manager in list(_OPEN_MANAGERS):
+        manager.close()
+
+
+class DatabaseManager(StorageBackend):
     """
     Clase para gestionar todas las operaciones de base de datos.
     Implementa patrón Repository para abstraer el acceso a datos.
@@ -15,69 +43,691 @@ class DatabaseManager:
     
     DB_PATH = 'kavak_memory.db'
     
-    def __init__(self, db_path: str = None):
+    # PRAGMAs aplicados a cada conexión nueva
+    CONNECTION_PRAGMAS = (
+        # Solo tiene efecto al crear la BD: debe ir antes de journal_mode
+        ('auto_vacuum', 'INCREMENTAL'),
+        ('journal_mode', 'WAL'),       # Lectores no bloquean al escritor
+        ('synchronous', 'NORMAL'),     # Seguro con WAL, un fsync por checkpoint
+        ('cache_size', -8000),         # ~8 MB de caché de páginas
+        ('mmap_size', 67108864),       # 64 MB mapeados en memoria
+        ('busy_timeout', 5000),        # Esperar 5 s antes de "database is locked"
+        ('temp_store', 'MEMORY'),
+    )
+    
+    def __init__(self, db_path: str = None, persistent_connections: bool = True,
+                 write_behind: bool = False, instrument=None,
+                 retention: Optional[RetentionPolicy] = None):
         """
         Inicializa el gestor de base de datos.
         Crea las tablas automáticamente si no existen.
         
         Args:
             db_path: Ruta a la base de datos (opcional)
+            persistent_connections: Reutilizar una conexión por hilo (True)
+                o abrir y cerrar una conexión en cada llamada (False)
+            write_behind: Enviar las escrituras a un único hilo escritor
+                que las agrupa en transacciones (ver WriteBehindQueue)
+            instrument: Medir sentencias SQL y métodos (True, o una
+                DatabaseInstrumentation compartida). Por defecto según KAVAK_DB_INSTRUMENT
+            retention: Política de retención aplicada por un barrido en segundo
+                plano. Por defecto RetentionPolicy.from_env(); RetentionPolicy()
+                la desactiva
         """
         self.db_path = db_path or self.DB_PATH
+        self.persistent_connections = persistent_connections
+        self._local = threading.local()
+        self._connections: List[Tuple[threading.Thread, sqlite3.Connection]] = []
+        self._connections_lock = threading.Lock()
+        self._write_queue: Optional[WriteBehindQueue] = None
+        self._sweeper: Optional[RetentionSweeper] = None
+        # Snapshot en memoria de prompt_rules: (generación, filas, texto unido)
+        self._rules_snapshot: Optional[Tuple[int, Tuple[Dict, ...], str]] = None
+        self._rules_snapshot_lock = threading.Lock()
+        
+        if instrument is None:
+            instrument = os.getenv(INSTRUMENT_ENV_VAR, '').lower() in ('1', 'true')
+        if isinstance(instrument, DatabaseInstrumentation):
+            self.instrumentation: Optional[DatabaseInstrumentation] = instrument
+        else:
+            self.instrumentation = DatabaseInstrumentation() if instrument else None
+        
+        _OPEN_MANAGERS.add(self)
         self._initialize_database()
+        self.fts_enabled = self._table_exists('prompt_rules_fts')
+        
+        if write_behind:
+            self._write_queue = WriteBehindQueue(self._open_connection)
+        
+        self.retention = retention if retention is not None else RetentionPolicy.from_env()
+        if self.retention.enabled:
+            interval = float(os.getenv(SWEEP_INTERVAL_ENV_VAR) or 300)
+            self._sweeper = RetentionSweeper(self, interval=interval).start()
+    
+    def _open_connection(self) -> sqlite3.Connection:
+        """
+        Abre una conexión nueva con los PRAGMAs de rendimiento aplicados.
+        
+        Returns:
+            sqlite3.Connection: Conexión a la BD
+        """
+        # check_same_thread=False solo para poder cerrarla desde close();
+        # cada conexión la usa exclusivamente el hilo que la abrió
+        if self.instrumentation is not None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=InstrumentedConnection)
+            conn.instrumentation = self.instrumentation
+            self.instrumentation.connection_opened()
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma, value in self.CONNECTION_PRAGMAS:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
     
     def _get_connection(self) -> sqlite3.Connection:
         """
-        Obtiene una conexión a la base de datos.
+        Obtiene la conexión del hilo actual, abriéndola si no existe.
         
         Returns:
             sqlite3.Connection: Conexión a la BD
         """
-        return sqlite3.connect(self.db_path)
+        if not self.persistent_connections:
+            return self._open_connection()
+        
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+            with self._connections_lock:
+                # Cerrar conexiones de hilos que ya terminaron (reruns de Streamlit)
+                alive = []
+                for thread, thread_conn in self._connections:
+                    if thread.is_alive():
+                        alive.append((thread, thread_conn))
+                    else:
+                        thread_conn.close()
+                alive.append((threading.current_thread(), conn))
+                self._connections = alive
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """
+        Context manager para operaciones de lectura.
+        Cierra la conexión al salir solo si no es persistente.
+        """
+        conn = self._get_connection()
+        try:
+            yield conn
+        finally:
+            if not self.persistent_connections:
+                conn.close()
+    
+    @contextmanager
+    def _transaction(self):
+        """
+        Context manager para operaciones de escritura.
+        Hace commit al salir o rollback si ocurre una excepción.
+        """
+        with self._connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+    
+    def _write(self, operation: Callable[..., Any], *args) -> Any:
+        """
+        Ejecuta una operación de escritura y espera su resultado.
+        En modo write-behind pasa por el hilo escritor; si no, usa una
+        transacción propia en la conexión del hilo actual.
+        
+        Args:
+            operation: Función (conn, *args) que realiza la escritura
+            *args: Argumentos de la operación
+        
+        Returns:
+            Any: Resultado de la operación
+        """
+        if self._write_queue is not None:
+            return self._submit(operation, *args).result()
+        
+        with self._transaction() as conn:
+            return operation(conn, *args)
+    
+    def _submit(self, operation: Callable[..., Any], *args) -> Future:
+        """
+        Encola una operación de escritura sin esperar al commit.
+        Sin write-behind la ejecuta de inmediato y retorna un Future resuelto.
+        
+        Args:
+            operation: Función (conn, *args) que realiza la escritura
+            *args: Argumentos de la operación
+        
+        Returns:
+            Future: Resultado de la operación
+        """
+        if self._write_queue is not None:
+            if self.instrumentation is None:
+                return self._write_queue.submit(lambda conn: operation(conn, *args))
+            
+            # Atribuir las sentencias del hilo escritor al método que las encoló
+            method_name = self.instrumentation.current_method()
+            
+            def attributed_operation(conn: sqlite3.Connection) -> Any:
+                with self.instrumentation.attribute_to(method_name):
+                    return operation(conn, *args)
+            
+            return self._write_queue.submit(attributed_operation)
+        
+        future = Future()
+        try:
+            future.set_result(self._write(operation, *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def flush(self):
+        """
+        Espera a que se confirmen todas las escrituras encoladas.
+        No hace nada si el modo write-behind está desactivado.
+        """
+        if self._write_queue is not None:
+            self._write_queue.flush()
+    
+    def close(self):
+        """
+        Detiene el barrido de retención, vacía la cola de escritura (si
+        existe) y cierra todas las conexiones abiertas por el gestor.
+        Se invoca automáticamente al terminar el proceso.
+        """
+        if self._sweeper is not None:
+            self._sweeper.stop()
+        if self._write_queue is not None:
+            self._write_queue.close()
+        
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+        for _, conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        self._local = threading.local()
+    
+    def __enter__(self) -> 'DatabaseManager':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
     
     def _initialize_database(self):
         """
         Crea las tablas si no existen.
         Se ejecuta automáticamente al instanciar DatabaseManager.
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Crear tabla de usuarios
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Crear tabla user_memory
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_memory (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
+                )
+            ''')
+            
+            # Crear tabla prompt_rules con categorización de errores
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prompt_rules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    rule_text TEXT NOT NULL,
+                    error_category TEXT DEFAULT 'general',
+                    validation_score REAL DEFAULT 0.0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
         
-        # Crear tabla de usuarios
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                username TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+        self._apply_migrations()
+    
+    # ==================== MIGRACIONES ====================
+    
+    # Migraciones en orden; la posición i (base 1) es la versión del esquema
+    # que deja aplicada. El número se guarda en PRAGMA user_version.
+    SCHEMA_MIGRATIONS = (
+        '_migrate_v1_indexes',
+        '_migrate_v2_rule_content_hash',
+        '_migrate_v3_system_counters',
+        '_migrate_v4_rules_generation',
+        '_migrate_v5_full_text_search',
+        '_migrate_v6_memory_archive',
+        '_migrate_v7_retention',
+        '_migrate_v8_memory_versions',
+        '_migrate_v9_rule_archive',
+        '_migrate_v10_rule_usage',
+    )
+    
+    def get_schema_version(self) -> int:
+        """
+        Obtiene la versión actual del esquema.
+        
+        Returns:
+            int: Valor de PRAGMA user_version
+        """
+        with self._connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    def _apply_migrations(self):
+        """
+        Aplica las migraciones pendientes sobre la BD existente.
+        Cada migración corre en su propia transacción junto con el cambio
+        de user_version, así una BD nunca queda a medio migrar.
+        """
+        target_version = len(self.SCHEMA_MIGRATIONS)
+        if self.get_schema_version() >= target_version:
+            return
+        
+        with self._connection() as conn:
+            for version, method_name in enumerate(self.SCHEMA_MIGRATIONS, start=1):
+                # BEGIN IMMEDIATE evita que dos procesos migren a la vez
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    current = conn.execute('PRAGMA user_version').fetchone()[0]
+                    if current >= version:
+                        conn.rollback()
+                        continue
+                    getattr(self, method_name)(conn)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+    
+    def _migrate_v1_indexes(self, conn: sqlite3.Connection):
+        """
+        v1: Índices secundarios para las consultas por usuario y categoría.
+        """
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_user_memory_user_id '
+            'ON user_memory(user_id, id)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_prompt_rules_category '
+            'ON prompt_rules(error_category)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_prompt_rules_score '
+            'ON prompt_rules(validation_score)'
+        )
+    
+    def _migrate_v2_rule_content_hash(self, conn: sqlite3.Connection):
+        """
+        v2: Hash de contenido normalizado en prompt_rules con índice UNIQUE.
+        Las reglas duplicadas existentes se eliminan conservando la más antigua.
+        """
+        conn.execute('ALTER TABLE prompt_rules ADD COLUMN content_hash TEXT')
+        
+        rows = conn.execute('SELECT id, rule_text FROM prompt_rules ORDER BY id ASC').fetchall()
+        seen = set()
+        duplicate_ids = []
+        updates = []
+        for rule_id, rule_text in rows:
+            content_hash = self.rule_content_hash(rule_text)
+            if content_hash in seen:
+                duplicate_ids.append((rule_id,))
+            else:
+                seen.add(content_hash)
+                updates.append((content_hash, rule_id))
+        
+        conn.executemany('DELETE FROM prompt_rules WHERE id = ?', duplicate_ids)
+        conn.executemany('UPDATE prompt_rules SET content_hash = ? WHERE id = ?', updates)
+        conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_prompt_rules_content_hash '
+            'ON prompt_rules(content_hash)'
+        )
+    
+    # Triggers que mantienen system_counters al día en cada escritura,
+    # incluidas las que no pasan por DatabaseManager
+    COUNTER_TRIGGERS = (
+        '''CREATE TRIGGER IF NOT EXISTS trg_users_count_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE system_counters SET value = value + 1 WHERE name = 'total_users';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_users_count_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE system_counters SET value = value - 1 WHERE name = 'total_users';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_memory_count_insert AFTER INSERT ON user_memory
+        BEGIN
+            UPDATE system_counters SET value = value + 1 WHERE name = 'total_memories';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_memory_count_delete AFTER DELETE ON user_memory
+        BEGIN
+            UPDATE system_counters SET value = value - 1 WHERE name = 'total_memories';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_prompt_rules_count_insert AFTER INSERT ON prompt_rules
+        BEGIN
+            UPDATE system_counters SET value = value + 1 WHERE name = 'total_rules';
+            INSERT INTO system_counters (name, value)
+                SELECT 'category:' || NEW.error_category, 1 WHERE NEW.error_category IS NOT NULL
+                ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            UPDATE system_counters SET value = value + NEW.validation_score
+                WHERE name = 'validation_score_sum' AND NEW.validation_score > 0;
+            UPDATE system_counters SET value = value + 1
+                WHERE name = 'validation_score_count' AND NEW.validation_score > 0;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_prompt_rules_count_delete AFTER DELETE ON prompt_rules
+        BEGIN
+            UPDATE system_counters SET value = value - 1 WHERE name = 'total_rules';
+            UPDATE system_counters SET value = value - 1
+                WHERE name = 'category:' || OLD.error_category;
+            UPDATE system_counters SET value = value - OLD.validation_score
+                WHERE name = 'validation_score_sum' AND OLD.validation_score > 0;
+            UPDATE system_counters SET value = value - 1
+                WHERE name = 'validation_score_count' AND OLD.validation_score > 0;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_prompt_rules_count_update
+        AFTER UPDATE OF error_category, validation_score ON prompt_rules
+        BEGIN
+            UPDATE system_counters SET value = value - 1
+                WHERE name = 'category:' || OLD.error_category;
+            INSERT INTO system_counters (name, value)
+                SELECT 'category:' || NEW.error_category, 1 WHERE NEW.error_category IS NOT NULL
+                ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            UPDATE system_counters SET value = value - OLD.validation_score
+                WHERE name = 'validation_score_sum' AND OLD.validation_score > 0;
+            UPDATE system_counters SET value = value - 1
+                WHERE name = 'validation_score_count' AND OLD.validation_score > 0;
+            UPDATE system_counters SET value = value + NEW.validation_score
+                WHERE name = 'validation_score_sum' AND NEW.validation_score > 0;
+            UPDATE system_counters SET value = value + 1
+                WHERE name = 'validation_score_count' AND NEW.validation_score > 0;
+        END''',
+    )
+    
+    def _migrate_v3_system_counters(self, conn: sqlite3.Connection):
+        """
+        v3: Tabla system_counters mantenida por triggers, para que
+        get_system_stats sea una sola lectura. Se inicializa con los
+        agregados actuales.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS system_counters (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        self._rebuild_counters(conn)
+        
+        for trigger_sql in self.COUNTER_TRIGGERS:
+            conn.execute(trigger_sql)
+    
+    @staticmethod
+    def _rebuild_counters(conn: sqlite3.Connection):
+        """
+        Recalcula los contadores agregados de system_counters a partir de
+        las tablas. No toca rules_generation ni la distribución de fragmentos.
+        """
+        conn.execute('''
+            DELETE FROM system_counters
+            WHERE name IN ('total_rules', 'total_users', 'total_memories',
+                           'validation_score_sum', 'validation_score_count')
+               OR name LIKE 'category:%'
+        ''')
+        conn.execute('''
+            INSERT INTO system_counters (name, value)
+            SELECT 'total_rules', COUNT(*) FROM prompt_rules
+            UNION ALL SELECT 'total_users', COUNT(*) FROM users
+            UNION ALL SELECT 'total_memories', COUNT(*) FROM user_memory
+            UNION ALL SELECT 'validation_score_sum', COALESCE(SUM(validation_score), 0)
+                FROM prompt_rules WHERE validation_score > 0
+            UNION ALL SELECT 'validation_score_count', COUNT(*)
+                FROM prompt_rules WHERE validation_score > 0
         ''')
+        conn.execute('''
+            INSERT INTO system_counters (name, value)
+            SELECT 'category:' || error_category, COUNT(*)
+            FROM prompt_rules
+            WHERE error_category IS NOT NULL
+            GROUP BY error_category
+        ''')
+    
+    def _migrate_v4_rules_generation(self, conn: sqlite3.Connection):
+        """
+        v4: Contador de generación de prompt_rules, incrementado por triggers
+        en cada cambio. Permite saber si el snapshot en memoria sigue vigente,
+        incluso si escribió otra conexión u otro proceso.
+        """
+        conn.execute(
+            "INSERT OR IGNORE INTO system_counters (name, value) VALUES ('rules_generation', 0)"
+        )
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_prompt_rules_generation_{event.lower()}
+                AFTER {event} ON prompt_rules
+                BEGIN
+                    UPDATE system_counters SET value = value + 1 WHERE name = 'rules_generation';
+                END
+            ''')
+    
+    # Tablas FTS5 de contenido externo: (tabla fts, tabla origen, columnas indexadas)
+    FTS_TABLES = (
+        ('prompt_rules_fts', 'prompt_rules', ('rule_text',)),
+        ('user_memory_fts', 'user_memory', ('context', 'user_id')),
+    )
+    
+    def _migrate_v5_full_text_search(self, conn: sqlite3.Connection):
+        """
+        v5: Índices FTS5 sobre prompt_rules.rule_text y user_memory.context,
+        sincronizados por triggers. Si SQLite no trae FTS5 se omite y las
+        búsquedas usan LIKE.
+        """
+        try:
+            conn.execute('CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)')
+            conn.execute('DROP TABLE temp._fts5_probe')
+        except sqlite3.OperationalError:
+            return
         
-        # Crear tabla user_memory
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+        for fts_table, source_table, columns in self.FTS_TABLES:
+            names = list(columns)
+            new_values = ', '.join(f'NEW.{name}' for name in names)
+            old_values = ', '.join(f'OLD.{name}' for name in names)
+            name_list = ', '.join(names)
+            
+            conn.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                    {', '.join(columns)},
+                    content='{source_table}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_insert AFTER INSERT ON {source_table}
+                BEGIN
+                    INSERT INTO {fts_table} (rowid, {name_list}) VALUES (NEW.id, {new_values});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_delete AFTER DELETE ON {source_table}
+                BEGIN
+                    INSERT INTO {fts_table} ({fts_table}, rowid, {name_list})
+                    VALUES ('delete', OLD.id, {old_values});
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_update AFTER UPDATE ON {source_table}
+                BEGIN
+                    INSERT INTO {fts_table} ({fts_table}, rowid, {name_list})
+                    VALUES ('delete', OLD.id, {old_values});
+                    INSERT INTO {fts_table} (rowid, {name_list}) VALUES (NEW.id, {new_values});
+                END
+            ''')
+            # Indexar las filas que ya existían
+            conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    
+    def _migrate_v6_memory_archive(self, conn: sqlite3.Connection):
+        """
+        v6: Archivo de memorias originales que la compactación consolidó.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_memory_archive (
+                id INTEGER PRIMARY KEY,
                 user_id TEXT NOT NULL,
                 context TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
+                consolidated_into INTEGER NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_user_memory_archive_user_id '
+            'ON user_memory_archive(user_id, id)'
+        )
+    
+    def _migrate_v7_retention(self, conn: sqlite3.Connection):
+        """
+        v7: Fecha de creación en user_memory e índices por antigüedad para
+        el barrido de retención. Las memorias existentes no tienen fecha
+        conocida y reciben LEGACY_CREATED_AT (las más antiguas para la retención).
+        El trigger FTS de UPDATE pasa a dispararse solo si cambia el texto
+        indexado, así fechar (o reescribir created_at) no reindexa.
+        """
+        conn.execute('ALTER TABLE user_memory ADD COLUMN created_at TIMESTAMP')
+        
+        has_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_memory_fts'"
+        ).fetchone() is not None
+        if has_fts:
+            conn.execute('DROP TRIGGER IF EXISTS trg_user_memory_fts_update')
+            conn.execute('''
+                CREATE TRIGGER trg_user_memory_fts_update
+                AFTER UPDATE OF context, user_id ON user_memory
+                BEGIN
+                    INSERT INTO user_memory_fts (user_memory_fts, rowid, context, user_id)
+                    VALUES ('delete', OLD.id, OLD.context, OLD.user_id);
+                    INSERT INTO user_memory_fts (rowid, context, user_id)
+                    VALUES (NEW.id, NEW.context, NEW.user_id);
+                END
+            ''')
+        
+        conn.execute('UPDATE user_memory SET created_at = ?', (LEGACY_CREATED_AT,))
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_user_memory_created_at '
+            'ON user_memory(created_at)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_user_memory_archive_archived_at '
+            'ON user_memory_archive(archived_at)'
+        )
+    
+    def _migrate_v8_memory_versions(self, conn: sqlite3.Connection):
+        """
+        v8: Versión de la memoria de cada usuario, incrementada por triggers
+        en cada cambio de user_memory. Permite cachear el prompt del sistema
+        sin volver a leer las memorias mientras no cambien.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_memory_versions (
+                user_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO user_memory_versions (user_id, version)
+            SELECT DISTINCT user_id, 1 FROM user_memory
+        ''')
         
-        # Crear tabla prompt_rules con categorización de errores
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS prompt_rules (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bump = '''
+            INSERT INTO user_memory_versions (user_id, version) VALUES ({row}.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+        '''
+        for event, rows in (('INSERT', ('NEW',)), ('DELETE', ('OLD',)),
+                            ('UPDATE OF context, user_id', ('OLD', 'NEW'))):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_user_memory_version_{event.split()[0].lower()}
+                AFTER {event} ON user_memory
+                BEGIN
+                    {''.join(bump.format(row=row) for row in rows)}
+                END
+            ''')
+    
+    def _migrate_v9_rule_archive(self, conn: sqlite3.Connection):
+        """
+        v9: Archivo de reglas casi duplicadas que la consolidación fusionó
+        en una regla canónica (procedencia de cada regla).
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS prompt_rules_archive (
+                id INTEGER PRIMARY KEY,
                 rule_text TEXT NOT NULL,
-                error_category TEXT DEFAULT 'general',
-                validation_score REAL DEFAULT 0.0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                error_category TEXT,
+                validation_score REAL,
+                created_at TIMESTAMP,
+                consolidated_into INTEGER NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_prompt_rules_archive_consolidated_into '
+            'ON prompt_rules_archive(consolidated_into)'
+        )
+    
+    def _migrate_v10_rule_usage(self, conn: sqlite3.Connection):
+        """
+        v10: Contadores de uso de cada regla (veces inyectada en el prompt
+        y feedback 👍/👎 de esas respuestas). Van en una tabla aparte para
+        no cambiar la generación de reglas (ni invalidar los prompts
+        cacheados) en cada turno. Un trigger los borra junto con la regla.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rule_usage (
+                rule_id INTEGER PRIMARY KEY,
+                injected INTEGER NOT NULL DEFAULT 0,
+                positive INTEGER NOT NULL DEFAULT 0,
+                negative INTEGER NOT NULL DEFAULT 0,
+                last_injected_at TIMESTAMP,
+                last_positive_at TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_prompt_rules_usage_delete
+            AFTER DELETE ON prompt_rules
+            BEGIN
+                DELETE FROM rule_usage WHERE rule_id = OLD.id;
+            END
+        ''')
+    
+    def _table_exists(self, table_name: str) -> bool:
+        """
+        Verifica si existe una tabla (o tabla virtual) en la BD.
+        
+        Args:
+            table_name: Nombre de la tabla
         
-        conn.commit()
-        conn.close()
+        Returns:
+            bool: True si existe
+        """
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (table_name,)
+            ).fetchone()
+        return row is not None
     
     # ==================== USUARIOS ====================
     
+    @instrumented
     def create_user(self, user_id: str, username: str) -> bool:
         """
         Crea un nuevo usuario en la base de datos.
@@ -90,21 +740,20 @@ class DatabaseManager:
             bool: True si se creó exitosamente, False si ya existe
         """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'INSERT INTO users (user_id, username) VALUES (?, ?)',
-                (user_id, username)
-            )
-            
-            conn.commit()
-            conn.close()
-            return True
+            return self._write(self._insert_user, user_id, username)
         except sqlite3.IntegrityError:
             # Usuario ya existe
             return False
     
+    @staticmethod
+    def _insert_user(conn: sqlite3.Connection, user_id: str, username: str) -> bool:
+        conn.execute(
+            'INSERT INTO users (user_id, username) VALUES (?, ?)',
+            (user_id, username)
+        )
+        return True
+    
+    @instrumented
     def user_exists(self, user_id: str) -> bool:
         """
         Verifica si un usuario existe en la base de datos.
@@ -115,18 +764,14 @@ class DatabaseManager:
         Returns:
             bool: True si existe, False si no
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT COUNT(*) FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        count = cursor.fetchone()[0]
-        
-        conn.close()
-        return count > 0
+        with self._connection() as conn:
+            cursor = conn.execute(
+                'SELECT 1 FROM users WHERE user_id = ?',
+                (user_id,)
+            )
+            return cursor.fetchone() is not None
     
+    @instrumented
     def get_username(self, user_id: str) -> Optional[str]:
         """
         Obtiene el nombre de usuario.
@@ -137,43 +782,118 @@ class DatabaseManager:
         Returns:
             str: Nombre del usuario o None si no existe
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT username FROM users WHERE user_id = ?',
-            (user_id,)
-        )
-        result = cursor.fetchone()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                'SELECT username FROM users WHERE user_id = ?',
+                (user_id,)
+            )
+            result = cursor.fetchone()
         
-        conn.close()
         return result[0] if result else None
     
     # ==================== REGLAS ====================
     
+    @instrumented
     def get_all_rules(self) -> str:
         """
         Obtiene todas las reglas de la base de datos.
+        Se sirven desde el snapshot en memoria mientras no cambien.
         
         Returns:
             str: Todas las reglas unidas por saltos de línea
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        return self._get_rules_snapshot()[2]
+    
+    @instrumented
+    def get_rules_version(self) -> int:
+        """
+        Obtiene la generación actual de prompt_rules.
+        Cambia cada vez que se inserta, modifica o elimina una regla.
+        
+        Returns:
+            int: Número de generación
+        """
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM system_counters WHERE name = 'rules_generation'"
+            ).fetchone()
+        return int(row[0]) if row else 0
+    
+    @instrumented
+    def get_rules_snapshot(self) -> Tuple[Dict, ...]:
+        """
+        Obtiene todas las reglas con sus metadatos desde el snapshot en memoria.
+        La tupla es compartida: no debe modificarse.
+        
+        Returns:
+            Tuple[Dict, ...]: Reglas con id, rule_text, error_category y validation_score
+        """
+        return self._get_rules_snapshot()[1]
+    
+    def _get_rules_snapshot(self) -> Tuple[int, Tuple[Dict, ...], str]:
+        """
+        Retorna el snapshot de reglas, recargándolo solo si la generación
+        guardada en la BD cambió desde la última lectura.
+        """
+        snapshot = self._rules_snapshot
+        if snapshot is not None and snapshot[0] == self.get_rules_version():
+            return snapshot
         
-        cursor.execute('SELECT rule_text FROM prompt_rules')
-        results = cursor.fetchall()
+        with self._rules_snapshot_lock:
+            with self._connection() as conn:
+                # Generación y filas en la misma transacción de lectura
+                conn.execute('BEGIN')
+                try:
+                    row = conn.execute(
+                        "SELECT value FROM system_counters WHERE name = 'rules_generation'"
+                    ).fetchone()
+                    generation = int(row[0]) if row else 0
+                    
+                    snapshot = self._rules_snapshot
+                    if snapshot is not None and snapshot[0] == generation:
+                        return snapshot
+                    
+                    rows = conn.execute(
+                        'SELECT id, rule_text, error_category, validation_score '
+                        'FROM prompt_rules ORDER BY id ASC'
+                    ).fetchall()
+                finally:
+                    conn.rollback()
+            
+            rules = tuple(
+                {'id': rule_id, 'rule_text': rule_text,
+                 'error_category': error_category, 'validation_score': validation_score}
+                for rule_id, rule_text, error_category, validation_score in rows
+            )
+            snapshot = (generation, rules, '\n'.join(rule['rule_text'] for rule in rules))
+            self._rules_snapshot = snapshot
         
-        conn.close()
+        return snapshot
+    
+    @instrumented
+    def rule_exists(self, rule_text: str) -> bool:
+        """
+        Verifica si ya existe una regla equivalente (mismo texto normalizado).
+        
+        Args:
+            rule_text: Texto de la regla
         
-        if results:
-            return '\n'.join([row[0] for row in results])
-        return ''
+        Returns:
+            bool: True si existe, False si no
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                'SELECT 1 FROM prompt_rules WHERE content_hash = ?',
+                (self.rule_content_hash(rule_text),)
+            )
+            return cursor.fetchone() is not None
     
+    @instrumented
     def save_rule(self, rule_text: str, error_category: str = 'general', 
                   validation_score: float = 0.0) -> int:
         """
         Guarda una nueva regla en la base de datos.
+        Si ya existe una regla equivalente no se duplica.
         
         Args:
             rule_text: Texto de la regla
@@ -181,22 +901,146 @@ class DatabaseManager:
             validation_score: Score de validación (0.0-1.0)
         
         Returns:
-            int: ID de la regla insertada
+            int: ID de la regla insertada (o de la existente si era duplicada)
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        return self._write(self._insert_rule, rule_text, error_category, validation_score)
+    
+    @instrumented
+    def save_rule_async(self, rule_text: str, error_category: str = 'general',
+                        validation_score: float = 0.0) -> Future:
+        """
+        Igual que save_rule, pero sin esperar al commit en modo write-behind.
+        
+        Returns:
+            Future: Se resuelve con el ID de la regla
+        """
+        return self._submit(self._insert_rule, rule_text, error_category, validation_score)
+    
+    def _insert_rule(self, conn: sqlite3.Connection, rule_text: str,
+                     error_category: str, validation_score: float) -> int:
+        content_hash = self.rule_content_hash(rule_text)
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO prompt_rules '
+            '(rule_text, error_category, validation_score, content_hash) VALUES (?, ?, ?, ?)',
+            (rule_text, error_category, validation_score, content_hash)
+        )
+        if cursor.rowcount:
+            return cursor.lastrowid
+        return conn.execute(
+            'SELECT id FROM prompt_rules WHERE content_hash = ?',
+            (content_hash,)
+        ).fetchone()[0]
+    
+    @instrumented
+    def save_rules_bulk(self, rules: List[Tuple[str, str, float]]) -> List[int]:
+        """
+        Guarda varias reglas en una sola transacción (un solo fsync).
+        Las reglas duplicadas se ignoran igual que en save_rule.
+        
+        Args:
+            rules: Lista de tuplas (rule_text, error_category, validation_score)
+        
+        Returns:
+            List[int]: IDs de las reglas, en el mismo orden que la entrada
+        """
+        if not rules:
+            return []
         
-        cursor.execute(
-            'INSERT INTO prompt_rules (rule_text, error_category, validation_score) VALUES (?, ?, ?)',
-            (rule_text, error_category, validation_score)
+        rows = [
+            (rule_text, error_category, validation_score, self.rule_content_hash(rule_text))
+            for rule_text, error_category, validation_score in rules
+        ]
+        return self._write(self._insert_rules, rows)
+    
+    @staticmethod
+    def _insert_rules(conn: sqlite3.Connection, rows: List[Tuple[str, str, float, str]]) -> List[int]:
+        conn.executemany(
+            'INSERT OR IGNORE INTO prompt_rules '
+            '(rule_text, error_category, validation_score, content_hash) VALUES (?, ?, ?, ?)',
+            rows
         )
+        hashes = list({row[3] for row in rows})
+        ids_by_hash = {}
+        # Resolver IDs por hash en lotes (límite de variables de SQLite)
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            ids_by_hash.update(conn.execute(
+                f'SELECT content_hash, id FROM prompt_rules WHERE content_hash IN ({placeholders})',
+                chunk
+            ).fetchall())
+        
+        return [ids_by_hash[row[3]] for row in rows]
+    
+    # Columnas por las que se puede paginar iter_rules (expresión SQL de orden)
+    RULE_ORDER_COLUMNS = {
+        'id': None,
+        'validation_score': 'COALESCE(validation_score, 0.0)',
+        'created_at': "COALESCE(created_at, '')",
+        'error_category': "COALESCE(error_category, '')",
+    }
+    
+    @instrumented
+    def iter_rules(self, batch_size: int = 100, order_by: str = 'id',
+                   descending: bool = False) -> Iterator[Dict]:
+        """
+        Recorre las reglas por páginas sin cargar toda la tabla en memoria.
+        Usa paginación por clave (keyset): cada página es una consulta
+        independiente, así el generador puede abandonarse en cualquier momento.
         
-        rule_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        Args:
+            batch_size: Filas leídas por página
+            order_by: Columna de orden ('id', 'validation_score', 'created_at', 'error_category')
+            descending: Orden descendente
         
-        return rule_id
+        Yields:
+            Dict: Regla con id, rule_text, error_category, validation_score y created_at
+        """
+        if order_by not in self.RULE_ORDER_COLUMNS:
+            raise ValueError(f"order_by inválido: {order_by}")
+        
+        sort_expr = self.RULE_ORDER_COLUMNS[order_by]
+        direction = 'DESC' if descending else 'ASC'
+        comparison = '<' if descending else '>'
+        select = (
+            'SELECT id, rule_text, error_category, validation_score, created_at'
+            + (f', {sort_expr}' if sort_expr else '')
+            + ' FROM prompt_rules'
+        )
+        order = f' ORDER BY {sort_expr} {direction}, id {direction}' if sort_expr else f' ORDER BY id {direction}'
+        
+        last_key = None
+        while True:
+            with self._connection() as conn:
+                if last_key is None:
+                    cursor = conn.execute(f'{select}{order} LIMIT ?', (batch_size,))
+                elif sort_expr:
+                    cursor = conn.execute(
+                        f'{select} WHERE ({sort_expr}, id) {comparison} (?, ?){order} LIMIT ?',
+                        (*last_key, batch_size)
+                    )
+                else:
+                    cursor = conn.execute(
+                        f'{select} WHERE id {comparison} ?{order} LIMIT ?',
+                        (last_key[0], batch_size)
+                    )
+                rows = cursor.fetchmany(batch_size)
+            
+            for row in rows:
+                yield {
+                    'id': row[0],
+                    'rule_text': row[1],
+                    'error_category': row[2],
+                    'validation_score': row[3],
+                    'created_at': row[4],
+                }
+            
+            if len(rows) < batch_size:
+                return
+            last = rows[-1]
+            last_key = (last[5], last[0]) if sort_expr else (last[0],)
     
+    @instrumented
     def get_rules_by_category(self, category: str) -> List[str]:
         """
         Obtiene reglas filtradas por categoría.
@@ -207,47 +1051,242 @@ class DatabaseManager:
         Returns:
             List[str]: Lista de reglas de esa categoría
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            results = conn.execute(
+                'SELECT rule_text FROM prompt_rules WHERE error_category = ?',
+                (category,)
+            ).fetchall()
+        
+        return [row[0] for row in results]
+    
+    @instrumented
+    def consolidate_rules(self, canonical_id: int, duplicate_ids: List[int]) -> int:
+        """
+        Fusiona reglas casi duplicadas en una regla canónica.
+        Las duplicadas se copian a prompt_rules_archive y se eliminan (junto
+        con su propia procedencia, que pasa a la canónica); la canónica
+        conserva su texto y toma el mayor validation_score del grupo.
+        
+        Args:
+            canonical_id: ID de la regla que se conserva
+            duplicate_ids: IDs de las reglas absorbidas
         
-        cursor.execute(
-            'SELECT rule_text FROM prompt_rules WHERE error_category = ?',
-            (category,)
+        Returns:
+            int: Reglas absorbidas
+        """
+        duplicate_ids = sorted(set(duplicate_ids) - {canonical_id})
+        if not duplicate_ids:
+            return 0
+        return self._write(self._consolidate_rules, canonical_id, duplicate_ids)
+    
+    @staticmethod
+    def _consolidate_rules(conn: sqlite3.Connection, canonical_id: int,
+                           duplicate_ids: List[int]) -> int:
+        placeholders = ', '.join('?' * len(duplicate_ids))
+        archived = conn.execute(
+            f'''
+            INSERT INTO prompt_rules_archive
+                (id, rule_text, error_category, validation_score, created_at, consolidated_into)
+            SELECT id, rule_text, error_category, validation_score, created_at, ?
+            FROM prompt_rules
+            WHERE id IN ({placeholders}) AND EXISTS (SELECT 1 FROM prompt_rules WHERE id = ?)
+            ''',
+            (canonical_id, *duplicate_ids, canonical_id)
+        ).rowcount
+        if archived != len(duplicate_ids):
+            # Otra consolidación se adelantó o alguna regla ya no existe
+            raise ValueError("Las reglas a consolidar cambiaron")
+        
+        best = conn.execute(
+            f'''
+            SELECT MAX(COALESCE(validation_score, 0.0)) FROM prompt_rules
+            WHERE id IN ({placeholders}) OR id = ?
+            ''',
+            (*duplicate_ids, canonical_id)
+        ).fetchone()[0]
+        # Lo que ya habían absorbido las duplicadas pasa a la canónica
+        conn.execute(
+            f'''
+            INSERT INTO rule_usage
+                (rule_id, injected, positive, negative, last_injected_at, last_positive_at)
+            SELECT ?, SUM(injected), SUM(positive), SUM(negative),
+                   MAX(last_injected_at), MAX(last_positive_at)
+            FROM rule_usage WHERE rule_id IN ({placeholders})
+            HAVING COUNT(*) > 0
+            ON CONFLICT(rule_id) DO UPDATE SET
+                injected = injected + excluded.injected,
+                positive = positive + excluded.positive,
+                negative = negative + excluded.negative,
+                last_injected_at = NULLIF(MAX(COALESCE(last_injected_at, ''), COALESCE(excluded.last_injected_at, '')), ''),
+                last_positive_at = NULLIF(MAX(COALESCE(last_positive_at, ''), COALESCE(excluded.last_positive_at, '')), '')
+            ''',
+            (canonical_id, *duplicate_ids)
+        )
+        conn.execute(
+            f'UPDATE prompt_rules_archive SET consolidated_into = ? WHERE consolidated_into IN ({placeholders})',
+            (canonical_id, *duplicate_ids)
         )
-        results = cursor.fetchall()
+        conn.execute(f'DELETE FROM prompt_rules WHERE id IN ({placeholders})', duplicate_ids)
+        # Los triggers mantienen los contadores y la generación de reglas
+        conn.execute(
+            'UPDATE prompt_rules SET validation_score = ? '
+            'WHERE id = ? AND COALESCE(validation_score, 0.0) < ?',
+            (best, canonical_id, best)
+        )
+        return archived
+    
+    @instrumented
+    def get_rule_provenance(self, rule_id: int) -> List[Dict]:
+        """
+        Obtiene las reglas que se consolidaron en una regla.
         
-        conn.close()
+        Args:
+            rule_id: ID de la regla canónica
         
-        return [row[0] for row in results]
+        Returns:
+            List[Dict]: Reglas archivadas con id, rule_text, error_category,
+                validation_score, created_at y archived_at
+        """
+        with self._connection() as conn:
+            rows = conn.execute('''
+                SELECT id, rule_text, error_category, validation_score, created_at, archived_at
+                FROM prompt_rules_archive
+                WHERE consolidated_into = ?
+                ORDER BY id
+            ''', (rule_id,)).fetchall()
+        
+        return [
+            {'id': row[0], 'rule_text': row[1], 'error_category': row[2],
+             'validation_score': row[3], 'created_at': row[4], 'archived_at': row[5]}
+            for row in rows
+        ]
+    
+    @instrumented
+    def record_rule_usage(self, deltas: List[Tuple[int, int, int, int]]):
+        """
+        Suma incrementos a los contadores de uso de las reglas, en una
+        sola transacción. Las reglas que ya no existen se ignoran.
+        
+        Args:
+            deltas: Tuplas (rule_id, inyecciones, feedback 👍, feedback 👎)
+        """
+        if deltas:
+            self._write(self._upsert_rule_usage, deltas)
+    
+    @staticmethod
+    def _upsert_rule_usage(conn: sqlite3.Connection, deltas: List[Tuple[int, int, int, int]]):
+        conn.executemany('''
+            INSERT INTO rule_usage
+                (rule_id, injected, positive, negative, last_injected_at, last_positive_at)
+            SELECT id, ?, ?, ?,
+                   CASE WHEN ? > 0 THEN CURRENT_TIMESTAMP END,
+                   CASE WHEN ? > 0 THEN CURRENT_TIMESTAMP END
+            FROM prompt_rules WHERE id = ?
+            ON CONFLICT(rule_id) DO UPDATE SET
+                injected = injected + excluded.injected,
+                positive = positive + excluded.positive,
+                negative = negative + excluded.negative,
+                last_injected_at = COALESCE(excluded.last_injected_at, last_injected_at),
+                last_positive_at = COALESCE(excluded.last_positive_at, last_positive_at)
+        ''', [
+            (injected, positive, negative, injected, positive, rule_id)
+            for rule_id, injected, positive, negative in deltas
+        ])
+    
+    @instrumented
+    def get_rule_usage(self) -> Dict[int, Dict]:
+        """
+        Obtiene la fecha de creación y los contadores de uso de todas las reglas.
+        
+        Returns:
+            Dict[int, Dict]: Por ID de regla: created_at, injected, positive,
+                negative, last_injected_at y last_positive_at
+        """
+        with self._connection() as conn:
+            rows = conn.execute('''
+                SELECT r.id, r.created_at, COALESCE(u.injected, 0), COALESCE(u.positive, 0),
+                       COALESCE(u.negative, 0), u.last_injected_at, u.last_positive_at
+                FROM prompt_rules r LEFT JOIN rule_usage u ON u.rule_id = r.id
+            ''').fetchall()
+        
+        return {
+            row[0]: {'created_at': row[1], 'injected': row[2], 'positive': row[3],
+                     'negative': row[4], 'last_injected_at': row[5], 'last_positive_at': row[6]}
+            for row in rows
+        }
     
     # ==================== MEMORIA ====================
     
-    def get_user_memory(self, user_id: str) -> str:
+    # Implementación heredada de StorageBackend, medida como el resto
+    get_user_memory = instrumented(StorageBackend.get_user_memory)
+    
+    @instrumented
+    def get_user_memory_version(self, user_id: str) -> int:
         """
-        Obtiene TODA la memoria histórica del usuario.
+        Obtiene la versión de la memoria del usuario.
+        Cambia cada vez que se inserta, modifica o elimina una de sus memorias.
         
         Args:
             user_id: ID del usuario
         
         Returns:
-            str: Memoria formateada del usuario
+            int: Número de versión (0 si nunca tuvo memorias)
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT version FROM user_memory_versions WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()
+        return row[0] if row else 0
+    
+    @instrumented
+    def iter_user_memory(self, user_id: str, limit: Optional[int] = None,
+                         newest_first: bool = False, batch_size: int = 100) -> Iterator[Dict]:
+        """
+        Recorre las memorias de un usuario por páginas (keyset sobre id,
+        usando el índice user_memory(user_id, id)).
         
-        cursor.execute(
-            'SELECT context FROM user_memory WHERE user_id = ? ORDER BY id ASC',
-            (user_id,)
-        )
-        results = cursor.fetchall()
+        Args:
+            user_id: ID del usuario
+            limit: Máximo de memorias a entregar (None = todas)
+            newest_first: Empezar por las más recientes
+            batch_size: Filas leídas por página
         
-        conn.close()
+        Yields:
+            Dict: Memoria con id y context
+        """
+        direction = 'DESC' if newest_first else 'ASC'
+        comparison = '<' if newest_first else '>'
+        remaining = limit
+        last_id = None
         
-        if results:
-            all_memories = '\n'.join([f"- {row[0]}" for row in results])
-            return f"HISTORIAL DE MEMORIA DEL USUARIO:\n{all_memories}"
-        return ''
+        while remaining is None or remaining > 0:
+            page_size = batch_size if remaining is None else min(batch_size, remaining)
+            with self._connection() as conn:
+                if last_id is None:
+                    cursor = conn.execute(
+                        f'SELECT id, context FROM user_memory WHERE user_id = ? '
+                        f'ORDER BY id {direction} LIMIT ?',
+                        (user_id, page_size)
+                    )
+                else:
+                    cursor = conn.execute(
+                        f'SELECT id, context FROM user_memory WHERE user_id = ? AND id {comparison} ? '
+                        f'ORDER BY id {direction} LIMIT ?',
+                        (user_id, last_id, page_size)
+                    )
+                rows = cursor.fetchmany(page_size)
+            
+            for memory_id, context in rows:
+                yield {'id': memory_id, 'context': context}
+            
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
     
+    @instrumented
     def save_user_memory(self, user_id: str, context: str) -> int:
         """
         Guarda una memoria del usuario.
@@ -259,120 +1298,886 @@ class DatabaseManager:
         Returns:
             int: ID de la memoria insertada
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        return self._write(self._insert_memory, user_id, context)
+    
+    @instrumented
+    def save_user_memory_async(self, user_id: str, context: str) -> Future:
+        """
+        Igual que save_user_memory, pero sin esperar al commit en modo write-behind.
         
-        cursor.execute(
-            'INSERT INTO user_memory (user_id, context) VALUES (?, ?)',
+        Returns:
+            Future: Se resuelve con el ID de la memoria
+        """
+        return self._submit(self._insert_memory, user_id, context)
+    
+    @staticmethod
+    def _insert_memory(conn: sqlite3.Connection, user_id: str, context: str) -> int:
+        cursor = conn.execute(
+            'INSERT INTO user_memory (user_id, context, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
             (user_id, context)
         )
+        return cursor.lastrowid
+    
+    @instrumented
+    def save_memories_bulk(self, memories: List[Tuple[str, str]]) -> List[int]:
+        """
+        Guarda varias memorias en una sola transacción (un solo fsync).
+        
+        Args:
+            memories: Lista de tuplas (user_id, context)
+        
+        Returns:
+            List[int]: IDs de las memorias insertadas, en orden
+        """
+        if not memories:
+            return []
+        
+        return self._write(self._insert_memories, list(memories))
+    
+    @staticmethod
+    def _insert_memories(conn: sqlite3.Connection, memories: List[Tuple[str, str]]) -> List[int]:
+        conn.executemany(
+            'INSERT INTO user_memory (user_id, context, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+            memories
+        )
+        # Dentro de la transacción nadie más escribe: los IDs son consecutivos
+        last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        return list(range(last_id - len(memories) + 1, last_id + 1))
+    
+    @instrumented
+    def count_user_memories(self, user_id: str) -> int:
+        """
+        Cuenta las memorias activas de un usuario.
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            int: Número de memorias
+        """
+        with self._connection() as conn:
+            return conn.execute(
+                'SELECT COUNT(*) FROM user_memory WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()[0]
+    
+    @instrumented
+    def count_users_with_memories(self) -> int:
+        """
+        Cuenta los usuarios con al menos una memoria activa, estén o no
+        registrados en users (el agente de consola no los registra).
+        
+        Returns:
+            int: Número de usuarios
+        """
+        with self._connection() as conn:
+            return conn.execute('SELECT COUNT(DISTINCT user_id) FROM user_memory').fetchone()[0]
+    
+    @instrumented
+    def get_users_over_memory_limit(self, max_memories: int) -> List[Tuple[str, int]]:
+        """
+        Obtiene los usuarios con más de N memorias activas.
+        
+        Args:
+            max_memories: Límite de memorias por usuario
+        
+        Returns:
+            List[Tuple[str, int]]: Pares (user_id, número de memorias)
+        """
+        with self._connection() as conn:
+            return conn.execute('''
+                SELECT user_id, COUNT(*) AS total
+                FROM user_memory
+                GROUP BY user_id
+                HAVING total > ?
+                ORDER BY total DESC
+            ''', (max_memories,)).fetchall()
+    
+    @instrumented
+    def compact_user_memory(self, user_id: str, memory_ids: List[int],
+                            consolidated_context: str) -> int:
+        """
+        Reemplaza varias memorias de un usuario por una consolidada.
+        Los originales se copian a user_memory_archive. La memoria
+        consolidada conserva el ID de la más antigua, así mantiene su
+        lugar en el orden cronológico, y la fecha de la más reciente,
+        para que la retención por antigüedad no la elimine antes de tiempo.
+        
+        Args:
+            user_id: ID del usuario
+            memory_ids: IDs de las memorias a consolidar
+            consolidated_context: Texto consolidado
+        
+        Returns:
+            int: ID de la memoria consolidada
+        """
+        return self._write(self._compact_memories, user_id, sorted(memory_ids), consolidated_context)
+    
+    @staticmethod
+    def _compact_memories(conn: sqlite3.Connection, user_id: str,
+                          memory_ids: List[int], consolidated_context: str) -> int:
+        if not memory_ids:
+            raise ValueError("No hay memorias para consolidar")
+        
+        target_id = memory_ids[0]
+        placeholders = ', '.join('?' * len(memory_ids))
+        archived = conn.execute(
+            f'''
+            INSERT INTO user_memory_archive (id, user_id, context, consolidated_into)
+            SELECT id, user_id, context, ? FROM user_memory
+            WHERE user_id = ? AND id IN ({placeholders})
+            ''',
+            (target_id, user_id, *memory_ids)
+        ).rowcount
+        if archived != len(memory_ids):
+            # Otra compactación se adelantó o los IDs no son de este usuario
+            raise ValueError("Las memorias a consolidar cambiaron")
+        
+        newest = conn.execute(
+            f'SELECT MAX(created_at) FROM user_memory WHERE id IN ({placeholders})',
+            memory_ids
+        ).fetchone()[0]
+        conn.execute(
+            f'DELETE FROM user_memory WHERE id IN ({placeholders}) AND id != ?',
+            (*memory_ids, target_id)
+        )
+        conn.execute(
+            'UPDATE user_memory SET context = ?, created_at = COALESCE(?, created_at) WHERE id = ?',
+            (consolidated_context, newest, target_id)
+        )
+        return target_id
+    
+    # ==================== BÚSQUEDA ====================
+    
+    @staticmethod
+    def _search_terms(text: str) -> List[str]:
+        """
+        Extrae los términos de búsqueda de un texto libre.
+        Quita acentos igual que el tokenizador (remove_diacritics).
+        
+        Args:
+            text: Pregunta o consulta del usuario
+        
+        Returns:
+            List[str]: Términos en minúsculas, sin palabras vacías ni repetidos
+        """
+        return search_terms(text)
+    
+    @classmethod
+    def _fts_query(cls, text: str) -> str:
+        """
+        Convierte texto libre en una consulta FTS5 segura (términos entre
+        comillas unidos con OR; BM25 premia a los que coinciden en más).
+        
+        Args:
+            text: Pregunta o consulta del usuario
+        
+        Returns:
+            str: Expresión MATCH, vacía si no hay términos útiles
+        """
+        return ' OR '.join(f'"{term}"' for term in cls._search_terms(text))
+    
+    @instrumented
+    def search_rules(self, query: str, k: int = 5) -> List[Dict]:
+        """
+        Busca las reglas más relevantes para una consulta (ranking BM25).
+        
+        Args:
+            query: Texto libre, por ejemplo la pregunta del usuario
+            k: Número máximo de reglas a retornar
+        
+        Returns:
+            List[Dict]: Reglas con id, rule_text, error_category,
+                validation_score y score (menor = más relevante)
+        """
+        match = self._fts_query(query)
+        if not match:
+            return []
+        
+        with self._connection() as conn:
+            if self.fts_enabled:
+                # Ordenar y limitar dentro de FTS5 antes de unir con la tabla
+                rows = conn.execute('''
+                    SELECT r.id, r.rule_text, r.error_category, r.validation_score, top.score
+                    FROM (
+                        SELECT rowid, rank AS score FROM prompt_rules_fts
+                        WHERE prompt_rules_fts MATCH ? ORDER BY rank LIMIT ?
+                    ) AS top
+                    JOIN prompt_rules r ON r.id = top.rowid
+                    ORDER BY top.score
+                ''', ('rule_text : (' + match + ')', k)).fetchall()
+            else:
+                terms = self._search_terms(query)
+                rows = conn.execute(
+                    'SELECT id, rule_text, error_category, validation_score, 0.0 FROM prompt_rules WHERE '
+                    + ' OR '.join('rule_text LIKE ?' for _ in terms) + ' LIMIT ?',
+                    [f'%{term}%' for term in terms] + [k]
+                ).fetchall()
+        
+        return [
+            {'id': row[0], 'rule_text': row[1], 'error_category': row[2],
+             'validation_score': row[3], 'score': row[4]}
+            for row in rows
+        ]
+    
+    @instrumented
+    def search_user_memory(self, user_id: str, query: str, k: int = 5) -> List[Dict]:
+        """
+        Busca las memorias de un usuario más relevantes para una consulta (BM25).
+        
+        Args:
+            user_id: ID del usuario
+            query: Texto libre, por ejemplo la pregunta del usuario
+            k: Número máximo de memorias a retornar
         
-        memory_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        Returns:
+            List[Dict]: Memorias con id, context y score (menor = más relevante)
+        """
+        match = self._fts_query(query)
+        if not match:
+            return []
         
-        return memory_id
+        with self._connection() as conn:
+            if self.fts_enabled:
+                # El user_id como frase en la columna user_id restringe el
+                # documento antes de puntuar; el JOIN confirma la coincidencia exacta
+                user_phrase = '"' + user_id.replace('"', '""') + '"'
+                rows = conn.execute('''
+                    SELECT m.id, m.context, bm25(user_memory_fts) AS score
+                    FROM user_memory_fts
+                    JOIN user_memory m ON m.id = user_memory_fts.rowid
+                    WHERE user_memory_fts MATCH ? AND m.user_id = ?
+                    ORDER BY score
+                    LIMIT ?
+                ''', (f'user_id : {user_phrase} AND context : ({match})', user_id, k)).fetchall()
+            else:
+                terms = self._search_terms(query)
+                rows = conn.execute(
+                    'SELECT id, context, 0.0 FROM user_memory WHERE user_id = ? AND ('
+                    + ' OR '.join('context LIKE ?' for _ in terms) + ') LIMIT ?',
+                    [user_id] + [f'%{term}%' for term in terms] + [k]
+                ).fetchall()
+        
+        return [{'id': row[0], 'context': row[1], 'score': row[2]} for row in rows]
     
     # ==================== MÉTRICAS ====================
     
+    @instrumented
     def get_system_stats(self) -> Dict[str, any]:
         """
         Obtiene estadísticas globales del sistema.
+        Lee los contadores de system_counters (mantenidos por triggers),
+        así el costo no depende del tamaño de las tablas.
         
         Returns:
             Dict: Diccionario con estadísticas
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            counters = conn.execute(
+                'SELECT name, value FROM system_counters ORDER BY name'
+            ).fetchall()
         
-        # Contar reglas
-        cursor.execute('SELECT COUNT(*) FROM prompt_rules')
-        total_rules = cursor.fetchone()[0]
+        return self._stats_from_counters(counters)
+    
+    def get_instrumentation_report(self, top_statements: int = 10) -> Optional[Dict]:
+        """
+        Mediciones de SQL acumuladas: latencia por método (histograma,
+        p50/p95, sentencias, tiempo en SQL y filas leídas), sentencias más
+        costosas y conexiones abiertas.
         
-        # Contar usuarios registrados
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
+        Args:
+            top_statements: Sentencias a incluir, ordenadas por tiempo total
         
-        # Contar memorias
-        cursor.execute('SELECT COUNT(*) FROM user_memory')
-        total_memories = cursor.fetchone()[0]
+        Returns:
+            Dict: Reporte, o None si la instrumentación está desactivada
+        """
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.report(top_statements)
+    
+    @staticmethod
+    def _stats_from_counters(counters: List[Tuple[str, float]]) -> Dict[str, any]:
+        """
+        Convierte las filas de system_counters al formato de get_system_stats.
         
-        # Distribución de errores
-        cursor.execute('''
-            SELECT error_category, COUNT(*) as count 
-            FROM prompt_rules 
-            WHERE error_category IS NOT NULL
-            GROUP BY error_category
-        ''')
-        error_distribution = dict(cursor.fetchall())
+        Args:
+            counters: Pares (nombre, valor)
         
-        # Score promedio de validación
-        cursor.execute('SELECT AVG(validation_score) FROM prompt_rules WHERE validation_score > 0')
-        avg_validation = cursor.fetchone()[0] or 0.0
+        Returns:
+            Dict: Diccionario con estadísticas
+        """
+        values = {}
+        error_distribution = {}
+        for name, value in counters:
+            if name.startswith('category:'):
+                # Categorías sin reglas se omiten, igual que el GROUP BY anterior
+                if value > 0:
+                    error_distribution[name[len('category:'):]] = int(value)
+            else:
+                values[name] = value
         
-        conn.close()
+        score_count = values.get('validation_score_count', 0)
+        avg_validation = (values.get('validation_score_sum', 0.0) / score_count) if score_count else 0.0
         
         return {
-            'total_rules': total_rules,
-            'total_users': total_users,
-            'total_memories': total_memories,
+            'total_rules': int(values.get('total_rules', 0)),
+            'total_users': int(values.get('total_users', 0)),
+            'total_memories': int(values.get('total_memories', 0)),
             'error_distribution': error_distribution,
             'avg_validation_score': avg_validation
         }
     
-    # ==================== UTILIDADES ====================
+    # ==================== SNAPSHOTS ====================
     
-    def clear_all_rules(self):
-        """Limpia todas las reglas de la base de datos."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM prompt_rules')
-        conn.commit()
-        conn.close()
-        print("✓ Todas las reglas han sido eliminadas")
+    # Tablas con el estado aprendido, en orden de carga
+    SNAPSHOT_TABLES = ('users', 'prompt_rules', 'prompt_rules_archive', 'rule_usage',
+                       'user_memory', 'user_memory_archive')
+    SNAPSHOT_FORMAT = 'kavak-snapshot'
+    SNAPSHOT_VERSION = 1
+    # Rutas con estas extensiones se copian como BD SQLite (API de backup)
+    SQLITE_SNAPSHOT_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+    # Filas por lote al leer y escribir snapshots
+    SNAPSHOT_BATCH_SIZE = 10000
     
-    def clear_all_memories(self):
-        """Limpia todas las memorias de la base de datos."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM user_memory')
-        conn.commit()
-        conn.close()
-        print("✓ Todas las memorias han sido eliminadas")
+    @instrumented
+    def export_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Exporta usuarios, reglas (con sus contadores de uso), memorias y
+        reglas y memorias archivadas.
+        
+        Con extensión .db/.sqlite/.sqlite3 hace una copia binaria con la API
+        de backup de SQLite. Con cualquier otra extensión (p. ej. .jsonl.gz)
+        escribe JSON por líneas comprimido con gzip: por cada tabla una línea
+        con sus columnas y una línea por fila, leídas en streaming dentro de
+        una sola transacción de lectura (copia consistente).
+        
+        Args:
+            path: Archivo de destino
+        
+        Returns:
+            Dict[str, int]: Filas exportadas por tabla
+        """
+        self.flush()
+        
+        if path.lower().endswith(self.SQLITE_SNAPSHOT_EXTENSIONS):
+            target = sqlite3.connect(path)
+            try:
+                with self._connection() as conn:
+                    conn.backup(target)
+                return self._table_counts(target)
+            finally:
+                target.close()
+        
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        counts = {}
+        with self._connection() as conn, gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as out:
+            conn.execute('BEGIN')
+            try:
+                out.write(encoder.encode(self.snapshot_header(
+                    schema_version=conn.execute('PRAGMA user_version').fetchone()[0]
+                )) + '\n')
+                
+                for table in self.SNAPSHOT_TABLES:
+                    counts[table] = self._write_snapshot_table(conn, out, encoder, table)
+            finally:
+                conn.rollback()
+        
+        return counts
     
-    def reset_database(self):
+    @classmethod
+    def snapshot_header(cls, **fields) -> Dict:
         """
-        Resetea completamente la base de datos a estado inicial (0).
-        Elimina todas las reglas y memorias.
+        Primera línea de un snapshot JSON por líneas.
+        
+        Args:
+            **fields: Datos adicionales del manifiesto (p. ej. schema_version)
+        
+        Returns:
+            Dict: Formato, versión y los datos adicionales
         """
-        print("\n⚠️  RESETEO COMPLETO DE LA BASE DE DATOS")
-        print("="*60)
+        return {'format': cls.SNAPSHOT_FORMAT, 'version': cls.SNAPSHOT_VERSION, **fields}
+    
+    def _write_snapshot_table(self, conn: sqlite3.Connection, out, encoder: json.JSONEncoder,
+                              table: str) -> int:
+        """
+        Escribe una tabla en un snapshot JSON por líneas: una línea con sus
+        columnas y una por fila, leídas en lotes.
         
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        Returns:
+            int: Filas escritas
+        """
+        cursor = conn.execute(f'SELECT * FROM {table} ORDER BY rowid')
+        columns = [description[0] for description in cursor.description]
+        out.write(encoder.encode({'table': table, 'columns': columns}) + '\n')
+        
+        count = 0
+        while True:
+            rows = cursor.fetchmany(self.SNAPSHOT_BATCH_SIZE)
+            if not rows:
+                break
+            out.write(''.join(encoder.encode(row) + '\n' for row in rows))
+            count += len(rows)
+        return count
+    
+    @classmethod
+    def read_snapshot(cls, path: str) -> Iterator[Tuple[str, List[str], List[list]]]:
+        """
+        Lee un snapshot (JSON por líneas o copia SQLite) por lotes, para
+        cargarlo en cualquier backend. Cada tabla empieza con un lote vacío,
+        así las tablas sin filas también aparecen. Una tabla puede venir en
+        varias secciones (p. ej. una por fragmento).
+        
+        Args:
+            path: Archivo del snapshot
+        
+        Yields:
+            Tuple: (tabla, columnas, filas del lote)
+        """
+        if path.lower().endswith(cls.SQLITE_SNAPSHOT_EXTENSIONS):
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            conn = sqlite3.connect(path)
+            try:
+                for table in cls.SNAPSHOT_TABLES:
+                    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+                    if not columns:
+                        continue
+                    yield table, columns, []
+                    cursor = conn.execute(f'SELECT * FROM {table} ORDER BY rowid')
+                    while True:
+                        rows = cursor.fetchmany(cls.SNAPSHOT_BATCH_SIZE)
+                        if not rows:
+                            break
+                        yield table, columns, [list(row) for row in rows]
+            finally:
+                conn.close()
+            return
+        
+        with gzip.open(path, 'rt', encoding='utf-8') as source:
+            try:
+                header = json.loads(source.readline())
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or header.get('format') != cls.SNAPSHOT_FORMAT:
+                raise ValueError(f"{path} no es un snapshot válido")
+            if header.get('version', 0) > cls.SNAPSHOT_VERSION:
+                raise ValueError(f"Versión de snapshot no soportada: {header.get('version')}")
+            
+            table, columns, batch = None, None, []
+            for line in source:
+                if line.startswith('{'):
+                    if batch:
+                        yield table, columns, batch
+                        batch = []
+                    section = json.loads(line)
+                    table, columns = section['table'], section['columns']
+                    if table not in cls.SNAPSHOT_TABLES:
+                        raise ValueError(f"Tabla desconocida en el snapshot: {table}")
+                    yield table, columns, []
+                    continue
+                
+                batch.append(json.loads(line))
+                if len(batch) >= cls.SNAPSHOT_BATCH_SIZE:
+                    yield table, columns, batch
+                    batch = []
+            if batch:
+                yield table, columns, batch
+    
+    @instrumented
+    def import_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Reemplaza usuarios, reglas y memorias por los de un snapshot
+        creado con export_snapshot (JSON por líneas o copia SQLite).
+        Todo se carga en una sola transacción: si algo falla, la BD queda
+        como estaba. Las columnas que no existan en el esquema actual se ignoran.
+        
+        Args:
+            path: Archivo del snapshot
+        
+        Returns:
+            Dict[str, int]: Filas importadas por tabla
+        """
+        if path.lower().endswith(self.SQLITE_SNAPSHOT_EXTENSIONS):
+            return self._import_sqlite_snapshot(path)
+        
+        counts = {}
+        batches = self.read_snapshot(path)
+        # El encabezado se valida antes de vaciar las tablas
+        first = next(batches, None)
+        with self._connection() as conn, self._bulk_load(conn):
+            self._clear_learned_state(conn)
+            if first is not None:
+                for table, columns, rows in itertools.chain((first,), batches):
+                    counts[table] = counts.get(table, 0) + len(rows)
+                    self._insert_snapshot_rows(conn, table, columns, rows)
+        
+        return counts
+    
+    def _insert_snapshot_rows(self, conn: sqlite3.Connection, table: str,
+                              columns: List[str], rows: List[list]):
+        """Inserta un lote de filas de un snapshot (solo las columnas del esquema actual)."""
+        if not rows:
+            return
+        names, keep = self._snapshot_columns(conn, table, columns)
+        if keep is not None:
+            rows = [[row[i] for i in keep] for row in rows]
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", rows
+        )
+    
+    def _import_sqlite_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Carga un snapshot SQLite adjuntándolo (ATTACH) y copiando cada
+        tabla con INSERT ... SELECT dentro de la transacción de carga.
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        
+        counts = {}
+        with self._connection() as conn:
+            conn.execute('ATTACH DATABASE ? AS snapshot', (path,))
+            try:
+                with self._bulk_load(conn):
+                    self._clear_learned_state(conn)
+                    for table in self.SNAPSHOT_TABLES:
+                        columns = [row[1] for row in conn.execute(f'PRAGMA snapshot.table_info({table})')]
+                        if not columns:
+                            continue
+                        names, _ = self._snapshot_columns(conn, table, columns)
+                        column_list = ', '.join(names)
+                        counts[table] = conn.execute(
+                            f'INSERT INTO {table} ({column_list}) '
+                            f'SELECT {column_list} FROM snapshot.{table} ORDER BY rowid'
+                        ).rowcount
+            finally:
+                conn.execute('DETACH DATABASE snapshot')
         
-        # Contar antes de borrar
-        cursor.execute('SELECT COUNT(*) FROM prompt_rules')
-        rules_count = cursor.fetchone()[0]
+        return counts
+    
+    @staticmethod
+    def _snapshot_columns(conn: sqlite3.Connection, table: str,
+                          columns: List[str]) -> Tuple[List[str], Optional[List[int]]]:
+        """
+        Filtra las columnas de una tabla del snapshot a las que existen
+        en el esquema actual.
         
-        cursor.execute('SELECT COUNT(*) FROM user_memory')
-        memories_count = cursor.fetchone()[0]
+        Returns:
+            Tuple: (columnas a cargar, sus posiciones o None si son todas)
+        """
+        available = {row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')}
+        keep = [i for i, column in enumerate(columns) if column in available]
+        return [columns[i] for i in keep], (None if len(keep) == len(columns) else keep)
+    
+    def _table_counts(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """Filas de cada tabla del snapshot."""
+        return {
+            table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in self.SNAPSHOT_TABLES
+        }
+    
+    def _clear_learned_state(self, conn: sqlite3.Connection, reset_sequences: bool = False):
+        """
+        Vacía las tablas del snapshot (dentro de _bulk_load).
         
-        print(f"Reglas a eliminar: {rules_count}")
-        print(f"Memorias a eliminar: {memories_count}")
+        Args:
+            conn: Conexión con la transacción de carga abierta
+            reset_sequences: Reiniciar los contadores AUTOINCREMENT
+        """
+        for table in reversed(self.SNAPSHOT_TABLES):
+            conn.execute(f'DELETE FROM {table}')
+        if reset_sequences:
+            conn.execute(
+                "DELETE FROM sqlite_sequence WHERE name IN ('prompt_rules', 'user_memory', 'users')"
+            )
+    
+    @contextmanager
+    def _bulk_load(self, conn: sqlite3.Connection):
+        """
+        Transacción exclusiva para cargas y borrados masivos.
+        Suspende los triggers de contadores, generación y FTS de las tablas
+        del snapshot (así DELETE vacía tablas completas de una vez y los
+        INSERT no se indexan fila por fila) y al terminar los restaura,
+        recalcula los contadores y reconstruye los índices FTS en una pasada.
         
-        # Borrar todo
-        cursor.execute('DELETE FROM prompt_rules')
-        cursor.execute('DELETE FROM user_memory')
-        cursor.execute('DELETE FROM users')
+        Args:
+            conn: Conexión a usar (la del hilo actual)
+        """
+        self.flush()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            placeholders = ', '.join('?' * len(self.SNAPSHOT_TABLES))
+            triggers = conn.execute(
+                f"SELECT name, sql FROM main.sqlite_master "
+                f"WHERE type = 'trigger' AND tbl_name IN ({placeholders})",
+                self.SNAPSHOT_TABLES
+            ).fetchall()
+            for name, _ in triggers:
+                conn.execute(f'DROP TRIGGER {name}')
+            
+            yield conn
+            
+            # Memorias de snapshots anteriores a v7: sin fecha conocida
+            conn.execute('UPDATE user_memory SET created_at = ? WHERE created_at IS NULL', (LEGACY_CREATED_AT,))
+            for _, trigger_sql in triggers:
+                conn.execute(trigger_sql)
+            self._rebuild_counters(conn)
+            if self.fts_enabled:
+                for fts_table, _, _ in self.FTS_TABLES:
+                    conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+            # Invalida los snapshots de reglas de todas las conexiones y procesos
+            conn.execute("UPDATE system_counters SET value = value + 1 WHERE name = 'rules_generation'")
+            # Y las memorias cacheadas: cambian los usuarios que tenían o tienen memorias
+            conn.execute('UPDATE user_memory_versions SET version = version + 1')
+            conn.execute('''
+                INSERT OR IGNORE INTO user_memory_versions (user_id, version)
+                SELECT DISTINCT user_id, 1 FROM user_memory
+            ''')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    
+    # ==================== RETENCIÓN ====================
+    
+    @instrumented
+    def sweep_expired(self, batch_size: int = 500,
+                      policy: Optional[RetentionPolicy] = None) -> Dict[str, int]:
+        """
+        Elimina un lote de filas vencidas según la política de retención.
+        Cada motivo se borra en su propia transacción corta de hasta
+        batch_size filas; hay que llamarlo hasta que no elimine nada
+        (RetentionSweeper lo hace en segundo plano).
         
-        # Resetear autoincrement
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name="prompt_rules"')
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name="user_memory"')
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name="users"')
+        Args:
+            batch_size: Filas máximas por motivo
+            policy: Política a aplicar (None = self.retention)
         
-        conn.commit()
-        conn.close()
+        Returns:
+            Dict[str, int]: Filas eliminadas por motivo (memories_expired,
+                archive_expired, memories_over_limit, rules_expired)
+        """
+        policy = policy or self.retention
+        deleted = {}
+        
+        if policy.memory_max_age_days is not None:
+            age = f'-{policy.memory_max_age_days} days'
+            deleted['memories_expired'] = self._write(self._delete_expired_memories, age, batch_size)
+            deleted['archive_expired'] = self._write(self._delete_expired_archive, age, batch_size)
+        
+        if policy.memory_max_per_user is not None:
+            deleted['memories_over_limit'] = self._write(
+                self._delete_memories_over_limit, policy.memory_max_per_user, batch_size
+            )
+        
+        if policy.expires_rules:
+            deleted['rules_expired'] = self._write(
+                self._delete_expired_rules, policy.rule_min_score,
+                None if policy.rule_max_age_days is None else f'-{policy.rule_max_age_days} days',
+                f'-{policy.rule_min_age_days} days', batch_size
+            )
+        
+        return deleted
+    
+    @staticmethod
+    def _delete_expired_memories(conn: sqlite3.Connection, age: str, batch_size: int) -> int:
+        return conn.execute('''
+            DELETE FROM user_memory WHERE id IN (
+                SELECT id FROM user_memory
+                WHERE created_at < datetime('now', ?)
+                ORDER BY created_at LIMIT ?
+            )
+        ''', (age, batch_size)).rowcount
+    
+    @staticmethod
+    def _delete_expired_archive(conn: sqlite3.Connection, age: str, batch_size: int) -> int:
+        return conn.execute('''
+            DELETE FROM user_memory_archive WHERE id IN (
+                SELECT id FROM user_memory_archive
+                WHERE archived_at < datetime('now', ?)
+                ORDER BY archived_at LIMIT ?
+            )
+        ''', (age, batch_size)).rowcount
+    
+    @staticmethod
+    def _delete_memories_over_limit(conn: sqlite3.Connection, max_per_user: int,
+                                    batch_size: int) -> int:
+        over_limit = conn.execute('''
+            SELECT user_id, COUNT(*) - ? FROM user_memory
+            GROUP BY user_id HAVING COUNT(*) > ?
+        ''', (max_per_user, max_per_user)).fetchall()
+        
+        deleted = 0
+        for user_id, excess in over_limit:
+            if deleted >= batch_size:
+                break
+            # Se eliminan las más antiguas del usuario por created_at: la
+            # consolidada conserva el ID más antiguo pero la fecha más reciente
+            # de lo que fusionó, y a igual fecha va después de las originales
+            deleted += conn.execute('''
+                DELETE FROM user_memory WHERE id IN (
+                    SELECT id FROM user_memory WHERE user_id = ?
+                    ORDER BY created_at,
+                             id IN (SELECT consolidated_into FROM user_memory_archive WHERE user_id = ?),
+                             id
+                    LIMIT ?
+                )
+            ''', (user_id, user_id, min(excess, batch_size - deleted))).rowcount
+        return deleted
+    
+    @staticmethod
+    def _delete_expired_rules(conn: sqlite3.Connection, min_score: Optional[float],
+                              age: Optional[str], min_age: str, batch_size: int) -> int:
+        conditions, params = [], []
+        if min_score is not None:
+            # Por score solo las que ya tuvieron tiempo de validarse
+            conditions.append("COALESCE(validation_score, 0) < ? AND created_at < datetime('now', ?)")
+            params.extend((min_score, min_age))
+        if age is not None:
+            conditions.append("created_at < datetime('now', ?)")
+            params.append(age)
+        
+        return conn.execute(f'''
+            DELETE FROM prompt_rules WHERE id IN (
+                SELECT id FROM prompt_rules WHERE {' AND '.join(conditions)}
+                ORDER BY id LIMIT ?
+            )
+        ''', (*params, batch_size)).rowcount
+    
+    @instrumented
+    def incremental_vacuum(self, pages: Optional[int] = None) -> int:
+        """
+        Devuelve al sistema páginas libres del archivo (PRAGMA incremental_vacuum).
+        Corre en una transacción propia, fuera de la cola write-behind.
+        No hace nada si la BD no se creó con auto_vacuum = INCREMENTAL
+        (ver enable_incremental_vacuum).
+        
+        Args:
+            pages: Páginas máximas a liberar (None = todas)
+        
+        Returns:
+            int: Páginas liberadas
+        """
+        with self._connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return 0
+            before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not before:
+                return 0
+            # executescript ejecuta el PRAGMA hasta el final; execute libera una sola página
+            conn.executescript(f'PRAGMA incremental_vacuum({int(pages or 0)})')
+            return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Activa auto_vacuum = INCREMENTAL en una BD creada sin él.
+        Requiere un VACUUM completo que bloquea la BD: ejecutar con la
+        aplicación detenida. Las BD nuevas ya se crean con el modo activo.
+        
+        Returns:
+            bool: True si hubo que convertir la BD
+        """
+        self.flush()
+        with self._connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        return True
+    
+    # ==================== FRAGMENTACIÓN ====================
+    
+    def get_shard_layout(self) -> Tuple[int, int]:
+        """
+        Obtiene la distribución de usuarios en fragmentos registrada en esta BD.
+        
+        Returns:
+            Tuple[int, int]: (número de fragmentos, época); (0, 0) si no está fragmentada
+        """
+        with self._connection() as conn:
+            values = dict(conn.execute(
+                "SELECT name, value FROM system_counters WHERE name IN ('shard_count', 'shard_epoch')"
+            ).fetchall())
+        return int(values.get('shard_count', 0)), int(values.get('shard_epoch', 0))
+    
+    def set_shard_layout(self, shard_count: int, epoch: int):
+        """
+        Registra la distribución de fragmentos (la usa la herramienta de refragmentación).
+        
+        Args:
+            shard_count: Número de fragmentos
+            epoch: Época de la distribución
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO system_counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+                (('shard_count', shard_count), ('shard_epoch', epoch))
+            )
+    
+    def reserve_memory_ids(self, start: int):
+        """
+        Hace que los próximos IDs de user_memory sean mayores que start.
+        Cada fragmento reserva su propio rango para que los IDs de memoria
+        sean únicos entre fragmentos.
+        
+        Args:
+            start: ID a partir del cual se asignan los siguientes
+        """
+        self.flush()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'user_memory'",
+                (start,)
+            ).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('user_memory', ?)",
+                    (start,)
+                )
+    
+    # ==================== UTILIDADES ====================
+    
+    @instrumented
+    def clear_all_rules(self, verbose: bool = True):
+        """Limpia todas las reglas de la base de datos (incluido el archivo)."""
+        self.flush()
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM prompt_rules_archive')
+            conn.execute('DELETE FROM prompt_rules')
+        if verbose:
+            print("✓ Todas las reglas han sido eliminadas")
+    
+    @instrumented
+    def clear_all_memories(self, verbose: bool = True):
+        """Limpia todas las memorias de la base de datos."""
+        self.flush()
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM user_memory')
+        if verbose:
+            print("✓ Todas las memorias han sido eliminadas")
+    
+    @instrumented
+    def reset_database(self, verbose: bool = True):
+        """
+        Resetea completamente la base de datos a estado inicial (0).
+        Elimina todos los usuarios, reglas y memorias (incluido el archivo).
+        
+        Args:
+            verbose: Imprimir el detalle del reseteo
+        """
+        if verbose:
+            print("\n⚠️  RESETEO COMPLETO DE LA BASE DE DATOS")
+            print("="*60)
+        
+        with self._connection() as conn, self._bulk_load(conn):
+            counts = self._table_counts(conn)
+            if verbose:
+                print(f"Reglas a eliminar: {counts['prompt_rules']}")
+                print(f"Memorias a eliminar: {counts['user_memory']}")
+            
+            # Sin triggers, DELETE sin WHERE vacía cada tabla de una vez
+            self._clear_learned_state(conn, reset_sequences=True)
         
-        print("\n✅ Base de datos reseteada completamente a 0")
-        print("="*60)
+        if verbose:
+            print("\n✅ Base de datos reseteada completamente a 0")
+            print("="*60)
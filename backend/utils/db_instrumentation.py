@@ -0,0 +1,376 @@
+"""
+Instrumentación de SQL
+Mide, de forma opcional, el tiempo de cada sentencia SQL, las filas
+leídas y las conexiones abiertas, y lo agrega en histogramas de latencia
+por método del gestor de base de datos (get_user_memory, get_system_stats...).
+"""
+
+import functools
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+# Variable de entorno que activa la instrumentación ('1' o 'true')
+INSTRUMENT_ENV_VAR = 'KAVAK_DB_INSTRUMENT'
+
+# Método al que se atribuyen las sentencias ejecutadas fuera de un método
+# instrumentado (migraciones, hilo write-behind)
+UNTRACKED_METHOD = '(otros)'
+
+
+class LatencyHistogram:
+    """
+    Histograma de latencias con cubetas fijas en escala logarítmica.
+    Los percentiles se estiman con el límite superior de la cubeta.
+    """
+
+    # Límites superiores de las cubetas, en milisegundos
+    BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """
+        Registra una muestra.
+
+        Args:
+            seconds: Duración en segundos
+        """
+        millis = seconds * 1000
+        for index, bound in enumerate(self.BUCKETS_MS):
+            if millis <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """
+        Estima un percentil.
+
+        Args:
+            pct: Percentil (0-100)
+
+        Returns:
+            float: Límite superior de la cubeta, en milisegundos
+        """
+        if not self.count:
+            return 0.0
+        threshold = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= threshold and count:
+                return min(bound, self.max * 1000)
+        return self.max * 1000
+
+    def to_dict(self) -> Dict:
+        """Resumen serializable del histograma."""
+        return {
+            'calls': self.count,
+            'total_ms': self.total * 1000,
+            'avg_ms': (self.total / self.count * 1000) if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'max_ms': self.max * 1000,
+            'histogram': [
+                [None if bound == float('inf') else bound, count]
+                for bound, count in zip(self.BUCKETS_MS, self.counts) if count
+            ],
+        }
+
+
+class _MethodStats:
+    """Acumulados de un método: latencia y trabajo SQL que generó."""
+
+    __slots__ = ('latency', 'statements', 'sql_seconds', 'rows')
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+
+class DatabaseInstrumentation:
+    """
+    Acumula las mediciones de uno o varios gestores de base de datos.
+    Es segura entre hilos; el método en curso se lleva por hilo, y las
+    llamadas anidadas (un método público que usa otro) se atribuyen al
+    método exterior.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Descarta todas las mediciones."""
+        with self._lock:
+            self._methods: Dict[str, _MethodStats] = {}
+            self._statements: Dict[str, LatencyHistogram] = {}
+            self.connections_opened = 0
+
+    # ==================== REGISTRO ====================
+
+    def _current_method(self) -> Optional[str]:
+        return getattr(self._local, 'method', None)
+
+    def _method_stats(self, method_name: str) -> _MethodStats:
+        stats = self._methods.get(method_name)
+        if stats is None:
+            stats = self._methods[method_name] = _MethodStats()
+        return stats
+
+    @contextmanager
+    def track(self, method_name: str):
+        """
+        Mide una llamada a un método y le atribuye las sentencias que ejecute.
+
+        Args:
+            method_name: Nombre del método
+        """
+        if self._current_method() is not None:
+            yield
+            return
+
+        self._local.method = method_name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._local.method = None
+            with self._lock:
+                self._method_stats(method_name).latency.record(elapsed)
+
+    @contextmanager
+    def attribute_to(self, method_name: Optional[str]):
+        """
+        Atribuye a un método las sentencias ejecutadas en otro hilo
+        (p. ej. el hilo write-behind), sin registrar otra llamada.
+
+        Args:
+            method_name: Nombre del método (None no cambia nada)
+        """
+        previous = self._current_method()
+        self._local.method = method_name or previous
+        try:
+            yield
+        finally:
+            self._local.method = previous
+
+    def current_method(self) -> Optional[str]:
+        """Método instrumentado en curso en este hilo, si lo hay."""
+        return self._current_method()
+
+    def track_generator(self, method_name: str, generator: Iterator) -> Iterator:
+        """
+        Igual que track, para métodos generadores: solo cuenta el tiempo
+        en que el generador está activo, no el del código que lo consume.
+
+        Args:
+            method_name: Nombre del método
+            generator: Generador a medir
+
+        Yields:
+            Los elementos del generador
+        """
+        if self._current_method() is not None:
+            yield from generator
+            return
+
+        elapsed = 0.0
+        try:
+            while True:
+                self._local.method = method_name
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                    self._local.method = None
+                yield item
+        finally:
+            generator.close()
+            with self._lock:
+                self._method_stats(method_name).latency.record(elapsed)
+
+    def record_statement(self, sql: str, seconds: float):
+        """
+        Registra la ejecución de una sentencia.
+
+        Args:
+            sql: Texto de la sentencia
+            seconds: Duración en segundos
+        """
+        key = _statement_key(sql)
+        method_name = self._current_method() or UNTRACKED_METHOD
+        with self._lock:
+            histogram = self._statements.get(key)
+            if histogram is None:
+                histogram = self._statements[key] = LatencyHistogram()
+            histogram.record(seconds)
+            stats = self._method_stats(method_name)
+            stats.statements += 1
+            stats.sql_seconds += seconds
+
+    def record_rows(self, rows: int):
+        """
+        Registra filas leídas por el método en curso.
+
+        Args:
+            rows: Número de filas
+        """
+        if rows:
+            with self._lock:
+                self._method_stats(self._current_method() or UNTRACKED_METHOD).rows += rows
+
+    def connection_opened(self):
+        """Registra la apertura de una conexión."""
+        with self._lock:
+            self.connections_opened += 1
+
+    # ==================== REPORTE ====================
+
+    def report(self, top_statements: int = 10) -> Dict:
+        """
+        Resumen de las mediciones, listo para mostrar en consola o Streamlit.
+
+        Args:
+            top_statements: Sentencias a incluir, ordenadas por tiempo total
+
+        Returns:
+            Dict: connections_opened, methods (por nombre, ordenados por
+                tiempo total) y statements (las más costosas)
+        """
+        with self._lock:
+            methods = {}
+            for name, stats in self._methods.items():
+                summary = stats.latency.to_dict()
+                summary.update({
+                    'statements': stats.statements,
+                    'sql_ms': stats.sql_seconds * 1000,
+                    'rows': stats.rows,
+                })
+                methods[name] = summary
+
+            statements = [
+                dict(histogram.to_dict(), sql=sql) for sql, histogram in self._statements.items()
+            ]
+            connections_opened = self.connections_opened
+
+        statements.sort(key=lambda item: -item['total_ms'])
+        return {
+            'connections_opened': connections_opened,
+            'methods': dict(sorted(
+                methods.items(), key=lambda item: -max(item[1]['total_ms'], item[1]['sql_ms'])
+            )),
+            'statements': statements[:top_statements],
+        }
+
+
+def _statement_key(sql: str) -> str:
+    """Texto de la sentencia con espacios colapsados, recortado para agrupar."""
+    return re.sub(r'\s+', ' ', sql).strip()[:120]
+
+
+def instrumented(method):
+    """
+    Decorador para métodos públicos de un gestor con atributo
+    `instrumentation`: si está activa, mide la llamada; si no, solo
+    cuesta una comprobación de atributo.
+    """
+    name = method.__name__
+
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if instrumentation is None:
+                return method(self, *args, **kwargs)
+            return instrumentation.track_generator(name, method(self, *args, **kwargs))
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        with instrumentation.track(name):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# ==================== CONEXIÓN INSTRUMENTADA ====================
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que mide cada sentencia y cuenta las filas leídas."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.instrumentation.record_statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.instrumentation.record_statement(sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.connection.instrumentation.record_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.connection.instrumentation.record_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.connection.instrumentation.record_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        self.connection.instrumentation.record_rows(1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Conexión cuyas sentencias pasan por InstrumentedCursor.
+    Se crea con sqlite3.connect(..., factory=InstrumentedConnection) y
+    luego se le asigna `instrumentation`.
+    """
+
+    instrumentation: DatabaseInstrumentation = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
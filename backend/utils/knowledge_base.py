@@ -0,0 +1,261 @@
+"""
+Base de Conocimiento con Recuperación
+Divide la información de Kavak (backend/knowledge/kavak.md) en secciones,
+las indexa con BM25 y guarda el índice en disco, para inyectar en el
+prompt solo las secciones relevantes a la pregunta en vez del texto
+completo.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .text_search import BM25Index
+
+
+# Variable de entorno con el archivo fuente de la base de conocimiento
+KNOWLEDGE_PATH_ENV_VAR = 'KAVAK_KNOWLEDGE_PATH'
+DEFAULT_KNOWLEDGE_PATH = Path(__file__).resolve().parent.parent / 'knowledge' / 'kavak.md'
+
+# Variable de entorno con el archivo del índice persistido
+KNOWLEDGE_INDEX_ENV_VAR = 'KAVAK_KNOWLEDGE_INDEX'
+DEFAULT_KNOWLEDGE_INDEX = 'kavak_knowledge_index.json'
+
+# Variable de entorno con las secciones a inyectar por pregunta (0 = todas)
+KNOWLEDGE_TOP_K_ENV_VAR = 'KAVAK_KNOWLEDGE_TOP_K'
+DEFAULT_KNOWLEDGE_TOP_K = 3
+
+# Encabezado de las secciones inyectadas en el prompt
+KNOWLEDGE_HEADER = "INFORMACIÓN DE KAVAK:"
+
+# Versión del formato del índice en disco
+INDEX_FORMAT = 1
+
+
+def split_sections(text: str) -> List[Dict]:
+    """
+    Divide el texto fuente en secciones recuperables. Cada encabezado
+    "## " es una sección con el título de su "# " como prefijo; el texto
+    de un "# " antes de su primer "## " es una sección propia.
+
+    Las líneas "<!-- ... -->" son palabras clave de búsqueda (sinónimos y
+    conjugaciones que la raíz no une): se indexan pero no van al prompt.
+    Bajo un "# " valen para todas sus secciones.
+
+    Args:
+        text: Contenido del archivo fuente (markdown con "# " y "## ")
+
+    Returns:
+        List[Dict]: Secciones en orden (id, title, text, keywords); text incluye el título
+    """
+    sections: List[Dict] = []
+    topic, title, lines = '', '', []
+    topic_keywords, keywords = [], []
+
+    def close():
+        body = '\n'.join(lines).strip()
+        if body and title:
+            sections.append({
+                'id': len(sections),
+                'title': title,
+                'text': f"{title}:\n{body}",
+                'keywords': ' '.join(topic_keywords + keywords),
+            })
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('<!--') and stripped.endswith('-->'):
+            words = stripped[4:-3].strip()
+            (topic_keywords if title == topic and not lines else keywords).append(words)
+        elif line.startswith('## '):
+            close()
+            title, lines, keywords = f"{topic} - {line[3:].strip()}" if topic else line[3:].strip(), [], []
+        elif line.startswith('# '):
+            close()
+            topic = line[2:].strip()
+            title, lines, keywords, topic_keywords = topic, [], [], []
+        else:
+            lines.append(line)
+    close()
+    return sections
+
+
+class KnowledgeBase:
+    """
+    Secciones de la base de conocimiento con su índice BM25 (por raíces).
+    El índice se guarda en index_path junto con el hash del archivo
+    fuente: al cargar se reutiliza si el fuente no cambió y se reconstruye
+    (y se vuelve a guardar) si cambió o no existe.
+    """
+
+    def __init__(self, source_path: Optional[str] = None, index_path: Optional[str] = None,
+                 top_k: Optional[int] = None):
+        """
+        Inicializa la base de conocimiento (se carga en el primer uso o con load()).
+
+        Args:
+            source_path: Archivo fuente (por defecto KAVAK_KNOWLEDGE_PATH o backend/knowledge/kavak.md)
+            index_path: Archivo del índice (por defecto KAVAK_KNOWLEDGE_INDEX o
+                kavak_knowledge_index.json; '' = no guardar en disco)
+            top_k: Secciones por pregunta (por defecto KAVAK_KNOWLEDGE_TOP_K o 3; 0 = todas)
+        """
+        if top_k is None:
+            top_k = int(os.getenv(KNOWLEDGE_TOP_K_ENV_VAR) or DEFAULT_KNOWLEDGE_TOP_K)
+        if top_k < 0:
+            raise ValueError("top_k no puede ser negativo")
+        if index_path is None:
+            index_path = os.getenv(KNOWLEDGE_INDEX_ENV_VAR, DEFAULT_KNOWLEDGE_INDEX)
+
+        self.source_path = Path(source_path or os.getenv(KNOWLEDGE_PATH_ENV_VAR) or DEFAULT_KNOWLEDGE_PATH)
+        self.index_path = Path(index_path) if index_path else None
+        self.top_k = top_k
+
+        self._lock = threading.Lock()
+        # (hash del fuente, secciones, índice)
+        self._state: Optional[Tuple[str, Tuple[Dict, ...], BM25Index]] = None
+        # Cómo se obtuvo el índice la última vez: 'disk' o 'built'
+        self.loaded_from: Optional[str] = None
+        # IDs de las secciones de la última recuperación
+        self.last_section_ids: Tuple[int, ...] = ()
+
+    def load(self) -> 'KnowledgeBase':
+        """
+        Carga el índice desde disco o lo construye. Llamarlo al iniciar
+        evita hacerlo en la primera pregunta.
+
+        Returns:
+            KnowledgeBase: La misma base
+        """
+        if self._state is not None:
+            return self
+        with self._lock:
+            if self._state is not None:
+                return self
+            text = self.source_path.read_text(encoding='utf-8')
+            source_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            state = self._read_index(source_hash)
+            if state is not None:
+                self.loaded_from = 'disk'
+            else:
+                state = self._build(text, source_hash)
+                self._write_index(state)
+                self.loaded_from = 'built'
+            self._state = state
+        return self
+
+    def build(self) -> Dict:
+        """
+        Reconstruye el índice desde el archivo fuente y lo guarda
+        (construcción offline).
+
+        Returns:
+            Dict: sections, terms, source_hash, index_path y elapsed_seconds
+        """
+        start = time.perf_counter()
+        with self._lock:
+            text = self.source_path.read_text(encoding='utf-8')
+            state = self._build(text, hashlib.sha1(text.encode('utf-8')).hexdigest())
+            self._write_index(state)
+            self._state = state
+            self.loaded_from = 'built'
+        return {
+            'sections': len(state[1]),
+            'terms': len(state[2].to_dict()['postings']),
+            'source_hash': state[0],
+            'index_path': str(self.index_path) if self.index_path else None,
+            'elapsed_seconds': time.perf_counter() - start,
+        }
+
+    @staticmethod
+    def _build(text: str, source_hash: str) -> Tuple[str, Tuple[Dict, ...], BM25Index]:
+        sections = tuple(split_sections(text))
+        index = BM25Index(
+            ((section['id'], f"{section['text']}\n{section['keywords']}") for section in sections), stemmed=True
+        )
+        return source_hash, sections, index
+
+    def _read_index(self, source_hash: str) -> Optional[Tuple[str, Tuple[Dict, ...], BM25Index]]:
+        """Índice guardado, si existe y corresponde al fuente actual."""
+        if self.index_path is None or not self.index_path.exists():
+            return None
+        try:
+            data = json.loads(self.index_path.read_text(encoding='utf-8'))
+            if data.get('format') != INDEX_FORMAT or data.get('source_hash') != source_hash:
+                return None
+            return source_hash, tuple(data['sections']), BM25Index.from_dict(data['index'])
+        except (OSError, ValueError, KeyError, TypeError):
+            # Índice dañado: se reconstruye
+            return None
+
+    def _write_index(self, state: Tuple[str, Tuple[Dict, ...], BM25Index]):
+        """Guarda el índice de forma atómica (archivo temporal + reemplazo)."""
+        if self.index_path is None:
+            return
+        data = {
+            'format': INDEX_FORMAT,
+            'source_hash': state[0],
+            'sections': list(state[1]),
+            'index': state[2].to_dict(),
+        }
+        temporary = self.index_path.with_name(self.index_path.name + '.tmp')
+        try:
+            temporary.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+            os.replace(temporary, self.index_path)
+        except OSError as e:
+            # Sin disco escribible se sigue con el índice en memoria
+            print(f"[Sistema: no se pudo guardar el índice de conocimiento: {str(e)}]")
+
+    @property
+    def version(self) -> str:
+        """Hash del archivo fuente cargado (cambia la clave de la caché de prompts)."""
+        return self.load()._state[0]
+
+    @property
+    def sections(self) -> Tuple[Dict, ...]:
+        """Todas las secciones, en el orden del archivo fuente."""
+        return self.load()._state[1]
+
+    def retrieve(self, query: Optional[str], k: Optional[int] = None) -> List[Dict]:
+        """
+        Las k secciones más relevantes para la pregunta (solo las que
+        comparten algún término con ella), en el orden del archivo fuente
+        para que el prompt sea estable. Con k = 0 se devuelven todas.
+
+        Args:
+            query: Pregunta del usuario
+            k: Secciones máximas (por defecto top_k)
+
+        Returns:
+            List[Dict]: Secciones elegidas (id, title, text)
+        """
+        k = self.top_k if k is None else k
+        _, sections, index = self.load()._state
+        if not k:
+            chosen = list(sections)
+        else:
+            ranked = index.top_k(query, k) if query else []
+            chosen = [sections[position] for position in sorted(position for position, _ in ranked)]
+        self.last_section_ids = tuple(section['id'] for section in chosen)
+        return chosen
+
+    @staticmethod
+    def render(sections: List[Dict]) -> List[str]:
+        """
+        Texto de cada sección, para una PromptSection o para unir con
+        saltos de línea dobles.
+
+        Args:
+            sections: Secciones de retrieve()
+
+        Returns:
+            List[str]: Texto de cada sección
+        """
+        return [section['text'] for section in sections]
+
+    def full_text(self) -> str:
+        """Todas las secciones unidas (el equivalente al prompt completo)."""
+        return '\n\n'.join(self.render(list(self.sections)))
@@ -0,0 +1,230 @@
+"""
+Caché Persistente de Respuestas del LLM
+Guarda en SQLite la respuesta a cada lista de mensajes exacta (mismo
+modelo y mismos parámetros, temperatura incluida), para no volver a pagar
+latencia ni tokens en las evaluaciones, validaciones y jueces que repiten
+llamadas idénticas. Las entradas expiran por TTL y, al superar el tamaño
+máximo, se desalojan las menos usadas recientemente (LRU).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration
+
+
+# Variable de entorno con el archivo SQLite de la caché (sin definir = desactivada)
+LLM_CACHE_ENV_VAR = 'KAVAK_LLM_CACHE'
+DEFAULT_LLM_CACHE_PATH = 'kavak_llm_cache.db'
+
+# Variable de entorno con la vida de una entrada, en segundos
+LLM_CACHE_TTL_ENV_VAR = 'KAVAK_LLM_CACHE_TTL'
+DEFAULT_LLM_CACHE_TTL = 7 * 24 * 3600
+
+# Variable de entorno con las entradas máximas
+LLM_CACHE_SIZE_ENV_VAR = 'KAVAK_LLM_CACHE_SIZE'
+DEFAULT_LLM_CACHE_SIZE = 1000
+
+# Marca en response_metadata de las respuestas servidas desde la caché
+CACHE_HIT_METADATA_KEY = 'response_cache_hit'
+
+
+class ResponseCache(BaseCache):
+    """
+    Caché de LangChain (BaseCache) sobre una tabla SQLite. La clave es el
+    SHA-256 de (llm_string, mensajes serializados): llm_string incluye el
+    modelo y todos sus parámetros, así otra temperatura es otra entrada.
+
+    Cada entrada guarda la latencia de la llamada original; un acierto la
+    suma a saved_seconds. Los contadores son del proceso; la tabla se
+    comparte entre procesos.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        """
+        Inicializa la caché y crea su tabla si no existe.
+
+        Args:
+            db_path: Archivo SQLite (por defecto KAVAK_LLM_CACHE o kavak_llm_cache.db)
+            ttl_seconds: Vida de una entrada (por defecto KAVAK_LLM_CACHE_TTL o 7 días)
+            max_entries: Entradas máximas (por defecto KAVAK_LLM_CACHE_SIZE o 1000)
+        """
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv(LLM_CACHE_TTL_ENV_VAR) or DEFAULT_LLM_CACHE_TTL)
+        if max_entries is None:
+            max_entries = int(os.getenv(LLM_CACHE_SIZE_ENV_VAR) or DEFAULT_LLM_CACHE_SIZE)
+        if ttl_seconds <= 0:
+            raise ValueError("ttl_seconds debe ser mayor que 0")
+        if max_entries < 1:
+            raise ValueError("max_entries debe ser al menos 1")
+
+        self.db_path = db_path or os.getenv(LLM_CACHE_ENV_VAR) or DEFAULT_LLM_CACHE_PATH
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    latency_ms REAL NOT NULL DEFAULT 0,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses(last_used_at)'
+            )
+
+        # Inicio de las llamadas que fallaron en la caché, para medir su latencia en update()
+        self._started: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> Optional['ResponseCache']:
+        """
+        Caché configurada por KAVAK_LLM_CACHE, o None si no está definida.
+
+        Returns:
+            Optional[ResponseCache]: Caché en ese archivo, o None
+        """
+        path = os.getenv(LLM_CACHE_ENV_VAR)
+        return cls(path) if path else None
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode('utf-8')).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        """
+        Respuesta guardada para los mensajes y la configuración del modelo.
+
+        Args:
+            prompt: Mensajes serializados por LangChain
+            llm_string: Modelo y parámetros serializados por LangChain
+
+        Returns:
+            Optional[list]: Generaciones guardadas, o None si no hay (o expiró)
+        """
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, latency_ms, created_at FROM llm_responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                with self._conn:
+                    self._conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                self._started[key] = time.perf_counter()
+                return None
+
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE llm_responses SET hits = hits + 1, last_used_at = ? WHERE key = ?', (now, key)
+                )
+            self.hits += 1
+            self.saved_seconds += row[1] / 1000
+
+        generations = []
+        for item in json.loads(row[0]):
+            message = messages_from_dict([item['message']])[0]
+            message.response_metadata = {**message.response_metadata, CACHE_HIT_METADATA_KEY: True}
+            generations.append(ChatGeneration(message=message, generation_info=item.get('generation_info')))
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: list):
+        """
+        Guarda la respuesta de una llamada y desaloja lo expirado y lo
+        menos usado si se supera max_entries. Solo se guardan respuestas
+        de modelos de chat.
+
+        Args:
+            prompt: Mensajes serializados por LangChain
+            llm_string: Modelo y parámetros serializados por LangChain
+            return_val: Generaciones de la respuesta
+        """
+        key = self._key(prompt, llm_string)
+        if not all(isinstance(generation, ChatGeneration) for generation in return_val):
+            with self._lock:
+                self._started.pop(key, None)
+            return
+
+        response = json.dumps([
+            {'message': message_to_dict(generation.message), 'generation_info': generation.generation_info}
+            for generation in return_val
+        ], ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            started = self._started.pop(key, None)
+            latency_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+            with self._conn:
+                self._conn.execute('''
+                    INSERT OR REPLACE INTO llm_responses (key, response, latency_ms, hits, created_at, last_used_at)
+                    VALUES (?, ?, ?, 0, ?, ?)
+                ''', (key, response, latency_ms, now, now))
+                self._conn.execute(
+                    'DELETE FROM llm_responses WHERE created_at < ?', (now - self.ttl_seconds,)
+                )
+                excess = self._conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self._conn.execute('''
+                        DELETE FROM llm_responses WHERE key IN (
+                            SELECT key FROM llm_responses ORDER BY last_used_at LIMIT ?
+                        )
+                    ''', (excess,))
+                    self.evictions += excess
+
+    def clear(self, **kwargs: Any):
+        """Borra todas las entradas (los contadores se conservan)."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM llm_responses')
+            self._started.clear()
+
+    def stats(self) -> Dict:
+        """
+        Estado de la caché.
+
+        Returns:
+            Dict: hits, misses, hit_rate, entries, max_entries, expired,
+                evictions y saved_seconds (latencia ahorrada por los aciertos)
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'saved_seconds': self.saved_seconds,
+            }
+
+    def close(self):
+        """Cierra la conexión a la BD de la caché."""
+        with self._lock:
+            self._conn.close()
@@ -4,34 +4,146 @@ Maneja la inicialización y configuración de OpenAI con LangChain
 """
 
 import os
+import threading
+import time
+from typing import Dict, Optional, Union
+
 import httpx
 from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI
 
+from .llm_cache import CACHE_HIT_METADATA_KEY, ResponseCache
+
+
+class LLMUsageTracker(BaseCallbackHandler):
+    """
+    Callback que acumula el uso de tokens de cada llamada al LLM, incluidos
+    los tokens de entrada servidos desde la caché de prompts del proveedor
+    (prompt_tokens_details.cached_tokens de OpenAI), y la latencia de las
+    llamadas con y sin aciertos de caché. Las respuestas servidas por
+    ResponseCache no llegan al proveedor y no se cuentan.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict = {}
+        self.reset()
+    
+    def reset(self):
+        """Pone los contadores en cero."""
+        with self._lock:
+            self.calls = 0
+            self.input_tokens = 0
+            self.cached_tokens = 0
+            self.output_tokens = 0
+            # Llamadas y segundos acumulados, con y sin tokens de caché
+            self.cached_calls = 0
+            self.cached_seconds = 0.0
+            self.uncached_seconds = 0.0
+    
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+    
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+    
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+    
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        elapsed = time.perf_counter() - started if started is not None else 0.0
+        
+        input_tokens = cached = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                if (getattr(message, 'response_metadata', None) or {}).get(CACHE_HIT_METADATA_KEY):
+                    return
+                usage = getattr(message, 'usage_metadata', None) or {}
+                input_tokens += usage.get('input_tokens', 0)
+                output_tokens += usage.get('output_tokens', 0)
+                cached += (usage.get('input_token_details') or {}).get('cache_read') or 0
+        
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.cached_tokens += cached
+            self.output_tokens += output_tokens
+            if cached:
+                self.cached_calls += 1
+                self.cached_seconds += elapsed
+            else:
+                self.uncached_seconds += elapsed
+    
+    def report(self) -> Dict:
+        """
+        Uso acumulado.
+        
+        Returns:
+            Dict: Llamadas, tokens de entrada/salida, tokens de caché, su
+                proporción y latencia promedio con y sin aciertos de caché
+        """
+        with self._lock:
+            uncached_calls = self.calls - self.cached_calls
+            return {
+                'calls': self.calls,
+                'input_tokens': self.input_tokens,
+                'cached_tokens': self.cached_tokens,
+                'output_tokens': self.output_tokens,
+                'cached_ratio': self.cached_tokens / self.input_tokens if self.input_tokens else 0.0,
+                'cached_calls': self.cached_calls,
+                'avg_ms_cached': self.cached_seconds / self.cached_calls * 1000 if self.cached_calls else 0.0,
+                'avg_ms_uncached': self.uncached_seconds / uncached_calls * 1000 if uncached_calls else 0.0,
+            }
+
 
 class LLMConfig:
     """
     Clase para configurar y obtener instancias del LLM.
     Incluye configuración anti-proxy para evitar errores.
+    
+    La caché de respuestas (ResponseCache) es opcional. Con temperatura
+    mayor que 0 se omite salvo cache_sampled: cada respuesta muestreada
+    debe generarse de nuevo (en el chat y en las evaluaciones, que miden
+    su varianza); cache_sampled solo sirve para repetir una corrida
+    exacta, p. ej. al depurar un script.
     """
     
-    def __init__(self, model: str = "gpt-3.5-turbo", temperature: float = 0.7):
+    def __init__(self, model: str = "gpt-3.5-turbo", temperature: float = 0.7,
+                 response_cache: Optional[Union[ResponseCache, bool]] = None,
+                 cache_sampled: bool = False):
         """
         Inicializa la configuración del LLM.
         
         Args:
             model: Modelo de OpenAI a usar
             temperature: Temperatura para la generación (0.0-1.0)
+            response_cache: Caché de respuestas; None = la de KAVAK_LLM_CACHE
+                (desactivada si no está definida), True = ResponseCache()
+                por defecto, False = desactivada
+            cache_sampled: Usar la caché también con temperatura > 0
         """
         self.model = model
         self.temperature = temperature
+        self.cache_sampled = cache_sampled
         self._llm_instance = None
+        # Tokens (incluidos los de caché del proveedor) de todas las llamadas
+        self.usage = LLMUsageTracker()
         
         # Cargar variables de entorno
         load_dotenv()
         
         # Limpiar variables de proxy
         self._clear_proxy_variables()
+        
+        # Caché de respuestas (después de .env, que puede definir KAVAK_LLM_CACHE)
+        if response_cache is None:
+            response_cache = ResponseCache.from_env()
+        elif response_cache is True:
+            response_cache = ResponseCache()
+        self.response_cache: Optional[ResponseCache] = response_cache or None
     
     def _clear_proxy_variables(self):
         """Limpia variables de proxy del entorno para evitar conflictos."""
@@ -40,6 +152,11 @@ class LLMConfig:
         os.environ.pop('http_proxy', None)
         os.environ.pop('https_proxy', None)
     
+    @property
+    def response_cache_active(self) -> bool:
+        """Si las llamadas de get_llm() pasan por la caché de respuestas."""
+        return self.response_cache is not None and (self.temperature == 0 or self.cache_sampled)
+    
     def get_llm(self) -> ChatOpenAI:
         """
         Obtiene una instancia configurada del LLM.
@@ -58,11 +175,26 @@ class LLMConfig:
                 model=self.model,
                 temperature=self.temperature,
                 http_client=sync_client,
-                http_async_client=async_client
+                http_async_client=async_client,
+                callbacks=[self.usage],
+                cache=self.response_cache if self.response_cache_active else None
             )
         
         return self._llm_instance
     
+    def get_usage_report(self) -> Dict:
+        """
+        Uso de tokens de las llamadas hechas con este LLM, para medir el
+        efecto de la caché de prompts del proveedor (ver LLMUsageTracker).
+        
+        Returns:
+            Dict: Reporte de LLMUsageTracker.report(), con response_cache
+                (ResponseCache.stats(), o None si la caché no está activa)
+        """
+        report = self.usage.report()
+        report['response_cache'] = self.response_cache.stats() if self.response_cache_active else None
+        return report
+    
     @staticmethod
     def create_default() -> 'LLMConfig':
         """
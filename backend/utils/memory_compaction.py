@@ -0,0 +1,174 @@
+"""
+Compactación de Memoria de Usuarios
+Cuando un usuario acumula demasiadas memorias, consolida las más
+antiguas en una sola usando el Agente Resumidor.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .storage import StorageBackend
+
+
+class MemoryCompactor:
+    """
+    Consolida las memorias antiguas de cada usuario para que el prompt
+    del sistema no crezca sin límite. Los originales quedan archivados
+    en user_memory_archive.
+    """
+
+    def __init__(self, db_manager: StorageBackend, summarizer_agent,
+                 max_memories: int = 20, keep_recent: int = 5):
+        """
+        Inicializa el compactador.
+
+        Args:
+            db_manager: Backend de almacenamiento
+            summarizer_agent: Instancia de SummarizerAgent (usa consolidate_memories)
+            max_memories: Se compacta al superar este número de memorias
+            keep_recent: Memorias más recientes que se conservan sin consolidar
+        """
+        if keep_recent >= max_memories:
+            raise ValueError("keep_recent debe ser menor que max_memories")
+
+        self.db_manager = db_manager
+        self.summarizer_agent = summarizer_agent
+        self.max_memories = max_memories
+        self.keep_recent = keep_recent
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # Usuarios con una compactación en curso o pendiente
+        self._in_flight = set()
+
+    def needs_compaction(self, user_id: str) -> bool:
+        """
+        Indica si el usuario supera el límite de memorias.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            bool: True si hay que compactar
+        """
+        return self.db_manager.count_user_memories(user_id) > self.max_memories
+
+    def compact_user(self, user_id: str) -> Dict:
+        """
+        Compacta las memorias de un usuario si supera el límite. El
+        resumidor las fusiona por tandas que caben en su presupuesto de
+        tokens, así un usuario con muchas memorias también se compacta.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            Dict: user_id, memorias consolidadas y memoria resultante (o None)
+        """
+        memories = list(self.db_manager.iter_user_memory(user_id))
+        if len(memories) <= self.max_memories:
+            return {'user_id': user_id, 'folded': 0, 'memory_id': None}
+
+        to_fold = memories[:len(memories) - self.keep_recent]
+        consolidated = self.summarizer_agent.consolidate_memories(
+            [memory['context'] for memory in to_fold]
+        )
+        memory_id = self.db_manager.compact_user_memory(
+            user_id, [memory['id'] for memory in to_fold], consolidated
+        )
+
+        return {'user_id': user_id, 'folded': len(to_fold), 'memory_id': memory_id}
+
+    def run_batch(self, verbose: bool = True) -> Dict:
+        """
+        Compacta a todos los usuarios que superan el límite.
+
+        Args:
+            verbose: Imprimir progreso y throughput
+
+        Returns:
+            Dict: Usuarios procesados, memorias consolidadas, errores y tiempos
+        """
+        candidates = self.db_manager.get_users_over_memory_limit(self.max_memories)
+        if verbose:
+            print(f"\n[Compactación: {len(candidates)} usuarios superan {self.max_memories} memorias]")
+
+        start = time.perf_counter()
+        users_compacted = 0
+        memories_folded = 0
+        errors: List[str] = []
+
+        for user_id, total in candidates:
+            try:
+                result = self.compact_user(user_id)
+            except Exception as e:
+                errors.append(user_id)
+                if verbose:
+                    print(f"   ✗ {user_id}: {str(e)}")
+                continue
+
+            if result['folded']:
+                users_compacted += 1
+                memories_folded += result['folded']
+                if verbose:
+                    print(f"   ✓ {user_id}: {total} → {total - result['folded'] + 1} memorias")
+
+        elapsed = time.perf_counter() - start
+        report = {
+            'users_compacted': users_compacted,
+            'memories_folded': memories_folded,
+            'errors': errors,
+            'elapsed_seconds': elapsed,
+            'users_per_second': users_compacted / elapsed if elapsed > 0 else 0.0,
+            'memories_per_second': memories_folded / elapsed if elapsed > 0 else 0.0,
+        }
+
+        if verbose:
+            print(f"\n   Usuarios compactados: {users_compacted} | Memorias consolidadas: {memories_folded}")
+            print(f"   Tiempo: {elapsed:.1f} s | {report['users_per_second']:.2f} usuarios/s | "
+                  f"{report['memories_per_second']:.1f} memorias/s")
+            if errors:
+                print(f"   Errores: {len(errors)}")
+
+        return report
+
+    def schedule(self, user_id: str) -> Optional[Future]:
+        """
+        Compacta al usuario en segundo plano si supera el límite.
+        No bloquea el flujo del chat; las llamadas repetidas para un
+        usuario que ya está en cola se ignoran.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            Future: Resultado de compact_user, o None si no hizo falta
+        """
+        if user_id in self._in_flight or not self.needs_compaction(user_id):
+            return None
+
+        with self._executor_lock:
+            if user_id in self._in_flight:
+                return None
+            self._in_flight.add(user_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='memory-compactor')
+
+        future = self._executor.submit(self.compact_user, user_id)
+        future.add_done_callback(lambda _: self._in_flight.discard(user_id))
+        return future
+
+    def shutdown(self, wait: bool = True):
+        """
+        Detiene el hilo de compactación en segundo plano.
+
+        Args:
+            wait: Esperar a que terminen las compactaciones en curso
+        """
+        with self._executor_lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait)
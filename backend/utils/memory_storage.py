@@ -0,0 +1,596 @@
+"""
+Almacenamiento en Memoria
+Implementación de StorageBackend sin disco, para pruebas de carga,
+evaluaciones y ejecuciones efímeras.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .retention import LEGACY_CREATED_AT
+from .storage import StorageBackend
+from .text_search import BM25Index
+
+
+def _timestamp() -> str:
+    """Marca de tiempo con el mismo formato que CURRENT_TIMESTAMP de SQLite."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Columnas de cada tabla del snapshot, en el orden del esquema SQLite
+_SNAPSHOT_COLUMNS = {
+    'users': ('user_id', 'username', 'created_at'),
+    'prompt_rules': ('id', 'rule_text', 'error_category', 'validation_score', 'created_at', 'content_hash'),
+    'prompt_rules_archive': ('id', 'rule_text', 'error_category', 'validation_score', 'created_at',
+                             'consolidated_into', 'archived_at'),
+    'rule_usage': ('rule_id', 'injected', 'positive', 'negative', 'last_injected_at', 'last_positive_at'),
+    'user_memory': ('id', 'user_id', 'context', 'created_at'),
+    'user_memory_archive': ('id', 'user_id', 'context', 'consolidated_into', 'archived_at'),
+}
+
+
+def _empty_usage() -> Dict:
+    """Contadores de uso de una regla que nunca se usó."""
+    return {'injected': 0, 'positive': 0, 'negative': 0,
+            'last_injected_at': None, 'last_positive_at': None}
+
+
+class InMemoryStorage(StorageBackend):
+    """
+    Backend en memoria con la misma semántica que DatabaseManager:
+    deduplicación de reglas por hash de contenido, IDs crecientes,
+    generación de reglas y archivo de memorias compactadas.
+    Es seguro entre hilos; los datos se pierden al terminar el proceso.
+    """
+
+    def __init__(self):
+        """Inicializa las estructuras vacías."""
+        self._lock = threading.RLock()
+        self._users: Dict[str, str] = {}
+        self._user_created_at: Dict[str, str] = {}
+        # id -> regla (los dicts preservan el orden de inserción = orden por id)
+        self._rules: Dict[int, Dict] = {}
+        self._rule_ids_by_hash: Dict[str, int] = {}
+        self._memories: Dict[int, Dict] = {}
+        self._memory_ids_by_user: Dict[str, List[int]] = {}
+        self._memory_archive: List[Dict] = []
+        self._rule_archive: List[Dict] = []
+        # rule_id -> contadores de uso (tabla rule_usage en SQLite)
+        self._rule_usage: Dict[int, Dict] = {}
+        # user_id -> versión de su memoria (solo crece)
+        self._memory_versions: Dict[str, int] = {}
+        self._next_rule_id = 1
+        self._next_memory_id = 1
+        self._rules_generation = 0
+        self._rules_snapshot: Optional[Tuple[int, Tuple[Dict, ...], str]] = None
+        # Contadores de get_system_stats, igual que system_counters en SQLite
+        self._category_counts: Dict[str, int] = {}
+        self._score_sum = 0.0
+        self._score_count = 0
+        self._rules_index: Optional[Tuple[int, BM25Index]] = None
+
+    # ==================== USUARIOS ====================
+
+    def create_user(self, user_id: str, username: str) -> bool:
+        with self._lock:
+            if user_id in self._users:
+                return False
+            self._users[user_id] = username
+            self._user_created_at[user_id] = _timestamp()
+            return True
+
+    def user_exists(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def get_username(self, user_id: str) -> Optional[str]:
+        return self._users.get(user_id)
+
+    # ==================== REGLAS ====================
+
+    def get_rules_version(self) -> int:
+        return self._rules_generation
+
+    def get_all_rules(self) -> str:
+        return self._get_rules_snapshot()[2]
+
+    def get_rules_snapshot(self) -> Tuple[Dict, ...]:
+        return self._get_rules_snapshot()[1]
+
+    def _get_rules_snapshot(self) -> Tuple[int, Tuple[Dict, ...], str]:
+        with self._lock:
+            if self._rules_snapshot is None or self._rules_snapshot[0] != self._rules_generation:
+                rules = tuple(
+                    {'id': rule['id'], 'rule_text': rule['rule_text'],
+                     'error_category': rule['error_category'],
+                     'validation_score': rule['validation_score']}
+                    for rule in self._rules.values()
+                )
+                self._rules_snapshot = (
+                    self._rules_generation, rules, '\n'.join(rule['rule_text'] for rule in rules)
+                )
+            return self._rules_snapshot
+
+    def rule_exists(self, rule_text: str) -> bool:
+        return self.rule_content_hash(rule_text) in self._rule_ids_by_hash
+
+    def save_rule(self, rule_text: str, error_category: str = 'general',
+                  validation_score: float = 0.0) -> int:
+        with self._lock:
+            return self._insert_rule(rule_text, error_category, validation_score)
+
+    def save_rules_bulk(self, rules: List[Tuple[str, str, float]]) -> List[int]:
+        with self._lock:
+            return [
+                self._insert_rule(rule_text, error_category, validation_score)
+                for rule_text, error_category, validation_score in rules
+            ]
+
+    def _insert_rule(self, rule_text: str, error_category: str, validation_score: float) -> int:
+        content_hash = self.rule_content_hash(rule_text)
+        existing = self._rule_ids_by_hash.get(content_hash)
+        if existing is not None:
+            return existing
+
+        rule_id = self._next_rule_id
+        self._next_rule_id += 1
+        self._rules[rule_id] = {
+            'id': rule_id,
+            'rule_text': rule_text,
+            'error_category': error_category,
+            'validation_score': validation_score,
+            'created_at': _timestamp(),
+        }
+        self._rule_ids_by_hash[content_hash] = rule_id
+        self._rules_generation += 1
+
+        if error_category is not None:
+            self._category_counts[error_category] = self._category_counts.get(error_category, 0) + 1
+        if validation_score and validation_score > 0:
+            self._score_sum += validation_score
+            self._score_count += 1
+        return rule_id
+
+    def iter_rules(self, batch_size: int = 100, order_by: str = 'id',
+                   descending: bool = False) -> Iterator[Dict]:
+        if order_by not in self.RULE_ORDER_FIELDS:
+            raise ValueError(f"order_by inválido: {order_by}")
+
+        with self._lock:
+            rules = [dict(rule) for rule in self._rules.values()]
+
+        if order_by != 'id':
+            default = 0.0 if order_by == 'validation_score' else ''
+            rules.sort(key=lambda rule: (
+                rule[order_by] if rule[order_by] is not None else default, rule['id']
+            ))
+        if descending:
+            rules.reverse()
+        return iter(rules)
+
+    def get_rules_by_category(self, category: str) -> List[str]:
+        with self._lock:
+            return [rule['rule_text'] for rule in self._rules.values()
+                    if rule['error_category'] == category]
+
+    def search_rules(self, query: str, k: int = 5) -> List[Dict]:
+        with self._lock:
+            # El índice se reconstruye solo cuando cambian las reglas
+            if self._rules_index is None or self._rules_index[0] != self._rules_generation:
+                index = BM25Index((rule_id, rule['rule_text']) for rule_id, rule in self._rules.items())
+                self._rules_index = (self._rules_generation, index)
+            index = self._rules_index[1]
+            rules = self._rules
+
+            results = []
+            for rule_id, score in index.top_k(query, k):
+                rule = rules[rule_id]
+                # Mismo criterio que FTS5: menor score = más relevante
+                results.append({
+                    'id': rule_id, 'rule_text': rule['rule_text'],
+                    'error_category': rule['error_category'],
+                    'validation_score': rule['validation_score'], 'score': -score,
+                })
+            return results
+
+    def consolidate_rules(self, canonical_id: int, duplicate_ids: List[int]) -> int:
+        duplicate_ids = sorted(set(duplicate_ids) - {canonical_id})
+        if not duplicate_ids:
+            return 0
+
+        with self._lock:
+            if canonical_id not in self._rules or any(rule_id not in self._rules for rule_id in duplicate_ids):
+                # Otra consolidación se adelantó o alguna regla ya no existe
+                raise ValueError("Las reglas a consolidar cambiaron")
+
+            folded = set(duplicate_ids)
+            for archived in self._rule_archive:
+                if archived['consolidated_into'] in folded:
+                    archived['consolidated_into'] = canonical_id
+
+            archived_at = _timestamp()
+            best = self._rules[canonical_id]['validation_score'] or 0.0
+            for rule_id in duplicate_ids:
+                rule = self._rules.pop(rule_id)
+                self._rule_archive.append(dict(rule, consolidated_into=canonical_id, archived_at=archived_at))
+                del self._rule_ids_by_hash[self.rule_content_hash(rule['rule_text'])]
+                self._discount_rule(rule)
+                best = max(best, rule['validation_score'] or 0.0)
+
+            self._fold_rule_usage(canonical_id, duplicate_ids)
+            canonical = self._rules[canonical_id]
+            if (canonical['validation_score'] or 0.0) < best:
+                self._discount_rule(canonical)
+                canonical['validation_score'] = best
+                self._score_sum += best
+                self._score_count += 1
+                if canonical['error_category'] is not None:
+                    self._category_counts[canonical['error_category']] = (
+                        self._category_counts.get(canonical['error_category'], 0) + 1
+                    )
+            self._rules_generation += 1
+        return len(duplicate_ids)
+
+    def _discount_rule(self, rule: Dict):
+        """Descuenta una regla de los contadores de get_system_stats."""
+        category = rule['error_category']
+        if category is not None:
+            self._category_counts[category] -= 1
+            if not self._category_counts[category]:
+                del self._category_counts[category]
+        if rule['validation_score'] and rule['validation_score'] > 0:
+            self._score_sum -= rule['validation_score']
+            self._score_count -= 1
+
+    def _fold_rule_usage(self, canonical_id: int, duplicate_ids: List[int]):
+        """Suma el uso de las reglas absorbidas al de la canónica."""
+        folded = [self._rule_usage.pop(rule_id) for rule_id in duplicate_ids if rule_id in self._rule_usage]
+        if not folded:
+            return
+        usage = self._rule_usage.setdefault(canonical_id, _empty_usage())
+        for other in folded:
+            for counter in ('injected', 'positive', 'negative'):
+                usage[counter] += other[counter]
+            for moment in ('last_injected_at', 'last_positive_at'):
+                usage[moment] = max(filter(None, (usage[moment], other[moment])), default=None)
+
+    def record_rule_usage(self, deltas: List[Tuple[int, int, int, int]]):
+        now = _timestamp()
+        with self._lock:
+            for rule_id, injected, positive, negative in deltas:
+                if rule_id not in self._rules:
+                    continue
+                usage = self._rule_usage.setdefault(rule_id, _empty_usage())
+                usage['injected'] += injected
+                usage['positive'] += positive
+                usage['negative'] += negative
+                if injected > 0:
+                    usage['last_injected_at'] = now
+                if positive > 0:
+                    usage['last_positive_at'] = now
+
+    def get_rule_usage(self) -> Dict[int, Dict]:
+        with self._lock:
+            return {
+                rule_id: dict(self._rule_usage.get(rule_id) or _empty_usage(), created_at=rule['created_at'])
+                for rule_id, rule in self._rules.items()
+            }
+
+    def get_rule_provenance(self, rule_id: int) -> List[Dict]:
+        with self._lock:
+            return [
+                {key: rule[key] for key in ('id', 'rule_text', 'error_category',
+                                            'validation_score', 'created_at', 'archived_at')}
+                for rule in sorted(self._rule_archive, key=lambda rule: rule['id'])
+                if rule['consolidated_into'] == rule_id
+            ]
+
+    # ==================== MEMORIA ====================
+
+    def get_user_memory_version(self, user_id: str) -> int:
+        return self._memory_versions.get(user_id, 0)
+
+    def _bump_memory_versions(self, user_ids):
+        for user_id in user_ids:
+            self._memory_versions[user_id] = self._memory_versions.get(user_id, 0) + 1
+
+    def iter_user_memory(self, user_id: str, limit: Optional[int] = None,
+                         newest_first: bool = False, batch_size: int = 100) -> Iterator[Dict]:
+        with self._lock:
+            memory_ids = list(self._memory_ids_by_user.get(user_id, ()))
+            if newest_first:
+                memory_ids.reverse()
+            if limit is not None:
+                memory_ids = memory_ids[:limit]
+            memories = [
+                {'id': memory_id, 'context': self._memories[memory_id]['context']}
+                for memory_id in memory_ids
+            ]
+        return iter(memories)
+
+    def save_user_memory(self, user_id: str, context: str) -> int:
+        with self._lock:
+            return self._insert_memory(user_id, context)
+
+    def save_memories_bulk(self, memories: List[Tuple[str, str]]) -> List[int]:
+        with self._lock:
+            return [self._insert_memory(user_id, context) for user_id, context in memories]
+
+    def _insert_memory(self, user_id: str, context: str) -> int:
+        memory_id = self._next_memory_id
+        self._next_memory_id += 1
+        self._memories[memory_id] = {
+            'id': memory_id, 'user_id': user_id, 'context': context, 'created_at': _timestamp(),
+        }
+        self._memory_ids_by_user.setdefault(user_id, []).append(memory_id)
+        self._bump_memory_versions((user_id,))
+        return memory_id
+
+    def count_user_memories(self, user_id: str) -> int:
+        return len(self._memory_ids_by_user.get(user_id, ()))
+
+    def count_users_with_memories(self) -> int:
+        with self._lock:
+            return sum(1 for memory_ids in self._memory_ids_by_user.values() if memory_ids)
+
+    def get_users_over_memory_limit(self, max_memories: int) -> List[Tuple[str, int]]:
+        with self._lock:
+            over_limit = [
+                (user_id, len(memory_ids))
+                for user_id, memory_ids in self._memory_ids_by_user.items()
+                if len(memory_ids) > max_memories
+            ]
+        return sorted(over_limit, key=lambda item: -item[1])
+
+    def compact_user_memory(self, user_id: str, memory_ids: List[int],
+                            consolidated_context: str) -> int:
+        if not memory_ids:
+            raise ValueError("No hay memorias para consolidar")
+
+        memory_ids = sorted(memory_ids)
+        target_id = memory_ids[0]
+        with self._lock:
+            owned = [memory_id for memory_id in memory_ids
+                     if self._memories.get(memory_id, {}).get('user_id') == user_id]
+            if len(owned) != len(memory_ids):
+                # Otra compactación se adelantó o los IDs no son de este usuario
+                raise ValueError("Las memorias a consolidar cambiaron")
+
+            archived_at = _timestamp()
+            for memory_id in memory_ids:
+                self._memory_archive.append({
+                    'id': memory_id, 'user_id': user_id,
+                    'context': self._memories[memory_id]['context'],
+                    'consolidated_into': target_id, 'archived_at': archived_at,
+                })
+
+            # Igual que en SQLite: la consolidada toma la fecha de la más reciente
+            newest = max(self._memories[memory_id]['created_at'] for memory_id in memory_ids)
+            folded = set(memory_ids[1:])
+            for memory_id in folded:
+                del self._memories[memory_id]
+            self._memory_ids_by_user[user_id] = [
+                memory_id for memory_id in self._memory_ids_by_user[user_id]
+                if memory_id not in folded
+            ]
+            self._memories[target_id].update(context=consolidated_context, created_at=newest)
+            self._bump_memory_versions((user_id,))
+        return target_id
+
+    def search_user_memory(self, user_id: str, query: str, k: int = 5) -> List[Dict]:
+        with self._lock:
+            documents = [
+                (memory_id, self._memories[memory_id]['context'])
+                for memory_id in self._memory_ids_by_user.get(user_id, ())
+            ]
+        contexts = dict(documents)
+        return [
+            {'id': memory_id, 'context': contexts[memory_id], 'score': -score}
+            for memory_id, score in BM25Index(documents).top_k(query, k)
+        ]
+
+    # ==================== MÉTRICAS ====================
+
+    def get_system_stats(self) -> Dict[str, any]:
+        with self._lock:
+            return {
+                'total_rules': len(self._rules),
+                'total_users': len(self._users),
+                'total_memories': len(self._memories),
+                'error_distribution': dict(sorted(self._category_counts.items())),
+                'avg_validation_score': (self._score_sum / self._score_count) if self._score_count else 0.0
+            }
+
+    # ==================== UTILIDADES ====================
+
+    def clear_all_rules(self, verbose: bool = True):
+        with self._lock:
+            self._clear_rules()
+        if verbose:
+            print("✓ Todas las reglas han sido eliminadas")
+
+    def clear_all_memories(self, verbose: bool = True):
+        with self._lock:
+            self._bump_memory_versions(self._memory_ids_by_user)
+            self._memories.clear()
+            self._memory_ids_by_user.clear()
+        if verbose:
+            print("✓ Todas las memorias han sido eliminadas")
+
+    def reset_database(self, verbose: bool = True):
+        if verbose:
+            print("\n⚠️  RESETEO COMPLETO DE LA BASE DE DATOS")
+            print("="*60)
+
+        with self._lock:
+            if verbose:
+                print(f"Reglas a eliminar: {len(self._rules)}")
+                print(f"Memorias a eliminar: {len(self._memories)}")
+
+            self._clear_rules()
+            self._bump_memory_versions(self._memory_ids_by_user)
+            self._memories.clear()
+            self._memory_ids_by_user.clear()
+            self._users.clear()
+            self._user_created_at.clear()
+            self._next_rule_id = 1
+            self._next_memory_id = 1
+
+        if verbose:
+            print("\n✅ Base de datos reseteada completamente a 0")
+            print("="*60)
+
+    # ==================== SNAPSHOTS ====================
+
+    def export_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Exporta el estado con el formato de DatabaseManager, para cargarlo
+        en cualquier backend: JSON por líneas con gzip o, con extensión
+        .db/.sqlite/.sqlite3, una BD SQLite (se escribe el JSON en un
+        temporal y se importa en ella).
+
+        Args:
+            path: Archivo de destino
+
+        Returns:
+            Dict[str, int]: Filas exportadas por tabla
+        """
+        from .database import DatabaseManager
+        from .retention import RetentionPolicy
+
+        if path.lower().endswith(DatabaseManager.SQLITE_SNAPSHOT_EXTENSIONS):
+            descriptor, temporary = tempfile.mkstemp(suffix='.jsonl.gz')
+            os.close(descriptor)
+            try:
+                self.export_snapshot(temporary)
+                with DatabaseManager(path, retention=RetentionPolicy()) as target:
+                    return target.import_snapshot(temporary)
+            finally:
+                os.remove(temporary)
+
+        with self._lock:
+            tables = {
+                'users': [[user_id, username, self._user_created_at.get(user_id)]
+                          for user_id, username in self._users.items()],
+                'prompt_rules': [
+                    [rule['id'], rule['rule_text'], rule['error_category'], rule['validation_score'],
+                     rule['created_at'], self.rule_content_hash(rule['rule_text'])]
+                    for rule in self._rules.values()
+                ],
+                'prompt_rules_archive': [
+                    [rule[column] for column in _SNAPSHOT_COLUMNS['prompt_rules_archive']]
+                    for rule in self._rule_archive
+                ],
+                'rule_usage': [
+                    [rule_id] + [usage[column] for column in _SNAPSHOT_COLUMNS['rule_usage'][1:]]
+                    for rule_id, usage in self._rule_usage.items()
+                ],
+                'user_memory': [
+                    [memory[column] for column in _SNAPSHOT_COLUMNS['user_memory']]
+                    for memory in self._memories.values()
+                ],
+                'user_memory_archive': [
+                    [memory[column] for column in _SNAPSHOT_COLUMNS['user_memory_archive']]
+                    for memory in self._memory_archive
+                ],
+            }
+
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as out:
+            out.write(encoder.encode(DatabaseManager.snapshot_header()) + '\n')
+            for table in DatabaseManager.SNAPSHOT_TABLES:
+                out.write(encoder.encode({'table': table, 'columns': list(_SNAPSHOT_COLUMNS[table])}) + '\n')
+                out.write(''.join(encoder.encode(row) + '\n' for row in tables[table]))
+        return {table: len(rows) for table, rows in tables.items()}
+
+    def import_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Reemplaza usuarios, reglas y memorias por los de un snapshot de
+        cualquier backend (JSON por líneas o copia SQLite). El snapshot se
+        lee completo antes de reemplazar: si falla, el estado no cambia.
+
+        Args:
+            path: Archivo del snapshot
+
+        Returns:
+            Dict[str, int]: Filas importadas por tabla
+        """
+        from .database import DatabaseManager
+
+        tables: Dict[str, List[Dict]] = {}
+        for table, columns, rows in DatabaseManager.read_snapshot(path):
+            tables.setdefault(table, []).extend(dict(zip(columns, row)) for row in rows)
+
+        def rows_of(table: str) -> List[Dict]:
+            return sorted(tables.get(table, ()), key=lambda row: row.get('id', 0))
+
+        with self._lock:
+            previous_users = list(self._memory_ids_by_user)
+            self._clear_rules()
+            self._memories.clear()
+            self._memory_ids_by_user.clear()
+            self._memory_archive.clear()
+            self._users.clear()
+            self._user_created_at.clear()
+
+            for row in tables.get('users', ()):
+                self._users[row['user_id']] = row['username']
+                self._user_created_at[row['user_id']] = row.get('created_at')
+
+            for row in rows_of('prompt_rules'):
+                rule = {column: row.get(column) for column in
+                        ('id', 'rule_text', 'error_category', 'validation_score', 'created_at')}
+                self._rules[rule['id']] = rule
+                self._rule_ids_by_hash[self.rule_content_hash(rule['rule_text'])] = rule['id']
+                if rule['error_category'] is not None:
+                    self._category_counts[rule['error_category']] = (
+                        self._category_counts.get(rule['error_category'], 0) + 1
+                    )
+                if rule['validation_score'] and rule['validation_score'] > 0:
+                    self._score_sum += rule['validation_score']
+                    self._score_count += 1
+            self._rule_archive.extend(
+                {column: row.get(column) for column in _SNAPSHOT_COLUMNS['prompt_rules_archive']}
+                for row in rows_of('prompt_rules_archive')
+            )
+            for row in tables.get('rule_usage', ()):
+                if row['rule_id'] in self._rules:
+                    self._rule_usage[row['rule_id']] = {
+                        column: row.get(column) for column in _SNAPSHOT_COLUMNS['rule_usage'][1:]
+                    }
+
+            for row in rows_of('user_memory'):
+                # Memorias de snapshots anteriores a v7: sin fecha conocida
+                self._memories[row['id']] = {
+                    'id': row['id'], 'user_id': row['user_id'], 'context': row['context'],
+                    'created_at': row.get('created_at') or LEGACY_CREATED_AT,
+                }
+                self._memory_ids_by_user.setdefault(row['user_id'], []).append(row['id'])
+            self._memory_archive.extend(
+                {column: row.get(column) for column in _SNAPSHOT_COLUMNS['user_memory_archive']}
+                for row in rows_of('user_memory_archive')
+            )
+
+            self._next_rule_id = max([self._next_rule_id - 1, *self._rules,
+                                      *(rule['id'] for rule in self._rule_archive)]) + 1
+            self._next_memory_id = max([self._next_memory_id - 1, *self._memories,
+                                        *(memory['id'] for memory in self._memory_archive)]) + 1
+            self._rules_generation += 1
+            self._bump_memory_versions(set(previous_users) | set(self._memory_ids_by_user))
+
+        return {table: len(rows) for table, rows in tables.items()}
+
+    def _clear_rules(self):
+        self._rule_archive.clear()
+        self._rule_usage.clear()
+        if self._rules:
+            self._rules.clear()
+            self._rule_ids_by_hash.clear()
+            self._category_counts.clear()
+            self._score_sum = 0.0
+            self._score_count = 0
+            self._rules_generation += 1
@@ -214,3 +214,55 @@ class MetricsCalculator:
         print("\n" + "="*70)
         print("Fin del Reporte de Métricas")
         print("="*70 + "\n")
+    
+    @staticmethod
+    def display_database_metrics(report: Dict):
+        """
+        Muestra las mediciones de acceso a datos (KAVAK_DB_INSTRUMENT=1).
+        
+        Args:
+            report: Reporte de get_instrumentation_report()
+        """
+        print("\n" + "="*70)
+        print("🗄️  ACCESO A DATOS POR MÉTODO")
+        print("="*70)
+        print(f"\n   Conexiones abiertas: {report['connections_opened']}\n")
+        print(f"   {'Método':<28}{'Llamadas':>9}{'p50 ms':>9}{'p95 ms':>9}{'Total ms':>10}{'SQL':>7}{'Filas':>8}")
+        print("   " + "─"*80)
+        
+        for name, method in report['methods'].items():
+            print(f"   {name[:27]:<28}{method['calls']:>9}{method['p50_ms']:>9.2f}{method['p95_ms']:>9.2f}"
+                  f"{method['total_ms']:>10.1f}{method['statements']:>7}{method['rows']:>8}")
+        
+        if report['statements']:
+            print("\n   Sentencias más costosas:")
+            for statement in report['statements']:
+                print(f"   {statement['total_ms']:>9.1f} ms  x{statement['calls']:<6} {statement['sql'][:50]}")
+        
+        print("\n" + "="*70 + "\n")
+    
+    @staticmethod
+    def display_llm_usage(report: Dict):
+        """
+        Muestra el uso de tokens del LLM y el aprovechamiento de la caché
+        de prompts del proveedor.
+        
+        Args:
+            report: Reporte de LLMConfig.get_usage_report()
+        """
+        print("\n" + "="*70)
+        print("🧾 USO DEL LLM")
+        print("="*70)
+        print(f"\n   Llamadas: {report['calls']}")
+        print(f"   Tokens de entrada: {report['input_tokens']} "
+              f"(desde caché: {report['cached_tokens']}, {report['cached_ratio'] * 100:.1f}%)")
+        print(f"   Tokens de salida: {report['output_tokens']}")
+        if report['cached_calls']:
+            print(f"   Latencia promedio: {report['avg_ms_cached']:.0f} ms con caché | "
+                  f"{report['avg_ms_uncached']:.0f} ms sin caché")
+        response_cache = report.get('response_cache')
+        if response_cache:
+            print(f"   Caché de respuestas: {response_cache['hits']} aciertos | "
+                  f"{response_cache['misses']} fallos ({response_cache['hit_rate'] * 100:.1f}%) | "
+                  f"latencia ahorrada {response_cache['saved_seconds']:.1f} s")
+        print("\n" + "="*70 + "\n")
@@ -0,0 +1,287 @@
+"""
+Presupuesto de Tokens del Prompt
+Cuenta tokens con un tokenizador local y arma los mensajes que se envían
+al LLM sin superar un presupuesto fijo, repartiéndolo por prioridad entre
+el prompt base, las secciones (reglas, memoria) y el historial reciente.
+"""
+
+import math
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
+
+
+# Variable de entorno con el presupuesto de tokens del prompt
+PROMPT_MAX_TOKENS_ENV_VAR = 'KAVAK_PROMPT_MAX_TOKENS'
+DEFAULT_PROMPT_MAX_TOKENS = 6000
+
+# Formato de chat de OpenAI: tokens fijos por mensaje y para iniciar la respuesta
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con tiktoken (la codificación del modelo). Si tiktoken
+    no está instalado o no tiene la codificación en caché (se descarga la
+    primera vez), usa una estimación conservadora de ~3.5 caracteres por token.
+    """
+
+    # Caracteres por token de la estimación (español, por lo bajo)
+    CHARS_PER_TOKEN = 3.5
+
+    def __init__(self, model: str = "gpt-3.5-turbo"):
+        """
+        Inicializa el contador (la codificación se carga al primer uso).
+
+        Args:
+            model: Modelo cuyo tokenizador se usa
+        """
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+
+    def _get_encoding(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                import tiktoken
+                self._encoding = tiktoken.encoding_for_model(self.model)
+            except Exception:
+                self._encoding = None
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        """Indica si el conteo usa el tokenizador real del modelo."""
+        return self._get_encoding() is not None
+
+    def count(self, text: str) -> int:
+        """
+        Cuenta los tokens de un texto.
+
+        Args:
+            text: Texto a medir
+
+        Returns:
+            int: Número de tokens
+        """
+        if not text:
+            return 0
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text))
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+
+    def count_message(self, message: BaseMessage) -> int:
+        """Tokens de un mensaje de chat, incluido el formato."""
+        return self.count(message.content) + TOKENS_PER_MESSAGE
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Recorta un texto a un máximo de tokens (conserva el inicio).
+
+        Args:
+            text: Texto original
+            max_tokens: Tokens máximos
+
+        Returns:
+            str: Texto recortado, con "…" al final si se cortó
+        """
+        if self.count(text) <= max_tokens:
+            return text
+        if max_tokens <= 1:
+            return ''
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return encoding.decode(encoding.encode(text)[:max_tokens - 1]) + '…'
+        return text[:int((max_tokens - 1) * self.CHARS_PER_TOKEN)] + '…'
+
+
+class PromptSection:
+    """
+    Parte del prompt del sistema formada por elementos que se pueden
+    descartar uno a uno (reglas, líneas de memoria).
+    """
+
+    def __init__(self, name: str, items: Sequence[str], header: str = '',
+                 keep_latest: bool = False):
+        """
+        Args:
+            name: Nombre de la sección en el reporte
+            items: Elementos en orden de aparición
+            header: Encabezado (se omite si no queda ningún elemento)
+            keep_latest: Al recortar, conservar los últimos elementos
+                (memoria cronológica) en vez de los primeros (reglas)
+        """
+        self.name = name
+        self.items = list(items)
+        self.header = header
+        self.keep_latest = keep_latest
+
+    def render(self, items: Sequence[str]) -> str:
+        """Texto de la sección con los elementos dados."""
+        body = '\n'.join(items)
+        return f"{self.header}\n{body}" if self.header else body
+
+
+class PromptAssembler:
+    """
+    Arma los mensajes de una llamada al LLM dentro de un presupuesto de
+    tokens. Prioridad, de mayor a menor:
+
+    1. Prompt base (nunca se recorta)
+    2. Último mensaje del usuario (se trunca solo si no cabe entero)
+    3. Secciones del prompt del sistema, en el orden recibido
+    4. Secciones de cola (van en un mensaje del sistema justo antes del
+       último mensaje del usuario, fuera del prefijo estable)
+    5. Historial anterior, de lo más reciente a lo más antiguo
+
+    Compartido por los tres agentes; cada llamada deja un reporte de lo
+    que se recortó.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, counter: Optional[TokenCounter] = None):
+        """
+        Inicializa el ensamblador.
+
+        Args:
+            max_tokens: Presupuesto del prompt (por defecto KAVAK_PROMPT_MAX_TOKENS o 6000)
+            counter: Contador de tokens (por defecto el de gpt-3.5-turbo)
+        """
+        if max_tokens is None:
+            max_tokens = int(os.getenv(PROMPT_MAX_TOKENS_ENV_VAR) or DEFAULT_PROMPT_MAX_TOKENS)
+        self.max_tokens = max_tokens
+        self.counter = counter or TokenCounter()
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Recorta un texto a max_tokens (ver TokenCounter.truncate)."""
+        return self.counter.truncate(text, max_tokens)
+
+    def assemble(self, base: str, sections: Sequence[PromptSection] = (),
+                 history: Sequence[BaseMessage] = (),
+                 tail: Sequence[PromptSection] = ()) -> Tuple[List[BaseMessage], Dict]:
+        """
+        Arma [SystemMessage(base + secciones)] + historial dentro del presupuesto.
+
+        Args:
+            base: Prompt base del agente
+            sections: Secciones del prompt del sistema, por prioridad
+            history: Mensajes de la conversación (sin el prompt del sistema)
+            tail: Secciones que cambian en cada turno; se envían como
+                SystemMessage antes del último mensaje del usuario
+
+        Returns:
+            Tuple[List[BaseMessage], Dict]: Mensajes a enviar y reporte con
+                budget, tokens usados, exact (tokenizador real), tokens por
+                parte y trimmed (elementos descartados por parte)
+        """
+        count = self.counter.count
+        remaining = self.max_tokens - TOKENS_PER_REPLY - TOKENS_PER_MESSAGE - count(base)
+        report = {'budget': self.max_tokens, 'exact': self.counter.exact,
+                  'parts': {'base': count(base)}, 'trimmed': {}}
+
+        # El último mensaje del usuario va siempre
+        history = list(history)
+        question_index = next(
+            (i for i in range(len(history) - 1, -1, -1) if isinstance(history[i], HumanMessage)),
+            None
+        )
+        kept_history: Dict[int, BaseMessage] = {}
+        if question_index is not None:
+            question = history[question_index]
+            tokens = self.counter.count_message(question)
+            if tokens > remaining:
+                question = HumanMessage(
+                    content=self.truncate(question.content, max(remaining - TOKENS_PER_MESSAGE, 1))
+                )
+                tokens = self.counter.count_message(question)
+                report['trimmed']['question'] = 1
+            kept_history[question_index] = question
+            remaining -= tokens
+            report['parts']['question'] = tokens
+
+        # Secciones por prioridad, elemento a elemento
+        system_parts = [base]
+        for section in sections:
+            kept, used = self._fit_section(section, remaining)
+            remaining -= used
+            report['parts'][section.name] = used
+            if len(kept) < len(section.items):
+                report['trimmed'][section.name] = len(section.items) - len(kept)
+            if kept:
+                system_parts.append(section.render(kept))
+
+        # Secciones de cola: su propio mensaje, que solo se cobra si queda algo
+        tail_parts = []
+        if tail:
+            remaining -= TOKENS_PER_MESSAGE
+            for section in tail:
+                kept, used = self._fit_section(section, remaining)
+                remaining -= used
+                report['parts'][section.name] = used
+                if len(kept) < len(section.items):
+                    report['trimmed'][section.name] = len(section.items) - len(kept)
+                if kept:
+                    tail_parts.append(section.render(kept))
+            if not tail_parts:
+                remaining += TOKENS_PER_MESSAGE
+
+        # Historial anterior, del más reciente al más antiguo
+        history_tokens = 0
+        dropped = 0
+        for i in range(len(history) - 1, -1, -1):
+            if i == question_index:
+                continue
+            tokens = self.counter.count_message(history[i])
+            if dropped or tokens > remaining:
+                # Sin huecos: al no caber un mensaje se descartan los anteriores
+                dropped += 1
+                continue
+            kept_history[i] = history[i]
+            remaining -= tokens
+            history_tokens += tokens
+        report['parts']['history'] = history_tokens
+        if dropped:
+            report['trimmed']['history'] = dropped
+
+        messages = [SystemMessage(content='\n\n'.join(system_parts))]
+        for i in sorted(kept_history):
+            if i == question_index and tail_parts:
+                messages.append(SystemMessage(content='\n\n'.join(tail_parts)))
+            messages.append(kept_history[i])
+        if question_index is None and tail_parts:
+            messages.append(SystemMessage(content='\n\n'.join(tail_parts)))
+        report['tokens'] = self.max_tokens - remaining
+        return messages, report
+
+    def _fit_section(self, section: PromptSection, remaining: int) -> Tuple[List[str], int]:
+        """
+        Elementos de una sección que caben en el presupuesto restante.
+
+        Returns:
+            Tuple[List[str], int]: Elementos conservados (en su orden) y tokens usados
+        """
+        if not section.items:
+            return [], 0
+
+        # Separador "\n\n" con la parte anterior y encabezado
+        overhead = self.counter.count('\n\n' + section.header) if section.header else 1
+        if overhead >= remaining:
+            return [], 0
+
+        candidates = reversed(section.items) if section.keep_latest else section.items
+        kept, used = [], overhead
+        for item in candidates:
+            tokens = self.counter.count(item) + 1  # salto de línea
+            if used + tokens > remaining:
+                break
+            kept.append(item)
+            used += tokens
+
+        if not kept:
+            return [], 0
+        if section.keep_latest:
+            kept.reverse()
+        return kept, used
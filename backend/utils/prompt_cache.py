@@ -0,0 +1,97 @@
+"""
+Caché de Prompts del Sistema
+LRU compartida entre sesiones para los prompts que arma el Agente
+Principal. Las claves incluyen la versión de las reglas y de la memoria
+del usuario, así una entrada nunca queda obsoleta: al cambiar los datos
+cambia la clave y la entrada vieja sale por LRU.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+# Variable de entorno con el máximo de entradas de la caché
+PROMPT_CACHE_SIZE_ENV_VAR = 'KAVAK_PROMPT_CACHE_SIZE'
+DEFAULT_PROMPT_CACHE_SIZE = 256
+
+
+class PromptCache:
+    """
+    Caché LRU segura entre hilos con contadores de aciertos y fallos.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        """
+        Inicializa la caché.
+
+        Args:
+            max_entries: Entradas máximas (por defecto KAVAK_PROMPT_CACHE_SIZE o 256)
+        """
+        if max_entries is None:
+            max_entries = int(os.getenv(PROMPT_CACHE_SIZE_ENV_VAR) or DEFAULT_PROMPT_CACHE_SIZE)
+        if max_entries < 1:
+            raise ValueError("max_entries debe ser al menos 1")
+
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        Devuelve el valor cacheado para la clave o lo construye y lo guarda.
+        La construcción ocurre fuera del lock; si dos hilos fallan a la vez
+        ambos construyen y queda el primero que termina.
+
+        Args:
+            key: Clave (debe identificar por completo el valor)
+            build: Función que construye el valor
+
+        Returns:
+            Any: Valor cacheado o recién construido
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = build()
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            self._entries[key] = value
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """Vacía la caché (los contadores se conservan)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """
+        Estado de la caché.
+
+        Returns:
+            Dict: entries, max_entries, hits, misses, evictions y hit_rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,216 @@
+"""
+Política de Retención
+Define cuánto tiempo (o cuántas) memorias y reglas se conservan, y el
+barrido en segundo plano que elimina lo vencido en lotes pequeños y
+devuelve el espacio libre al sistema con PRAGMA incremental_vacuum.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+
+# Variables de entorno de la política (vacías = sin límite)
+MEMORY_MAX_AGE_ENV_VAR = 'KAVAK_MEMORY_MAX_AGE_DAYS'
+MEMORY_MAX_PER_USER_ENV_VAR = 'KAVAK_MEMORY_MAX_PER_USER'
+RULE_MIN_SCORE_ENV_VAR = 'KAVAK_RULE_MIN_SCORE'
+RULE_MAX_AGE_ENV_VAR = 'KAVAK_RULE_MAX_AGE_DAYS'
+RULE_MIN_AGE_ENV_VAR = 'KAVAK_RULE_MIN_AGE_DAYS'
+
+# Días mínimos antes de eliminar una regla por score: una regla recién
+# guardada aún tiene validation_score 0.0 y no ha podido validarse
+DEFAULT_RULE_MIN_AGE_DAYS = 7.0
+
+# created_at de las memorias anteriores a v7 (fecha desconocida): cuentan
+# como las más antiguas, así la retención por antigüedad y por usuario las
+# alcanza desde el primer barrido en vez de tratarlas como recién creadas
+LEGACY_CREATED_AT = '1970-01-01 00:00:00'
+
+# Segundos entre barridos
+SWEEP_INTERVAL_ENV_VAR = 'KAVAK_RETENTION_INTERVAL'
+
+
+def _env_number(name: str, cast):
+    """Lee un número de una variable de entorno (None si no está definida)."""
+    value = os.getenv(name, '').strip()
+    return cast(value) if value else None
+
+
+class RetentionPolicy:
+    """
+    Límites de retención. Cada límite es opcional; sin ninguno la
+    política está desactivada y no se elimina nada.
+
+    - Memorias: se eliminan las de más de memory_max_age_days días
+      (también las archivadas por la compactación) y, por usuario,
+      las más antiguas por encima de memory_max_per_user.
+    - Reglas: se eliminan las de validation_score menor a rule_min_score
+      con más de rule_max_age_days días. Con solo uno de los dos límites,
+      basta esa condición, pero la eliminación por score respeta siempre
+      rule_min_age_days (las reglas nuevas aún no tienen score).
+    """
+
+    def __init__(self, memory_max_age_days: Optional[float] = None,
+                 memory_max_per_user: Optional[int] = None,
+                 rule_min_score: Optional[float] = None,
+                 rule_max_age_days: Optional[float] = None,
+                 rule_min_age_days: float = DEFAULT_RULE_MIN_AGE_DAYS):
+        """
+        Inicializa la política.
+
+        Args:
+            memory_max_age_days: Antigüedad máxima de una memoria, en días
+            memory_max_per_user: Máximo de memorias activas por usuario
+            rule_min_score: validation_score mínimo para conservar una regla
+            rule_max_age_days: Antigüedad máxima de una regla que no alcanza el score
+            rule_min_age_days: Antigüedad mínima para eliminar una regla por score
+        """
+        if memory_max_per_user is not None and memory_max_per_user < 1:
+            raise ValueError("memory_max_per_user debe ser al menos 1")
+        for name, days in (('memory_max_age_days', memory_max_age_days),
+                           ('rule_max_age_days', rule_max_age_days)):
+            if days is not None and days <= 0:
+                raise ValueError(f"{name} debe ser mayor que 0")
+        if rule_min_age_days < 0:
+            raise ValueError("rule_min_age_days no puede ser negativo")
+
+        self.memory_max_age_days = memory_max_age_days
+        self.memory_max_per_user = memory_max_per_user
+        self.rule_min_score = rule_min_score
+        self.rule_max_age_days = rule_max_age_days
+        self.rule_min_age_days = rule_min_age_days
+
+    @classmethod
+    def from_env(cls) -> 'RetentionPolicy':
+        """
+        Crea la política a partir de las variables KAVAK_MEMORY_MAX_AGE_DAYS,
+        KAVAK_MEMORY_MAX_PER_USER, KAVAK_RULE_MIN_SCORE, KAVAK_RULE_MAX_AGE_DAYS
+        y KAVAK_RULE_MIN_AGE_DAYS.
+
+        Returns:
+            RetentionPolicy: Política configurada (desactivada si no hay variables)
+        """
+        rule_min_age_days = _env_number(RULE_MIN_AGE_ENV_VAR, float)
+        return cls(
+            memory_max_age_days=_env_number(MEMORY_MAX_AGE_ENV_VAR, float),
+            memory_max_per_user=_env_number(MEMORY_MAX_PER_USER_ENV_VAR, int),
+            rule_min_score=_env_number(RULE_MIN_SCORE_ENV_VAR, float),
+            rule_max_age_days=_env_number(RULE_MAX_AGE_ENV_VAR, float),
+            rule_min_age_days=DEFAULT_RULE_MIN_AGE_DAYS if rule_min_age_days is None else rule_min_age_days,
+        )
+
+    @property
+    def expires_memories(self) -> bool:
+        return self.memory_max_age_days is not None or self.memory_max_per_user is not None
+
+    @property
+    def expires_rules(self) -> bool:
+        return self.rule_min_score is not None or self.rule_max_age_days is not None
+
+    @property
+    def enabled(self) -> bool:
+        return self.expires_memories or self.expires_rules
+
+    def __repr__(self) -> str:
+        return (f"RetentionPolicy(memory_max_age_days={self.memory_max_age_days}, "
+                f"memory_max_per_user={self.memory_max_per_user}, "
+                f"rule_min_score={self.rule_min_score}, "
+                f"rule_max_age_days={self.rule_max_age_days}, "
+                f"rule_min_age_days={self.rule_min_age_days})")
+
+
+class RetentionSweeper:
+    """
+    Hilo de barrido de un gestor de base de datos. Cada pasada llama a
+    sweep_expired en lotes pequeños (cada lote es una transacción corta,
+    así las escrituras del chat se intercalan) y después libera páginas
+    con incremental_vacuum, también por tramos.
+    """
+
+    def __init__(self, db_manager, policy: Optional[RetentionPolicy] = None,
+                 interval: float = 300.0, batch_size: int = 500, pause: float = 0.05):
+        """
+        Inicializa el barrido (sin arrancarlo).
+
+        Args:
+            db_manager: Gestor con sweep_expired e incremental_vacuum
+            policy: Política a aplicar (None = la del gestor)
+            interval: Segundos entre pasadas
+            batch_size: Filas máximas por lote y tabla
+            pause: Segundos de espera entre lotes
+        """
+        self.db_manager = db_manager
+        self.policy = policy
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Acumulados desde el arranque
+        self.passes = 0
+        self.deleted: Dict[str, int] = {}
+        self.pages_freed = 0
+
+    def start(self) -> 'RetentionSweeper':
+        """Arranca el hilo de barrido en segundo plano."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='db-retention-sweeper', daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Detiene el hilo; el lote en curso termina normalmente.
+
+        Args:
+            timeout: Segundos máximos de espera (None = sin límite)
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        """Bucle del hilo: espera el intervalo y hace una pasada."""
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                # Un fallo (p. ej. BD bloqueada) no detiene el barrido
+                print(f"[Retención: error en el barrido: {str(e)}]")
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Elimina todo lo vencido, lote a lote, y libera el espacio.
+
+        Returns:
+            Dict[str, int]: Filas eliminadas por motivo y páginas liberadas
+        """
+        totals: Dict[str, int] = {}
+        while not self._stop.is_set():
+            deleted = self.db_manager.sweep_expired(self.batch_size, self.policy)
+            for reason, count in deleted.items():
+                totals[reason] = totals.get(reason, 0) + count
+            if not any(deleted.values()):
+                break
+            time.sleep(self.pause)
+
+        pages = 0
+        while not self._stop.is_set():
+            freed = self.db_manager.incremental_vacuum(self.batch_size)
+            pages += freed
+            if freed < self.batch_size:
+                break
+            time.sleep(self.pause)
+
+        self.passes += 1
+        for reason, count in totals.items():
+            self.deleted[reason] = self.deleted.get(reason, 0) + count
+        self.pages_freed += pages
+
+        totals['pages_freed'] = pages
+        return totals
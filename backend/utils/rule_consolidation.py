@@ -0,0 +1,366 @@
+"""
+Consolidación de Reglas Casi Duplicadas
+Detecta reglas que dicen lo mismo con otras palabras (MinHash + LSH
+sobre tejas de términos) y fusiona cada grupo en una regla canónica.
+Las reglas absorbidas quedan en prompt_rules_archive como procedencia.
+"""
+
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .prompt_budget import TokenCounter
+from .storage import StorageBackend
+from .text_search import tokenize
+
+
+# Variable de entorno con la similitud mínima para fusionar dos reglas
+RULE_DEDUP_THRESHOLD_ENV_VAR = 'KAVAK_RULE_DEDUP_THRESHOLD'
+DEFAULT_RULE_DEDUP_THRESHOLD = 0.5
+
+# Primo de Mersenne 2^61 - 1 para las permutaciones (a * x + b) mod p
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def rule_shingles(rule_text: str) -> Set[str]:
+    """
+    Tejas de una regla: raíces de sus términos y pares consecutivos.
+    Los separadores de miles se quitan antes ("3,000 km" = "3000 km").
+
+    Args:
+        rule_text: Texto de la regla
+
+    Returns:
+        Set[str]: Conjunto de tejas
+    """
+    text = re.sub(r'(?<=\d)[,.](?=\d{3}\b)', '', rule_text)
+    tokens = tokenize(text, stemmed=True)
+    shingles = set(tokens)
+    shingles.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+    return shingles
+
+
+def jaccard(first: Set[str], second: Set[str]) -> float:
+    """Similitud de Jaccard entre dos conjuntos."""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class MinHashLSH:
+    """
+    Índice LSH en memoria: firmas MinHash de num_perm valores divididas en
+    bands bandas; dos reglas son candidatas si coinciden en alguna banda.
+    El umbral aproximado de similitud es (1 / bands) ** (1 / filas por banda).
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        """
+        Inicializa el índice.
+
+        Args:
+            num_perm: Valores por firma
+            bands: Bandas (num_perm debe ser múltiplo)
+            seed: Semilla de las permutaciones (las firmas son reproducibles)
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm debe ser múltiplo de bands")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        # Permutaciones deterministas a partir de la semilla
+        state = seed
+        self._permutations = []
+        for _ in range(num_perm):
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = (state >> 3) % (_MERSENNE_PRIME - 1) + 1
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            b = (state >> 3) % _MERSENNE_PRIME
+            self._permutations.append((a, b))
+
+        self._buckets: List[Dict[Tuple[int, ...], Set[int]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[int, Tuple[int, ...]] = {}
+
+    def signature(self, shingles: Iterable[str]) -> Tuple[int, ...]:
+        """Firma MinHash de un conjunto de tejas."""
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        return tuple(
+            min(((a * value + b) % _MERSENNE_PRIME) & _MAX_HASH for value in hashes)
+            for a, b in self._permutations
+        )
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, key: int, signature: Tuple[int, ...]):
+        """Agrega una firma al índice."""
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, set()).add(key)
+
+    def remove(self, key: int):
+        """Quita una firma del índice (si está)."""
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in self._band_keys(signature):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def candidates(self, signature: Tuple[int, ...]) -> Set[int]:
+        """Claves que comparten al menos una banda con la firma."""
+        found = set()
+        for band, band_key in self._band_keys(signature):
+            found.update(self._buckets[band].get(band_key, ()))
+        return found
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._signatures
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+
+class RuleConsolidator:
+    """
+    Fusiona reglas casi duplicadas. Las candidatas de LSH se confirman
+    con la similitud de Jaccard exacta de sus tejas (threshold); la
+    categoría no se compara, porque el optimizador puede clasificar distinto
+    el mismo error. La regla canónica de cada grupo
+    es la de mayor validation_score (a igualdad, la más antigua) y conserva
+    el mayor score del grupo. Cada regla absorbida debe superar el umbral
+    contra la canónica (no basta con parecerse a otra del grupo), así dos
+    reglas distintas no se unen a través de una intermedia.
+
+    save_rule consolida cada regla nueva al guardarla; run_batch revisa
+    toda la tabla (p. ej. para las reglas anteriores a la consolidación).
+    El índice se actualiza con las escrituras del propio consolidador y
+    solo se reconstruye si la generación de reglas cambió por fuera.
+    """
+
+    def __init__(self, db_manager: StorageBackend, threshold: Optional[float] = None,
+                 num_perm: int = 64, bands: int = 32,
+                 counter: Optional[TokenCounter] = None):
+        """
+        Inicializa el consolidador.
+
+        Args:
+            db_manager: Backend de almacenamiento
+            threshold: Jaccard mínima entre tejas para considerar duplicadas dos reglas
+                (por defecto KAVAK_RULE_DEDUP_THRESHOLD o 0.5)
+            num_perm: Valores por firma MinHash
+            bands: Bandas del índice LSH (32 bandas de 2 filas: casi todo par con
+                Jaccard >= 0.4 llega a candidato; la Jaccard exacta filtra el resto)
+            counter: Contador de tokens del reporte
+        """
+        if threshold is None:
+            threshold = float(os.getenv(RULE_DEDUP_THRESHOLD_ENV_VAR) or DEFAULT_RULE_DEDUP_THRESHOLD)
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold debe estar entre 0 y 1")
+
+        self.db_manager = db_manager
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.counter = counter or TokenCounter()
+
+        self._lock = threading.Lock()
+        # Índice de la generación de reglas indexada: (generación, índice, reglas por id, tejas por id)
+        self._state: Optional[Tuple[int, MinHashLSH, Dict[int, Dict], Dict[int, Set[str]]]] = None
+        # Reconstrucciones completas del índice (las escrituras propias no reconstruyen)
+        self.rebuilds = 0
+
+    def _index(self) -> Tuple[MinHashLSH, Dict[int, Dict], Dict[int, Set[str]]]:
+        """Índice LSH de las reglas actuales, reconstruido si cambió la generación."""
+        version = self.db_manager.get_rules_version()
+        if self._state is not None and self._state[0] == version:
+            return self._state[1:]
+
+        rules = {rule['id']: dict(rule) for rule in self.db_manager.get_rules_snapshot()}
+        index = MinHashLSH(self.num_perm, self.bands)
+        shingles = {}
+        for rule_id, rule in rules.items():
+            shingles[rule_id] = rule_shingles(rule['rule_text'])
+            index.add(rule_id, index.signature(shingles[rule_id]))
+        self._state = (version, index, rules, shingles)
+        self.rebuilds += 1
+        return index, rules, shingles
+
+    def _merge(self, canonical: Dict, duplicate_ids: List[int]) -> int:
+        """
+        Consolida en la BD y aplica el cambio al índice (con el lock tomado).
+        Si el índice no estaba al día antes de escribir, se descarta y se
+        reconstruirá en el siguiente uso.
+
+        Returns:
+            int: Reglas absorbidas
+        """
+        current = self._state is not None and self._state[0] == self.db_manager.get_rules_version()
+        merged = self.db_manager.consolidate_rules(canonical['id'], duplicate_ids)
+        if not current:
+            self._state = None
+            return merged
+
+        _, index, rules, shingles = self._state
+        best = canonical['validation_score'] or 0.0
+        for rule_id in duplicate_ids:
+            best = max(best, rules.pop(rule_id)['validation_score'] or 0.0)
+            shingles.pop(rule_id)
+            index.remove(rule_id)
+        if best > (rules[canonical['id']]['validation_score'] or 0.0):
+            rules[canonical['id']]['validation_score'] = best
+        self._state = (self.db_manager.get_rules_version(), index, rules, shingles)
+        return merged
+
+    def _similar(self, rule: Dict, index: MinHashLSH, rules: Dict[int, Dict],
+                 shingles: Dict[int, Set[str]], own: Set[str]) -> List[Tuple[int, float]]:
+        """Reglas con Jaccard >= threshold, de mayor a menor."""
+        matches = []
+        for candidate_id in index.candidates(index.signature(own)):
+            if candidate_id == rule.get('id'):
+                continue
+            similarity = jaccard(own, shingles[candidate_id])
+            if similarity >= self.threshold:
+                matches.append((candidate_id, similarity))
+        return sorted(matches, key=lambda match: -match[1])
+
+    @staticmethod
+    def _canonical(cluster: Sequence[Dict]) -> Dict:
+        """Regla canónica del grupo: mayor validation_score y, a igualdad, la más antigua."""
+        return min(cluster, key=lambda rule: (-(rule['validation_score'] or 0.0), rule['id']))
+
+    def find_clusters(self) -> List[List[Dict]]:
+        """
+        Agrupa las reglas casi duplicadas alrededor de su canónica: en orden
+        de prioridad (mayor score, más antigua), cada regla aún libre es
+        canónica de las reglas libres con Jaccard >= threshold contra ella.
+
+        Returns:
+            List[List[Dict]]: Grupos de dos o más reglas, ordenadas por id
+        """
+        with self._lock:
+            index, rules, shingles = self._index()
+
+            assigned: Set[int] = set()
+            groups = []
+            for rule in sorted(rules.values(), key=lambda rule: (-(rule['validation_score'] or 0.0), rule['id'])):
+                if rule['id'] in assigned:
+                    continue
+                members = [other_id for other_id, _ in self._similar(rule, index, rules, shingles, shingles[rule['id']])
+                           if other_id not in assigned]
+                if not members:
+                    continue
+                assigned.add(rule['id'])
+                assigned.update(members)
+                groups.append(sorted([rule] + [rules[other_id] for other_id in members],
+                                     key=lambda member: member['id']))
+        return sorted(groups, key=lambda group: group[0]['id'])
+
+    def save_rule(self, rule_text: str, error_category: str = 'general',
+                  validation_score: float = 0.0) -> int:
+        """
+        Guarda una regla y, si tiene casi duplicadas, las fusiona con ella.
+
+        Args:
+            rule_text: Texto de la regla
+            error_category: Categoría del error
+            validation_score: Score de validación (0.0-1.0)
+
+        Returns:
+            int: ID de la regla canónica que la contiene
+        """
+        with self._lock:
+            index, rules, shingles = self._index()
+            version = self._state[0]
+            rule_id = self.db_manager.save_rule(rule_text, error_category, validation_score)
+            saved_version = self.db_manager.get_rules_version()
+            if saved_version == version + 1 and rule_id not in rules:
+                # Solo cambió la regla nueva: se agrega al índice sin reconstruirlo
+                rules[rule_id] = {'id': rule_id, 'rule_text': rule_text,
+                                  'error_category': error_category, 'validation_score': validation_score}
+                shingles[rule_id] = rule_shingles(rule_text)
+                index.add(rule_id, index.signature(shingles[rule_id]))
+                self._state = (saved_version, index, rules, shingles)
+            elif saved_version != version:
+                index, rules, shingles = self._index()
+
+            rule = rules.get(rule_id)
+            if rule is None:
+                return rule_id
+            similar = self._similar(rule, index, rules, shingles, shingles[rule_id])
+            if not similar:
+                return rule_id
+
+            cluster = [rule] + [rules[other_id] for other_id, _ in similar]
+            canonical = self._canonical(cluster)
+            # Solo se absorben las reglas que también superan el umbral contra la canónica
+            duplicates = [
+                member['id'] for member in cluster
+                if member is not canonical
+                and jaccard(shingles[canonical['id']], shingles[member['id']]) >= self.threshold
+            ]
+            if duplicates:
+                self._merge(canonical, duplicates)
+        return canonical['id'] if rule_id in duplicates else rule_id
+
+    def run_batch(self, dry_run: bool = False, verbose: bool = True) -> Dict:
+        """
+        Consolida todos los grupos de reglas casi duplicadas.
+
+        Args:
+            dry_run: Solo reportar los grupos, sin modificar la BD
+            verbose: Imprimir los grupos y el ahorro
+
+        Returns:
+            Dict: Grupos, reglas absorbidas, tokens de todas las reglas antes
+                y después, tokens ahorrados y tiempo
+        """
+        start = time.perf_counter()
+        tokens_before = self.counter.count(self.db_manager.get_all_rules())
+        clusters = self.find_clusters()
+
+        merged = 0
+        saved_tokens = 0
+        for cluster in clusters:
+            canonical = self._canonical(cluster)
+            duplicates = [rule for rule in cluster if rule is not canonical]
+            saved_tokens += sum(self.counter.count(rule['rule_text']) + 1 for rule in duplicates)
+            if verbose:
+                print(f"\n   ✓ Regla {canonical['id']} [{canonical['error_category']}]: "
+                      f"{canonical['rule_text'][:80]}")
+                for rule in duplicates:
+                    print(f"      ← {rule['id']}: {rule['rule_text'][:80]}")
+            if not dry_run:
+                with self._lock:
+                    merged += self._merge(canonical, [rule['id'] for rule in duplicates])
+            else:
+                merged += len(duplicates)
+
+        tokens_after = tokens_before - saved_tokens if dry_run else self.counter.count(self.db_manager.get_all_rules())
+        report = {
+            'clusters': len(clusters),
+            'rules_merged': merged,
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'tokens_saved': tokens_before - tokens_after,
+            'elapsed_seconds': time.perf_counter() - start,
+        }
+
+        if verbose:
+            saved_pct = report['tokens_saved'] / tokens_before * 100 if tokens_before else 0.0
+            print(f"\n   Grupos: {report['clusters']} | Reglas absorbidas: {report['rules_merged']}")
+            print(f"   Tokens de las reglas: {tokens_before} → {tokens_after} "
+                  f"(−{report['tokens_saved']}, {saved_pct:.1f}%)")
+        return report
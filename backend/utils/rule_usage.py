@@ -0,0 +1,275 @@
+"""
+Uso de Reglas y Conjunto Activo
+Cuenta cuántas veces se inyecta cada regla y el feedback 👍/👎 de las
+respuestas que la llevaban (escrito en la BD por lotes), y limita las
+reglas candidatas del prompt a un conjunto activo de tamaño fijo: entran
+las de mayor valor según score, resultados y antigüedad.
+"""
+
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .storage import StorageBackend
+
+
+# Variable de entorno con los eventos de uso acumulados antes de escribir en la BD
+RULE_USAGE_FLUSH_ENV_VAR = 'KAVAK_RULE_USAGE_FLUSH_EVERY'
+DEFAULT_RULE_USAGE_FLUSH_EVERY = 20
+
+# Variable de entorno con el tamaño del conjunto activo (0 = todas las reglas)
+ACTIVE_RULES_ENV_VAR = 'KAVAK_ACTIVE_RULES_MAX'
+DEFAULT_ACTIVE_RULES_MAX = 50
+
+# Variable de entorno con la vida media, en días, del peso por antigüedad
+RULE_HALF_LIFE_ENV_VAR = 'KAVAK_RULE_HALF_LIFE_DAYS'
+DEFAULT_RULE_HALF_LIFE_DAYS = 30.0
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Segundos epoch de un CURRENT_TIMESTAMP de SQLite (UTC), o None."""
+    if not value:
+        return None
+    try:
+        moment = datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RuleUsageTracker:
+    """
+    Acumula en memoria los incrementos de uso por regla y los escribe con
+    record_rule_usage cada flush_every eventos o cada flush_interval
+    segundos, en una sola transacción. Una inyección es un evento y un
+    feedback también; el feedback cuenta para todas las reglas que iban en
+    el prompt de esa respuesta.
+    """
+
+    def __init__(self, db_manager: StorageBackend, flush_every: Optional[int] = None,
+                 flush_interval: float = 60.0):
+        """
+        Inicializa el contador.
+
+        Args:
+            db_manager: Backend de almacenamiento
+            flush_every: Eventos acumulados antes de escribir
+                (por defecto KAVAK_RULE_USAGE_FLUSH_EVERY o 20; 1 = escribir siempre)
+            flush_interval: Segundos máximos entre escrituras con eventos pendientes
+        """
+        if flush_every is None:
+            flush_every = int(os.getenv(RULE_USAGE_FLUSH_ENV_VAR) or DEFAULT_RULE_USAGE_FLUSH_EVERY)
+        if flush_every < 1:
+            raise ValueError("flush_every debe ser al menos 1")
+
+        self.db_manager = db_manager
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # rule_id -> [inyecciones, 👍, 👎] pendientes de escribir
+        self._pending: Dict[int, List[int]] = {}
+        self._events = 0
+        self._last_flush = time.monotonic()
+        self.flushes = 0
+
+    def record_injection(self, rule_ids: Iterable[int]):
+        """
+        Registra que las reglas se inyectaron en el prompt de una respuesta.
+
+        Args:
+            rule_ids: IDs de las reglas del prompt (MainAgent.last_rule_ids)
+        """
+        self._add(rule_ids, 0)
+
+    def record_feedback(self, rule_ids: Iterable[int], positive: bool):
+        """
+        Registra el feedback de una respuesta para las reglas de su prompt.
+
+        Args:
+            rule_ids: IDs de las reglas que llevaba el prompt de esa respuesta
+            positive: True para 👍, False para 👎
+        """
+        self._add(rule_ids, 1 if positive else 2)
+
+    def _add(self, rule_ids: Iterable[int], counter: int):
+        rule_ids = list(rule_ids)
+        if not rule_ids:
+            return
+        with self._lock:
+            for rule_id in rule_ids:
+                self._pending.setdefault(rule_id, [0, 0, 0])[counter] += 1
+            self._events += 1
+            due = (self._events >= self.flush_every
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Escribe en la BD los incrementos pendientes (si los hay)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._events = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        try:
+            self.db_manager.record_rule_usage([
+                (rule_id, injected, positive, negative)
+                for rule_id, (injected, positive, negative) in sorted(pending.items())
+            ])
+        except Exception as e:
+            # Se reintenta en la próxima escritura
+            print(f"[Sistema: no se pudo guardar el uso de las reglas: {str(e)}]")
+            with self._lock:
+                for rule_id, counts in pending.items():
+                    merged = self._pending.setdefault(rule_id, [0, 0, 0])
+                    for i, count in enumerate(counts):
+                        merged[i] += count
+            return
+        with self._lock:
+            self.flushes += 1
+
+    @property
+    def pending_events(self) -> int:
+        return self._events
+
+
+class ActiveRuleSet:
+    """
+    Conjunto activo de reglas: las capacity de mayor valor. El valor de
+    una regla combina su calidad con un peso por antigüedad:
+
+        calidad = (validation_score + tasa de 👍) / 2
+        valor   = calidad * (1 + 0.5 ** (días / vida media)) / 2
+
+    La tasa de 👍 se suaviza con Laplace, (👍 + 1) / (👍 + 👎 + 2): una
+    regla sin feedback vale 0.5. La antigüedad se mide desde el último 👍
+    (o desde su creación), así una regla vieja que sigue ayudando no
+    pierde peso y una que nadie confirma llega a valer la mitad.
+
+    Las reglas desalojadas siguen en la BD y vuelven a competir en cada
+    recálculo (al cambiar las reglas o cada refresh_seconds).
+    """
+
+    def __init__(self, capacity: Optional[int] = None, half_life_days: Optional[float] = None,
+                 refresh_seconds: float = 60.0):
+        """
+        Inicializa el conjunto activo.
+
+        Args:
+            capacity: Reglas activas máximas (por defecto KAVAK_ACTIVE_RULES_MAX o 50; 0 = todas)
+            half_life_days: Vida media del peso por antigüedad
+                (por defecto KAVAK_RULE_HALF_LIFE_DAYS o 30)
+            refresh_seconds: Segundos máximos antes de recalcular con los contadores nuevos
+        """
+        if capacity is None:
+            capacity = int(os.getenv(ACTIVE_RULES_ENV_VAR) or DEFAULT_ACTIVE_RULES_MAX)
+        if half_life_days is None:
+            half_life_days = float(os.getenv(RULE_HALF_LIFE_ENV_VAR) or DEFAULT_RULE_HALF_LIFE_DAYS)
+        if capacity < 0:
+            raise ValueError("capacity no puede ser negativa")
+        if half_life_days <= 0:
+            raise ValueError("half_life_days debe ser mayor que 0")
+
+        self.capacity = capacity
+        self.half_life_days = half_life_days
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        # (generación de reglas, momento del cálculo, reglas activas, IDs desalojados)
+        self._state: Optional[Tuple[int, float, Tuple[Dict, ...], Tuple[int, ...]]] = None
+        self.refreshes = 0
+
+    def value(self, rule: Dict, usage: Optional[Dict], now: Optional[float] = None) -> float:
+        """
+        Valor de una regla (ver la descripción de la clase).
+
+        Args:
+            rule: Regla del snapshot (validation_score)
+            usage: Entrada de get_rule_usage (None = sin uso registrado)
+            now: Segundos epoch de referencia (por defecto, ahora)
+
+        Returns:
+            float: Valor entre 0 y 1
+        """
+        usage = usage or {}
+        positive, negative = usage.get('positive', 0), usage.get('negative', 0)
+        outcome = (positive + 1) / (positive + negative + 2)
+        quality = ((rule['validation_score'] or 0.0) + outcome) / 2
+
+        reference = (_parse_timestamp(usage.get('last_positive_at'))
+                     or _parse_timestamp(usage.get('created_at')))
+        if reference is None:
+            return quality
+        age_days = max(0.0, ((now or time.time()) - reference) / 86400)
+        return quality * (1 + math.pow(0.5, age_days / self.half_life_days)) / 2
+
+    def rules(self, db_manager: StorageBackend) -> Tuple[Dict, ...]:
+        """
+        Reglas activas, en el orden del snapshot. Mientras el conjunto no
+        cambie se devuelve la misma tupla (los índices de MainAgent y la
+        caché de prompts la reutilizan).
+
+        Args:
+            db_manager: Backend de almacenamiento
+
+        Returns:
+            Tuple[Dict, ...]: Reglas activas (el snapshot completo si caben todas)
+        """
+        version = db_manager.get_rules_version()
+        state = self._state
+        if state is not None and state[0] == version and time.monotonic() - state[1] < self.refresh_seconds:
+            return state[2]
+
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == version and time.monotonic() - state[1] < self.refresh_seconds:
+                return state[2]
+
+            snapshot = db_manager.get_rules_snapshot()
+            if not self.capacity or len(snapshot) <= self.capacity:
+                active, evicted = snapshot, ()
+            else:
+                usage = db_manager.get_rule_usage()
+                now = time.time()
+                ranked = sorted(
+                    range(len(snapshot)),
+                    key=lambda position: (-self.value(snapshot[position], usage.get(snapshot[position]['id']), now),
+                                          snapshot[position]['id'])
+                )
+                kept = set(ranked[:self.capacity])
+                active = tuple(rule for position, rule in enumerate(snapshot) if position in kept)
+                evicted = tuple(snapshot[position]['id'] for position in sorted(ranked[self.capacity:]))
+                # Mismo conjunto que antes: se conserva la tupla anterior
+                if state is not None and state[0] == version and len(state[2]) == len(active) \
+                        and all(old is new for old, new in zip(state[2], active)):
+                    active = state[2]
+
+            self._state = (version, time.monotonic(), active, evicted)
+            self.refreshes += 1
+            return active
+
+    def invalidate(self):
+        """Fuerza el recálculo en la próxima llamada a rules()."""
+        with self._lock:
+            self._state = None
+
+    def stats(self) -> Dict:
+        """
+        Estado del conjunto activo.
+
+        Returns:
+            Dict: capacity, active, evicted (IDs desalojados) y refreshes
+        """
+        state = self._state
+        return {
+            'capacity': self.capacity,
+            'active': len(state[2]) if state else 0,
+            'evicted': list(state[3]) if state else [],
+            'refreshes': self.refreshes,
+        }
@@ -0,0 +1,635 @@
+"""
+Almacenamiento Fragmentado por Usuario
+Reparte usuarios y memorias en N archivos SQLite según un hash estable
+del user_id, para que cada fragmento tenga su propio escritor. Las
+reglas (prompt_rules) siguen en la BD principal, compartidas por todos.
+"""
+
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import Future
+from contextlib import ExitStack
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .database import DatabaseManager
+from .db_instrumentation import INSTRUMENT_ENV_VAR, DatabaseInstrumentation, instrumented
+from .retention import RetentionPolicy
+from .storage import StorageBackend
+
+
+# Variable de entorno con el número de fragmentos a crear
+SHARDS_ENV_VAR = 'KAVAK_SHARDS'
+
+# Cada fragmento asigna IDs de memoria en su propio rango de 2^32,
+# distinto por época y fragmento: los IDs son únicos entre fragmentos
+# y se conservan al refragmentar.
+_MEMORY_ID_BITS = 32
+_SHARD_INDEX_BITS = 10
+
+# Tablas del snapshot que viven en los fragmentos (todas tienen user_id)
+_SHARDED_TABLES = ('users', 'user_memory', 'user_memory_archive')
+
+
+def shard_index(user_id: str, shard_count: int) -> int:
+    """
+    Fragmento al que pertenece un usuario (CRC32 del user_id, estable entre procesos).
+
+    Args:
+        user_id: ID del usuario
+        shard_count: Número de fragmentos
+
+    Returns:
+        int: Índice del fragmento (0..shard_count-1)
+    """
+    return zlib.crc32(user_id.encode('utf-8')) % shard_count
+
+
+def shard_paths(db_path: str, shard_count: int, epoch: int) -> List[str]:
+    """
+    Rutas de los archivos de cada fragmento.
+    La época forma parte del nombre para que una refragmentación
+    escriba archivos nuevos sin tocar los vigentes.
+
+    Args:
+        db_path: Ruta de la BD principal
+        shard_count: Número de fragmentos
+        epoch: Época de la distribución
+
+    Returns:
+        List[str]: Una ruta por fragmento
+    """
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.shard-{epoch}-{index}{ext or '.db'}" for index in range(shard_count)]
+
+
+def _memory_id_base(epoch: int, index: int) -> int:
+    """Primer ID de memoria reservado para un fragmento en una época."""
+    return ((epoch << _SHARD_INDEX_BITS) | index) << _MEMORY_ID_BITS
+
+
+def _open_shard(path: str, epoch: int, index: int, **options) -> DatabaseManager:
+    """Abre (o crea) un fragmento con su rango de IDs de memoria reservado."""
+    shard = DatabaseManager(path, **options)
+    shard.reserve_memory_ids(_memory_id_base(epoch, index))
+    return shard
+
+
+def _remove_database_files(path: str):
+    """Borra un archivo SQLite junto con su WAL y memoria compartida."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class ShardedDatabaseManager(StorageBackend):
+    """
+    Backend SQLite fragmentado por usuario.
+    users, user_memory y user_memory_archive viven en el fragmento del
+    usuario; prompt_rules y la distribución de fragmentos, en la BD principal.
+    """
+
+    def __init__(self, db_path: str = None, shards: Optional[int] = None, **options):
+        """
+        Abre la BD principal y sus fragmentos.
+
+        Args:
+            db_path: Ruta de la BD principal (por defecto la de DatabaseManager)
+            shards: Número de fragmentos. Solo hace falta al fragmentar una BD
+                nueva; una BD ya fragmentada usa la distribución registrada.
+            **options: Opciones de DatabaseManager (p. ej. write_behind)
+        """
+        self.db_path = db_path or DatabaseManager.DB_PATH
+
+        # Una sola instrumentación compartida por la BD principal y los fragmentos
+        instrument = options.pop('instrument', None)
+        if instrument is None:
+            instrument = os.getenv(INSTRUMENT_ENV_VAR, '').lower() in ('1', 'true')
+        if isinstance(instrument, DatabaseInstrumentation):
+            self.instrumentation: Optional[DatabaseInstrumentation] = instrument
+        else:
+            self.instrumentation = DatabaseInstrumentation() if instrument else None
+        options['instrument'] = self.instrumentation or False
+
+        self._global = DatabaseManager(self.db_path, **options)
+
+        shard_count, epoch = self._global.get_shard_layout()
+        if shard_count == 0:
+            if not shards:
+                raise ValueError("La BD no está fragmentada: indica el número de fragmentos")
+            stats = self._global.get_system_stats()
+            if stats['total_users'] or stats['total_memories']:
+                raise ValueError(
+                    "La BD tiene usuarios sin fragmentar: "
+                    f"ejecuta reshard_database.py --shards {shards}"
+                )
+            shard_count, epoch = shards, 1
+            self._shards = [
+                _open_shard(path, epoch, index, **options)
+                for index, path in enumerate(shard_paths(self.db_path, shard_count, epoch))
+            ]
+            self._global.set_shard_layout(shard_count, epoch)
+        else:
+            if shards and shards != shard_count:
+                raise ValueError(
+                    f"La BD tiene {shard_count} fragmentos: "
+                    f"ejecuta reshard_database.py --shards {shards} para cambiarlos"
+                )
+            self._shards = [
+                DatabaseManager(path, **options)
+                for path in shard_paths(self.db_path, shard_count, epoch)
+            ]
+
+        self.shard_count = shard_count
+        self.epoch = epoch
+
+    def shard_for(self, user_id: str) -> DatabaseManager:
+        """
+        Gestor del fragmento que guarda a un usuario.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            DatabaseManager: Fragmento del usuario
+        """
+        return self._shards[shard_index(user_id, self.shard_count)]
+
+    # ==================== USUARIOS ====================
+
+    def create_user(self, user_id: str, username: str) -> bool:
+        return self.shard_for(user_id).create_user(user_id, username)
+
+    def user_exists(self, user_id: str) -> bool:
+        return self.shard_for(user_id).user_exists(user_id)
+
+    def get_username(self, user_id: str) -> Optional[str]:
+        return self.shard_for(user_id).get_username(user_id)
+
+    # ==================== REGLAS (BD principal) ====================
+
+    def get_all_rules(self) -> str:
+        return self._global.get_all_rules()
+
+    def get_rules_version(self) -> int:
+        return self._global.get_rules_version()
+
+    def get_rules_snapshot(self) -> Tuple[Dict, ...]:
+        return self._global.get_rules_snapshot()
+
+    def rule_exists(self, rule_text: str) -> bool:
+        return self._global.rule_exists(rule_text)
+
+    def save_rule(self, rule_text: str, error_category: str = 'general',
+                  validation_score: float = 0.0) -> int:
+        return self._global.save_rule(rule_text, error_category, validation_score)
+
+    def save_rule_async(self, rule_text: str, error_category: str = 'general',
+                        validation_score: float = 0.0) -> Future:
+        return self._global.save_rule_async(rule_text, error_category, validation_score)
+
+    def save_rules_bulk(self, rules: List[Tuple[str, str, float]]) -> List[int]:
+        return self._global.save_rules_bulk(rules)
+
+    def iter_rules(self, batch_size: int = 100, order_by: str = 'id',
+                   descending: bool = False) -> Iterator[Dict]:
+        return self._global.iter_rules(batch_size, order_by, descending)
+
+    def get_rules_by_category(self, category: str) -> List[str]:
+        return self._global.get_rules_by_category(category)
+
+    def search_rules(self, query: str, k: int = 5) -> List[Dict]:
+        return self._global.search_rules(query, k)
+
+    def consolidate_rules(self, canonical_id: int, duplicate_ids: List[int]) -> int:
+        return self._global.consolidate_rules(canonical_id, duplicate_ids)
+
+    def get_rule_provenance(self, rule_id: int) -> List[Dict]:
+        return self._global.get_rule_provenance(rule_id)
+
+    def record_rule_usage(self, deltas: List[Tuple[int, int, int, int]]):
+        self._global.record_rule_usage(deltas)
+
+    def get_rule_usage(self) -> Dict[int, Dict]:
+        return self._global.get_rule_usage()
+
+    # ==================== MEMORIA (fragmento del usuario) ====================
+
+    get_user_memory = instrumented(StorageBackend.get_user_memory)
+
+    def get_user_memory_version(self, user_id: str) -> int:
+        return self.shard_for(user_id).get_user_memory_version(user_id)
+
+    def iter_user_memory(self, user_id: str, limit: Optional[int] = None,
+                         newest_first: bool = False, batch_size: int = 100) -> Iterator[Dict]:
+        return self.shard_for(user_id).iter_user_memory(user_id, limit, newest_first, batch_size)
+
+    def save_user_memory(self, user_id: str, context: str) -> int:
+        return self.shard_for(user_id).save_user_memory(user_id, context)
+
+    def save_user_memory_async(self, user_id: str, context: str) -> Future:
+        return self.shard_for(user_id).save_user_memory_async(user_id, context)
+
+    @instrumented
+    def save_memories_bulk(self, memories: List[Tuple[str, str]]) -> List[int]:
+        """
+        Guarda varias memorias con una transacción por fragmento.
+
+        Args:
+            memories: Lista de tuplas (user_id, context)
+
+        Returns:
+            List[int]: IDs de las memorias, en el mismo orden que la entrada
+        """
+        positions_by_shard: Dict[int, List[int]] = {}
+        for position, (user_id, _) in enumerate(memories):
+            positions_by_shard.setdefault(shard_index(user_id, self.shard_count), []).append(position)
+
+        ids = [0] * len(memories)
+        for index, positions in positions_by_shard.items():
+            shard_ids = self._shards[index].save_memories_bulk([memories[p] for p in positions])
+            for position, memory_id in zip(positions, shard_ids):
+                ids[position] = memory_id
+        return ids
+
+    def count_user_memories(self, user_id: str) -> int:
+        return self.shard_for(user_id).count_user_memories(user_id)
+
+    def count_users_with_memories(self) -> int:
+        # Cada usuario vive en un solo fragmento
+        return sum(shard.count_users_with_memories() for shard in self._shards)
+
+    @instrumented
+    def get_users_over_memory_limit(self, max_memories: int) -> List[Tuple[str, int]]:
+        over_limit = []
+        for shard in self._shards:
+            over_limit.extend(shard.get_users_over_memory_limit(max_memories))
+        return sorted(over_limit, key=lambda item: -item[1])
+
+    def compact_user_memory(self, user_id: str, memory_ids: List[int],
+                            consolidated_context: str) -> int:
+        return self.shard_for(user_id).compact_user_memory(user_id, memory_ids, consolidated_context)
+
+    def search_user_memory(self, user_id: str, query: str, k: int = 5) -> List[Dict]:
+        return self.shard_for(user_id).search_user_memory(user_id, query, k)
+
+    # ==================== MÉTRICAS ====================
+
+    @instrumented
+    def get_system_stats(self) -> Dict[str, any]:
+        """
+        Estadísticas globales: reglas de la BD principal, usuarios y
+        memorias sumados entre fragmentos (cada lectura es un contador O(1)).
+
+        Returns:
+            Dict: Diccionario con estadísticas
+        """
+        stats = self._global.get_system_stats()
+        for shard in self._shards:
+            shard_stats = shard.get_system_stats()
+            stats['total_users'] += shard_stats['total_users']
+            stats['total_memories'] += shard_stats['total_memories']
+        return stats
+
+    def get_instrumentation_report(self, top_statements: int = 10) -> Optional[Dict]:
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.report(top_statements)
+
+    # ==================== RETENCIÓN ====================
+
+    def _all_managers(self) -> List[DatabaseManager]:
+        return [self._global, *self._shards]
+
+    @instrumented
+    def sweep_expired(self, batch_size: int = 500,
+                      policy: Optional[RetentionPolicy] = None) -> Dict[str, int]:
+        """
+        Un lote de retención en la BD principal (reglas) y en cada
+        fragmento (memorias). Cada gestor tiene además su propio barrido
+        en segundo plano si la política está activa.
+
+        Args:
+            batch_size: Filas máximas por motivo y BD
+            policy: Política a aplicar (None = la de cada gestor)
+
+        Returns:
+            Dict[str, int]: Filas eliminadas por motivo, sumadas
+        """
+        totals: Dict[str, int] = {}
+        for manager in self._all_managers():
+            for reason, count in manager.sweep_expired(batch_size, policy).items():
+                totals[reason] = totals.get(reason, 0) + count
+        return totals
+
+    def incremental_vacuum(self, pages: Optional[int] = None) -> int:
+        return sum(manager.incremental_vacuum(pages) for manager in self._all_managers())
+
+    def enable_incremental_vacuum(self) -> bool:
+        converted = [manager.enable_incremental_vacuum() for manager in self._all_managers()]
+        return any(converted)
+
+    # ==================== UTILIDADES ====================
+
+    def clear_all_rules(self, verbose: bool = True):
+        self._global.clear_all_rules(verbose)
+
+    @instrumented
+    def clear_all_memories(self, verbose: bool = True):
+        for shard in self._shards:
+            shard.clear_all_memories(verbose=False)
+        if verbose:
+            print("✓ Todas las memorias han sido eliminadas")
+
+    @instrumented
+    def reset_database(self, verbose: bool = True):
+        """
+        Resetea la BD principal y todos los fragmentos.
+        La distribución de fragmentos se conserva.
+
+        Args:
+            verbose: Imprimir el detalle del reseteo
+        """
+        if verbose:
+            stats = self.get_system_stats()
+            print("\n⚠️  RESETEO COMPLETO DE LA BASE DE DATOS")
+            print("="*60)
+            print(f"Fragmentos: {self.shard_count}")
+            print(f"Reglas a eliminar: {stats['total_rules']}")
+            print(f"Memorias a eliminar: {stats['total_memories']}")
+
+        self._global.reset_database(verbose=False)
+        for index, shard in enumerate(self._shards):
+            shard.reset_database(verbose=False)
+            shard.reserve_memory_ids(_memory_id_base(self.epoch, index))
+
+        if verbose:
+            print("\n✅ Base de datos reseteada completamente a 0")
+            print("="*60)
+
+    # ==================== SNAPSHOTS ====================
+
+    @instrumented
+    def export_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Exporta reglas de la BD principal y usuarios y memorias de todos los
+        fragmentos en un solo snapshot, cargable en cualquier backend (con
+        o sin fragmentos). Cada BD se lee en su propia transacción de lectura.
+
+        Con extensión .db/.sqlite/.sqlite3 copia la BD principal con la API
+        de backup y le agrega las tablas de cada fragmento; la copia queda
+        sin fragmentar. Con otra extensión escribe JSON por líneas con gzip,
+        con el número de fragmentos y la época en el encabezado.
+
+        Args:
+            path: Archivo de destino
+
+        Returns:
+            Dict[str, int]: Filas exportadas por tabla
+        """
+        self.flush()
+
+        if path.lower().endswith(DatabaseManager.SQLITE_SNAPSHOT_EXTENSIONS):
+            self._global.export_snapshot(path)
+            target = sqlite3.connect(path)
+            try:
+                for shard in self._shards:
+                    target.execute('ATTACH DATABASE ? AS shard', (shard.db_path,))
+                    try:
+                        with target:
+                            for table in _SHARDED_TABLES:
+                                columns = ', '.join(
+                                    row[1] for row in target.execute(f'PRAGMA shard.table_info({table})')
+                                )
+                                target.execute(
+                                    f'INSERT INTO main.{table} ({columns}) '
+                                    f'SELECT {columns} FROM shard.{table} ORDER BY rowid'
+                                )
+                    finally:
+                        target.execute('DETACH DATABASE shard')
+                with target:
+                    target.execute("DELETE FROM system_counters WHERE name IN ('shard_count', 'shard_epoch')")
+                return self._global._table_counts(target)
+            finally:
+                target.close()
+
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        counts = {}
+        with ExitStack() as stack, gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as out:
+            connections = []
+            for manager in self._all_managers():
+                conn = stack.enter_context(manager._connection())
+                conn.execute('BEGIN')
+                stack.callback(conn.rollback)
+                connections.append(conn)
+
+            out.write(encoder.encode(DatabaseManager.snapshot_header(
+                schema_version=connections[0].execute('PRAGMA user_version').fetchone()[0],
+                shards=self.shard_count,
+                epoch=self.epoch,
+            )) + '\n')
+
+            owners = list(zip(self._all_managers(), connections))
+            for table in DatabaseManager.SNAPSHOT_TABLES:
+                sources = owners[1:] if table in _SHARDED_TABLES else owners[:1]
+                counts[table] = sum(
+                    manager._write_snapshot_table(conn, out, encoder, table) for manager, conn in sources
+                )
+
+        return counts
+
+    @instrumented
+    def import_snapshot(self, path: str) -> Dict[str, int]:
+        """
+        Reemplaza reglas, usuarios y memorias por los de un snapshot (de un
+        backend con o sin fragmentos). Usuarios y memorias van al fragmento
+        de su user_id con la distribución actual; los IDs se conservan.
+
+        Cada BD se carga en su propia transacción: si algo falla antes de
+        confirmar, ninguna cambia.
+
+        Args:
+            path: Archivo del snapshot
+
+        Returns:
+            Dict[str, int]: Filas importadas por tabla
+        """
+        counts = {}
+        batches = DatabaseManager.read_snapshot(path)
+        # El encabezado se valida antes de vaciar las tablas
+        first = next(batches, None)
+        with ExitStack() as stack:
+            connections = []
+            for manager in self._all_managers():
+                conn = stack.enter_context(manager._connection())
+                stack.enter_context(manager._bulk_load(conn))
+                manager._clear_learned_state(conn)
+                connections.append(conn)
+
+            if first is not None:
+                for table, columns, rows in itertools.chain((first,), batches):
+                    counts[table] = counts.get(table, 0) + len(rows)
+                    if table not in _SHARDED_TABLES:
+                        self._global._insert_snapshot_rows(connections[0], table, columns, rows)
+                        continue
+                    user_column = columns.index('user_id')
+                    by_shard: Dict[int, List[list]] = {}
+                    for row in rows:
+                        by_shard.setdefault(shard_index(row[user_column], self.shard_count), []).append(row)
+                    for index, shard_rows in by_shard.items():
+                        self._shards[index]._insert_snapshot_rows(
+                            connections[index + 1], table, columns, shard_rows
+                        )
+
+        return counts
+
+    def flush(self):
+        self._global.flush()
+        for shard in self._shards:
+            shard.flush()
+
+    def close(self):
+        self._global.close()
+        for shard in self._shards:
+            shard.close()
+
+
+# ==================== REFRAGMENTACIÓN ====================
+
+def reshard(db_path: str, shard_count: int, verbose: bool = True) -> Dict:
+    """
+    Redistribuye usuarios, memorias y memorias archivadas en un nuevo
+    número de fragmentos. Debe ejecutarse con la aplicación detenida.
+
+    Los fragmentos nuevos se escriben en archivos de la época siguiente;
+    el cambio se confirma al registrar la nueva distribución en la BD
+    principal y solo después se borran los datos anteriores. Si el proceso
+    se interrumpe antes, la distribución vigente queda intacta.
+
+    Args:
+        db_path: Ruta de la BD principal
+        shard_count: Número de fragmentos deseado
+        verbose: Imprimir progreso
+
+    Returns:
+        Dict: Fragmentos anteriores y nuevos, usuarios y memorias copiados y tiempo
+    """
+    if shard_count < 1:
+        raise ValueError("shard_count debe ser al menos 1")
+
+    start = time.perf_counter()
+    main_db = DatabaseManager(db_path, retention=RetentionPolicy())
+    old_count, old_epoch = main_db.get_shard_layout()
+    report = {'old_shards': old_count, 'new_shards': shard_count, 'users': 0, 'memories': 0}
+
+    if old_count == shard_count:
+        main_db.close()
+        report['elapsed_seconds'] = time.perf_counter() - start
+        return report
+
+    # Sin fragmentar, los usuarios están en la BD principal
+    sources = shard_paths(db_path, old_count, old_epoch) if old_count else [db_path]
+    if old_count:
+        # Llevar los fragmentos al esquema actual antes de copiarlos
+        for source in sources:
+            DatabaseManager(source, retention=RetentionPolicy()).close()
+    new_epoch = old_epoch + 1
+    targets = shard_paths(db_path, shard_count, new_epoch)
+
+    if verbose:
+        print(f"\n[Refragmentación: {old_count or 'sin fragmentar'} → {shard_count} fragmentos]")
+
+    def belongs_to(user_id: str) -> int:
+        return shard_index(user_id, shard_count)
+
+    try:
+        for index, target in enumerate(targets):
+            # Restos de un intento anterior interrumpido
+            _remove_database_files(target)
+            _open_shard(target, new_epoch, index, retention=RetentionPolicy()).close()
+
+            conn = sqlite3.connect(target)
+            conn.create_function('shard_of', 1, belongs_to, deterministic=True)
+            try:
+                for source_number, source in enumerate(sources):
+                    conn.execute('ATTACH DATABASE ? AS src', (source,))
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.execute('''
+                        INSERT INTO users (user_id, username, created_at)
+                        SELECT user_id, username, created_at FROM src.users WHERE shard_of(user_id) = ?
+                    ''', (index,))
+                    # Los IDs se conservan: son únicos entre fragmentos
+                    conn.execute('''
+                        INSERT INTO user_memory (id, user_id, context, created_at)
+                        SELECT id, user_id, context, created_at FROM src.user_memory
+                        WHERE shard_of(user_id) = ? ORDER BY id
+                    ''', (index,))
+                    conn.execute('''
+                        INSERT INTO user_memory_archive (id, user_id, context, consolidated_into, archived_at)
+                        SELECT id, user_id, context, consolidated_into, archived_at
+                        FROM src.user_memory_archive WHERE shard_of(user_id) = ?
+                    ''', (index,))
+                    conn.commit()
+                    conn.execute('DETACH DATABASE src')
+
+                users, memories = conn.execute(
+                    'SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM user_memory)'
+                ).fetchone()
+            finally:
+                conn.close()
+
+            report['users'] += users
+            report['memories'] += memories
+            if verbose:
+                print(f"   ✓ Fragmento {index}: {users} usuarios, {memories} memorias")
+
+        expected_users = expected_memories = 0
+        for source in sources:
+            conn = sqlite3.connect(source)
+            try:
+                users, memories = conn.execute(
+                    'SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM user_memory)'
+                ).fetchone()
+            finally:
+                conn.close()
+            expected_users += users
+            expected_memories += memories
+
+        if (report['users'], report['memories']) != (expected_users, expected_memories):
+            raise RuntimeError(
+                f"La copia no coincide: {report['users']}/{expected_users} usuarios, "
+                f"{report['memories']}/{expected_memories} memorias"
+            )
+    except BaseException:
+        for target in targets:
+            _remove_database_files(target)
+        main_db.close()
+        raise
+
+    # Punto de confirmación: a partir de aquí se usan los fragmentos nuevos
+    main_db.set_shard_layout(shard_count, new_epoch)
+
+    if old_count:
+        for source in sources:
+            _remove_database_files(source)
+    else:
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM user_memory_archive')
+            conn.execute('DELETE FROM user_memory')
+            conn.execute('DELETE FROM users')
+            conn.commit()
+        finally:
+            conn.close()
+    main_db.close()
+
+    report['elapsed_seconds'] = time.perf_counter() - start
+    if verbose:
+        print(f"\n   Usuarios: {report['users']} | Memorias: {report['memories']} | "
+              f"Tiempo: {report['elapsed_seconds']:.1f} s")
+    return report
@@ -0,0 +1,303 @@
+"""
+Interfaz de Almacenamiento
+Define el contrato común de los backends de persistencia (usuarios,
+reglas, memorias y estadísticas) y la fábrica para elegir uno.
+"""
+
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class StorageBackend(ABC):
+    """
+    Contrato que cumplen todos los backends de almacenamiento.
+    DatabaseManager lo implementa sobre SQLite e InMemoryStorage sobre
+    estructuras en memoria (pruebas de carga y evaluaciones sin disco).
+    """
+
+    # Columnas por las que se puede ordenar iter_rules
+    RULE_ORDER_FIELDS = ('id', 'validation_score', 'created_at', 'error_category')
+
+    # ==================== USUARIOS ====================
+
+    @abstractmethod
+    def create_user(self, user_id: str, username: str) -> bool:
+        """Crea un usuario. Retorna False si ya existía."""
+
+    @abstractmethod
+    def user_exists(self, user_id: str) -> bool:
+        """Indica si el usuario existe."""
+
+    @abstractmethod
+    def get_username(self, user_id: str) -> Optional[str]:
+        """Nombre del usuario o None si no existe."""
+
+    # ==================== REGLAS ====================
+
+    @staticmethod
+    def normalize_rule_text(rule_text: str) -> str:
+        """
+        Normaliza el texto de una regla para detectar duplicados:
+        minúsculas y espacios colapsados.
+
+        Args:
+            rule_text: Texto de la regla
+
+        Returns:
+            str: Texto normalizado
+        """
+        return re.sub(r'\s+', ' ', rule_text).strip().casefold()
+
+    @staticmethod
+    def rule_content_hash(rule_text: str) -> str:
+        """
+        Calcula el hash de contenido de una regla (SHA-1 del texto normalizado).
+
+        Args:
+            rule_text: Texto de la regla
+
+        Returns:
+            str: Hash hexadecimal
+        """
+        normalized = StorageBackend.normalize_rule_text(rule_text)
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def get_all_rules(self) -> str:
+        """
+        Obtiene todas las reglas unidas por saltos de línea.
+
+        Returns:
+            str: Texto de las reglas
+        """
+        return '\n'.join(rule['rule_text'] for rule in self.get_rules_snapshot())
+
+    @abstractmethod
+    def get_rules_version(self) -> int:
+        """Generación actual de las reglas; cambia con cada escritura."""
+
+    @abstractmethod
+    def get_rules_snapshot(self) -> Tuple[Dict, ...]:
+        """Todas las reglas con id, rule_text, error_category y validation_score."""
+
+    @abstractmethod
+    def rule_exists(self, rule_text: str) -> bool:
+        """Indica si existe una regla con el mismo texto normalizado."""
+
+    @abstractmethod
+    def save_rule(self, rule_text: str, error_category: str = 'general',
+                  validation_score: float = 0.0) -> int:
+        """Guarda una regla (sin duplicar) y retorna su ID."""
+
+    def save_rule_async(self, rule_text: str, error_category: str = 'general',
+                        validation_score: float = 0.0) -> Future:
+        """
+        Versión asíncrona de save_rule. Por defecto se ejecuta de inmediato.
+
+        Returns:
+            Future: Se resuelve con el ID de la regla
+        """
+        return self._completed(self.save_rule, rule_text, error_category, validation_score)
+
+    @abstractmethod
+    def save_rules_bulk(self, rules: List[Tuple[str, str, float]]) -> List[int]:
+        """Guarda varias reglas de una vez; retorna sus IDs en orden."""
+
+    @abstractmethod
+    def iter_rules(self, batch_size: int = 100, order_by: str = 'id',
+                   descending: bool = False) -> Iterator[Dict]:
+        """Recorre las reglas en el orden indicado."""
+
+    @abstractmethod
+    def get_rules_by_category(self, category: str) -> List[str]:
+        """Textos de las reglas de una categoría."""
+
+    @abstractmethod
+    def search_rules(self, query: str, k: int = 5) -> List[Dict]:
+        """Las k reglas más relevantes para la consulta."""
+
+    @abstractmethod
+    def consolidate_rules(self, canonical_id: int, duplicate_ids: List[int]) -> int:
+        """Fusiona reglas en la canónica (las archiva); retorna cuántas absorbió."""
+
+    @abstractmethod
+    def get_rule_provenance(self, rule_id: int) -> List[Dict]:
+        """Reglas archivadas que se consolidaron en la regla indicada."""
+
+    @abstractmethod
+    def record_rule_usage(self, deltas: List[Tuple[int, int, int, int]]):
+        """Suma (rule_id, inyecciones, 👍, 👎) a los contadores de uso de las reglas."""
+
+    @abstractmethod
+    def get_rule_usage(self) -> Dict[int, Dict]:
+        """created_at y contadores de uso de cada regla, por ID."""
+
+    # ==================== MEMORIA ====================
+
+    def get_user_memory(self, user_id: str, limit: Optional[int] = None) -> str:
+        """
+        Obtiene la memoria histórica del usuario (TODA por defecto).
+
+        Args:
+            user_id: ID del usuario
+            limit: Incluir solo las N memorias más recientes (opcional)
+
+        Returns:
+            str: Memoria formateada del usuario, en orden cronológico
+        """
+        if limit is None:
+            memories = list(self.iter_user_memory(user_id))
+        else:
+            memories = list(self.iter_user_memory(user_id, limit=limit, newest_first=True))
+            memories.reverse()
+
+        if memories:
+            all_memories = '\n'.join([f"- {memory['context']}" for memory in memories])
+            return f"HISTORIAL DE MEMORIA DEL USUARIO:\n{all_memories}"
+        return ''
+
+    @abstractmethod
+    def get_user_memory_version(self, user_id: str) -> int:
+        """Versión de la memoria del usuario; cambia con cada escritura."""
+
+    @abstractmethod
+    def iter_user_memory(self, user_id: str, limit: Optional[int] = None,
+                         newest_first: bool = False, batch_size: int = 100) -> Iterator[Dict]:
+        """Recorre las memorias del usuario (dicts con id y context)."""
+
+    @abstractmethod
+    def save_user_memory(self, user_id: str, context: str) -> int:
+        """Guarda una memoria y retorna su ID."""
+
+    def save_user_memory_async(self, user_id: str, context: str) -> Future:
+        """
+        Versión asíncrona de save_user_memory. Por defecto se ejecuta de inmediato.
+
+        Returns:
+            Future: Se resuelve con el ID de la memoria
+        """
+        return self._completed(self.save_user_memory, user_id, context)
+
+    @abstractmethod
+    def save_memories_bulk(self, memories: List[Tuple[str, str]]) -> List[int]:
+        """Guarda varias memorias (user_id, context); retorna sus IDs."""
+
+    @abstractmethod
+    def count_user_memories(self, user_id: str) -> int:
+        """Número de memorias activas del usuario."""
+
+    @abstractmethod
+    def count_users_with_memories(self) -> int:
+        """Usuarios con al menos una memoria activa (registrados o no)."""
+
+    @abstractmethod
+    def get_users_over_memory_limit(self, max_memories: int) -> List[Tuple[str, int]]:
+        """Usuarios con más de N memorias, de mayor a menor."""
+
+    @abstractmethod
+    def compact_user_memory(self, user_id: str, memory_ids: List[int],
+                            consolidated_context: str) -> int:
+        """Reemplaza varias memorias por una consolidada, archivando las originales."""
+
+    @abstractmethod
+    def search_user_memory(self, user_id: str, query: str, k: int = 5) -> List[Dict]:
+        """Las k memorias del usuario más relevantes para la consulta."""
+
+    # ==================== MÉTRICAS ====================
+
+    @abstractmethod
+    def get_system_stats(self) -> Dict[str, any]:
+        """Totales de reglas, usuarios y memorias, distribución de errores y score promedio."""
+
+    def get_instrumentation_report(self, top_statements: int = 10) -> Optional[Dict]:
+        """Mediciones de acceso a datos, o None si el backend no está instrumentado."""
+        return None
+
+    # ==================== UTILIDADES ====================
+
+    @abstractmethod
+    def clear_all_rules(self, verbose: bool = True):
+        """Elimina todas las reglas."""
+
+    @abstractmethod
+    def clear_all_memories(self, verbose: bool = True):
+        """Elimina todas las memorias."""
+
+    @abstractmethod
+    def reset_database(self, verbose: bool = True):
+        """Elimina usuarios, reglas y memorias."""
+
+    # ==================== SNAPSHOTS ====================
+
+    @abstractmethod
+    def export_snapshot(self, path: str) -> Dict[str, int]:
+        """Exporta usuarios, reglas y memorias (con sus archivos). Retorna filas por tabla."""
+
+    @abstractmethod
+    def import_snapshot(self, path: str) -> Dict[str, int]:
+        """Reemplaza usuarios, reglas y memorias por los de un snapshot. Retorna filas por tabla."""
+
+    def flush(self):
+        """Espera a que se confirmen las escrituras pendientes (si las hay)."""
+
+    def close(self):
+        """Libera los recursos del backend."""
+
+    def __enter__(self) -> 'StorageBackend':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _completed(func, *args) -> Future:
+        """Ejecuta func y retorna un Future ya resuelto con su resultado."""
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+# Variable de entorno para elegir el backend ('sqlite' o 'memory')
+STORAGE_ENV_VAR = 'KAVAK_STORAGE'
+
+
+def create_storage(backend: str = None, db_path: str = None, shards: int = None,
+                   **sqlite_options) -> StorageBackend:
+    """
+    Crea el backend de almacenamiento configurado.
+
+    Args:
+        backend: 'sqlite' o 'memory' (por defecto la variable KAVAK_STORAGE, o 'sqlite')
+        db_path: Ruta de la BD para SQLite (opcional)
+        shards: Fragmentar usuarios y memorias de SQLite en N archivos
+            (por defecto la variable KAVAK_SHARDS). Una BD ya fragmentada
+            se abre fragmentada aunque no se indique.
+        **sqlite_options: Opciones adicionales de DatabaseManager (p. ej. write_behind)
+
+    Returns:
+        StorageBackend: Backend listo para usar
+    """
+    backend = (backend or os.getenv(STORAGE_ENV_VAR) or 'sqlite').lower()
+
+    if backend == 'sqlite':
+        from .database import DatabaseManager
+        from .sharding import SHARDS_ENV_VAR, ShardedDatabaseManager
+
+        shards = shards or int(os.getenv(SHARDS_ENV_VAR) or 0)
+        if not shards:
+            manager = DatabaseManager(db_path, **sqlite_options)
+            if not manager.get_shard_layout()[0]:
+                return manager
+            manager.close()
+        return ShardedDatabaseManager(db_path, shards or None, **sqlite_options)
+    if backend == 'memory':
+        from .memory_storage import InMemoryStorage
+        return InMemoryStorage()
+
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
@@ -0,0 +1,217 @@
+"""
+Utilidades de Búsqueda de Texto
+Extracción de términos y ranking BM25 en memoria, sin dependencias externas.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+# Palabras vacías en español que no aportan a la búsqueda
+STOPWORDS = frozenset({
+    'a', 'al', 'como', 'con', 'cual', 'cuales', 'cuanto', 'de', 'del', 'el',
+    'en', 'es', 'la', 'las', 'lo', 'los', 'me', 'mi', 'o', 'para', 'por',
+    'que', 'se', 'si', 'su', 'sus', 'tiene', 'tienen', 'un', 'una', 'y', 'yo',
+})
+
+# Terminaciones que quita stem(), de la más larga a la más corta
+STEM_SUFFIXES = (
+    'amientos', 'amiento', 'aciones', 'acion', 'ciones', 'cion',
+    'ados', 'adas', 'idos', 'idas', 'ado', 'ada', 'ido', 'ida',
+    'ar', 'er', 'ir', 'an', 'en', 'es', 'os', 'as', 'a', 'e', 'o', 's',
+)
+
+
+def strip_accents(text: str) -> str:
+    """
+    Pasa el texto a minúsculas y quita los acentos
+    (equivalente al tokenizador unicode61 con remove_diacritics).
+
+    Args:
+        text: Texto original
+
+    Returns:
+        str: Texto normalizado
+    """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(token: str) -> str:
+    """
+    Reducción ligera para español: quita una terminación de plural,
+    género o verbo ("garantías" y "garantía" -> "garanti", "vendo" y
+    "vender" -> "vend"). Conserva al menos 4 caracteres.
+
+    Args:
+        token: Token normalizado (sin acentos)
+
+    Returns:
+        str: Raíz aproximada
+    """
+    for suffix in STEM_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str, stemmed: bool = False) -> List[str]:
+    """
+    Divide un texto en tokens normalizados, sin palabras vacías.
+
+    Args:
+        text: Texto original
+        stemmed: Reducir cada token con stem()
+
+    Returns:
+        List[str]: Tokens en orden de aparición (con repeticiones)
+    """
+    tokens = [token for token in re.findall(r'\w+', strip_accents(text)) if token not in STOPWORDS]
+    return [stem(token) for token in tokens] if stemmed else tokens
+
+
+def search_terms(text: str, stemmed: bool = False) -> List[str]:
+    """
+    Extrae los términos de búsqueda de un texto libre.
+
+    Args:
+        text: Pregunta o consulta del usuario
+        stemmed: Reducir cada término con stem()
+
+    Returns:
+        List[str]: Términos únicos en orden de aparición
+    """
+    return list(dict.fromkeys(tokenize(text, stemmed)))
+
+
+class BM25Index:
+    """
+    Índice BM25 en memoria sobre una colección de documentos.
+    Se construye una vez y responde consultas top-k.
+    """
+
+    def __init__(self, documents: Iterable[Tuple[object, str]], k1: float = 1.2, b: float = 0.75,
+                 stemmed: bool = False):
+        """
+        Construye el índice.
+
+        Args:
+            documents: Pares (clave, texto) a indexar
+            k1: Saturación de frecuencia de término
+            b: Normalización por longitud del documento
+            stemmed: Indexar y consultar raíces (stem) en vez de palabras
+                exactas. Desactivado da el mismo resultado que FTS5 unicode61
+        """
+        self.k1 = k1
+        self.b = b
+        self.stemmed = stemmed
+        self.keys: List[object] = []
+        self._lengths: List[int] = []
+        # término -> [(posición del documento, frecuencia)]
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+
+        for key, text in documents:
+            tokens = tokenize(text, stemmed)
+            position = len(self.keys)
+            self.keys.append(key)
+            self._lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self._postings.setdefault(term, []).append((position, frequency))
+
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def to_dict(self) -> Dict:
+        """
+        Estado serializable a JSON (claves incluidas), para guardar el
+        índice en disco y cargarlo sin volver a tokenizar.
+
+        Returns:
+            Dict: Parámetros, claves, longitudes y postings
+        """
+        return {
+            'k1': self.k1,
+            'b': self.b,
+            'stemmed': self.stemmed,
+            'keys': list(self.keys),
+            'lengths': list(self._lengths),
+            'postings': {term: [list(posting) for posting in postings]
+                         for term, postings in self._postings.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BM25Index':
+        """
+        Reconstruye un índice guardado con to_dict().
+
+        Args:
+            data: Estado de to_dict()
+
+        Returns:
+            BM25Index: Índice equivalente al original
+        """
+        index = cls((), k1=data['k1'], b=data['b'], stemmed=data['stemmed'])
+        index.keys = list(data['keys'])
+        index._lengths = list(data['lengths'])
+        index._postings = {term: [tuple(posting) for posting in postings]
+                           for term, postings in data['postings'].items()}
+        index._avg_length = (sum(index._lengths) / len(index._lengths)) if index._lengths else 0.0
+        return index
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """
+        Calcula el score BM25 de cada documento que contiene algún término.
+
+        Args:
+            query: Texto de la consulta
+
+        Returns:
+            Dict[int, float]: Posición del documento -> score (mayor = más relevante)
+        """
+        total = len(self.keys)
+        scores: Dict[int, float] = {}
+        for term in search_terms(query, self.stemmed):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                length_norm = 1 - self.b + self.b * self._lengths[position] / (self._avg_length or 1)
+                scores[position] = scores.get(position, 0.0) + idf * (
+                    frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                )
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[Tuple[object, float]]:
+        """
+        Retorna los k documentos más relevantes.
+
+        Args:
+            query: Texto de la consulta
+            k: Número máximo de resultados
+
+        Returns:
+            List[Tuple[object, float]]: Pares (clave, score), del más al menos relevante
+        """
+        ranked = sorted(self.scores(query).items(), key=lambda item: (-item[1], item[0]))
+        return [(self.keys[position], score) for position, score in ranked[:k]]
+
+
+def bm25_top_k(documents: Sequence[Tuple[object, str]], query: str, k: int) -> List[Tuple[object, float]]:
+    """
+    Atajo para rankear una colección pequeña sin conservar el índice.
+
+    Args:
+        documents: Pares (clave, texto)
+        query: Texto de la consulta
+        k: Número máximo de resultados
+
+    Returns:
+        List[Tuple[object, float]]: Pares (clave, score), del más al menos relevante
+    """
+    return BM25Index(documents).top_k(query, k)
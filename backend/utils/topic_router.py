@@ -0,0 +1,248 @@
+"""
+Enrutamiento de Reglas por Tema
+Clasificador local (palabras clave + pesos aprendidos de las reglas ya
+etiquetadas) que asigna temas a la pregunta y a cada regla, para cargar
+en el prompt solo los grupos de reglas del tema de la pregunta más un
+pequeño conjunto global, sin llamadas extra al LLM.
+"""
+
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .text_search import tokenize
+
+
+# Variable de entorno con las reglas sin tema que acompañan a cada grupo
+GLOBAL_RULES_ENV_VAR = 'KAVAK_GLOBAL_RULES'
+DEFAULT_GLOBAL_RULES = 3
+
+# Palabras clave de cada tema (se comparan por raíz, sin acentos)
+TOPIC_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    'garantia': ('garantía', 'garantizado', 'cobertura', 'falla', 'descompone', 'reparación'),
+    'devolucion': ('devolución', 'devolver', 'devuelvo', 'reembolso', 'regresar', 'arrepiento',
+                   'gusta'),
+    'financiamiento': ('financiamiento', 'financiar', 'crédito', 'enganche', 'mensualidad',
+                       'mensualidades', 'plazo', 'tasa', 'interés', 'aprobación', 'aprueban',
+                       'precalificación'),
+    'precios': ('precio', 'precios', 'cuesta', 'cuestan', 'costo', 'vale', 'comisiones', 'barato'),
+    'inventario': ('inventario', 'modelo', 'modelos', 'marca', 'disponible', 'disponibles',
+                   'híbrido', 'híbridos', 'eléctrico', 'eléctricos', 'kilometraje', 'suv',
+                   'toyota', 'mazda', 'honda', 'nissan'),
+    'inspeccion': ('inspección', 'inspeccionan', 'revisión', 'revisan', 'puntos'),
+    'venta': ('vender', 'vendo', 'venta', 'vendes', 'cotización', 'cotizar', 'oferta', 'compran'),
+    'pagos': ('pago', 'pagos', 'pagar', 'pagan', 'efectivo', 'tarjeta', 'transferencia', 'spei'),
+    'entrega': ('entrega', 'entregan', 'domicilio', 'recoger', 'envío', 'hub'),
+    'documentos': ('documento', 'documentos', 'ine', 'comprobante', 'rfc', 'factura', 'trámite',
+                   'trámites', 'placas', 'propietario'),
+    'apartado': ('apartar', 'apartado', 'aparto', 'reservar', 'reserva'),
+}
+
+
+class TopicClassifier:
+    """
+    Clasificador de temas por puntaje de términos. Cada palabra clave
+    suma 1 a su tema; fit() agrega pesos (hasta learned_weight) para los
+    términos de las reglas cuya categoría ya es un tema, proporcionales a
+    qué tan exclusivos de ese tema son.
+    """
+
+    def __init__(self, keywords: Optional[Dict[str, Iterable[str]]] = None,
+                 learned_weight: float = 0.5):
+        """
+        Inicializa el clasificador.
+
+        Args:
+            keywords: Palabras clave por tema (por defecto TOPIC_KEYWORDS)
+            learned_weight: Peso máximo de un término aprendido con fit()
+        """
+        keywords = TOPIC_KEYWORDS if keywords is None else keywords
+        self.topics: Tuple[str, ...] = tuple(keywords)
+        self.learned_weight = learned_weight
+
+        self._seed_weights: Dict[str, Dict[str, float]] = {}
+        for topic, words in keywords.items():
+            for word in words:
+                for term in tokenize(word, stemmed=True):
+                    self._seed_weights.setdefault(term, {})[topic] = 1.0
+        self._weights = self._seed_weights
+
+    def fit(self, labeled: Iterable[Tuple[str, str]]) -> 'TopicClassifier':
+        """
+        Aprende pesos de textos ya etiquetados con un tema (p. ej. reglas
+        cuya error_category es un tema). Las etiquetas desconocidas se
+        ignoran; reentrenar reemplaza lo aprendido antes.
+
+        Args:
+            labeled: Pares (tema, texto)
+
+        Returns:
+            TopicClassifier: El mismo clasificador
+        """
+        counts: Dict[str, Counter] = {}
+        for topic, text in labeled:
+            if topic in self.topics:
+                for term in set(tokenize(text, stemmed=True)):
+                    counts.setdefault(term, Counter())[topic] += 1
+
+        weights = {term: dict(topics) for term, topics in self._seed_weights.items()}
+        for term, by_topic in counts.items():
+            total = sum(by_topic.values())
+            for topic, count in by_topic.items():
+                learned = self.learned_weight * count / total
+                weights.setdefault(term, {})
+                weights[term][topic] = max(weights[term].get(topic, 0.0), learned)
+        self._weights = weights
+        return self
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """
+        Puntaje de cada tema con algún término en el texto.
+
+        Args:
+            text: Pregunta o regla
+
+        Returns:
+            Dict[str, float]: Tema -> puntaje
+        """
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(text, stemmed=True)):
+            for topic, weight in self._weights.get(term, {}).items():
+                scores[topic] = scores.get(topic, 0.0) + weight
+        return scores
+
+    def classify(self, text: str, max_topics: int = 2, min_score: float = 1.0,
+                 relative: float = 0.5) -> Tuple[str, ...]:
+        """
+        Temas del texto: los de puntaje >= min_score y >= relative veces
+        el mejor, como máximo max_topics.
+
+        Args:
+            text: Pregunta o regla
+            max_topics: Temas máximos
+            min_score: Puntaje mínimo (1.0 = al menos una palabra clave o equivalente)
+            relative: Fracción del mejor puntaje que debe alcanzar un tema
+
+        Returns:
+            Tuple[str, ...]: Temas, del más al menos probable (vacía si no hay)
+        """
+        scores = self.scores(text)
+        if not scores:
+            return ()
+        best = max(scores.values())
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return tuple(
+            topic for topic, score in ranked[:max_topics]
+            if score >= min_score and score >= best * relative
+        )
+
+
+class TopicRouter:
+    """
+    Elige los grupos de reglas de una pregunta. Cada regla pertenece al
+    tema de su error_category si es un tema conocido; si no (las
+    categorías del Agente Optimizador son tipos de error), a los temas que
+    el clasificador encuentra en su texto. Las reglas sin tema forman el
+    conjunto global, del que se agregan las global_rules de mayor
+    validation_score.
+
+    Los temas de las reglas se calculan una vez por snapshot.
+    """
+
+    def __init__(self, classifier: Optional[TopicClassifier] = None,
+                 global_rules: Optional[int] = None, max_topics: int = 2,
+                 rule_max_topics: int = 3):
+        """
+        Inicializa el enrutador.
+
+        Args:
+            classifier: Clasificador (por defecto TopicClassifier con TOPIC_KEYWORDS)
+            global_rules: Reglas sin tema por pregunta (por defecto KAVAK_GLOBAL_RULES o 3)
+            max_topics: Temas máximos por pregunta
+            rule_max_topics: Temas máximos por regla (una regla puede estar en varios grupos)
+        """
+        if global_rules is None:
+            global_rules = int(os.getenv(GLOBAL_RULES_ENV_VAR) or DEFAULT_GLOBAL_RULES)
+        if global_rules < 0:
+            raise ValueError("global_rules no puede ser negativo")
+
+        self.classifier = classifier or TopicClassifier()
+        self.global_rules = global_rules
+        self.max_topics = max_topics
+        self.rule_max_topics = rule_max_topics
+
+        self._lock = threading.Lock()
+        # (snapshot, grupos por tema, posiciones globales elegidas)
+        self._buckets: Optional[Tuple[Sequence[Dict], Dict[str, List[int]], Tuple[int, ...]]] = None
+        # Temas de la última pregunta enrutada
+        self.last_topics: Tuple[str, ...] = ()
+
+    def _index(self, rules: Sequence[Dict]) -> Tuple[Dict[str, List[int]], Tuple[int, ...]]:
+        """Grupos de posiciones por tema y conjunto global del snapshot."""
+        cached = self._buckets
+        if cached is not None and cached[0] is rules:
+            return cached[1], cached[2]
+
+        with self._lock:
+            cached = self._buckets
+            if cached is not None and cached[0] is rules:
+                return cached[1], cached[2]
+
+            topics = set(self.classifier.topics)
+            self.classifier.fit(
+                (rule['error_category'], rule['rule_text'])
+                for rule in rules if rule.get('error_category') in topics
+            )
+
+            buckets: Dict[str, List[int]] = {}
+            untopiced = []
+            for position, rule in enumerate(rules):
+                category = rule.get('error_category')
+                rule_topics = ((category,) if category in topics
+                               else self.classifier.classify(rule['rule_text'], self.rule_max_topics))
+                for topic in rule_topics:
+                    buckets.setdefault(topic, []).append(position)
+                if not rule_topics:
+                    untopiced.append(position)
+
+            best_global = sorted(
+                untopiced, key=lambda position: -(rules[position]['validation_score'] or 0.0)
+            )[:self.global_rules]
+            self._buckets = (rules, buckets, tuple(sorted(best_global)))
+            return buckets, self._buckets[2]
+
+    def route(self, rules: Sequence[Dict], query: str) -> Optional[Tuple[List[int], Tuple[int, ...]]]:
+        """
+        Reglas candidatas para una pregunta.
+
+        Args:
+            rules: Snapshot de reglas
+            query: Pregunta del usuario
+
+        Returns:
+            Tuple: (posiciones de los grupos de sus temas, posiciones del
+                conjunto global), o None si la pregunta no tiene tema
+        """
+        buckets, global_positions = self._index(rules)
+        self.last_topics = self.classifier.classify(query, self.max_topics)
+        if not self.last_topics:
+            return None
+
+        positions = sorted({position for topic in self.last_topics for position in buckets.get(topic, ())})
+        return positions, global_positions
+
+    def bucket_sizes(self, rules: Sequence[Dict]) -> Dict[str, int]:
+        """
+        Reglas por tema del snapshot (más 'global', las reglas sin tema elegidas).
+
+        Args:
+            rules: Snapshot de reglas
+
+        Returns:
+            Dict[str, int]: Tema -> número de reglas
+        """
+        buckets, global_positions = self._index(rules)
+        sizes = {topic: len(positions) for topic, positions in sorted(buckets.items())}
+        sizes['global'] = len(global_positions)
+        return sizes
@@ -0,0 +1,185 @@
+"""
+Cola de Escritura Diferida (write-behind)
+Serializa las escrituras a SQLite en un único hilo escritor que las
+agrupa en transacciones, evitando esperas por "database is locked"
+cuando varias sesiones escriben a la vez.
+"""
+
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Tuple
+
+
+# Operación de escritura: recibe la conexión del hilo escritor y retorna un resultado
+WriteOperation = Callable[[sqlite3.Connection], Any]
+
+# Marca interna para detener el hilo escritor
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Cola en proceso con un solo hilo escritor.
+    Cada operación encolada recibe un Future con su resultado; las
+    operaciones pendientes se aplican juntas en una transacción, cada
+    una dentro de su propio SAVEPOINT para que un fallo no afecte al resto.
+    """
+
+    def __init__(self, connection_factory: Callable[[], sqlite3.Connection],
+                 max_batch: int = 256):
+        """
+        Inicializa la cola y arranca el hilo escritor.
+
+        Args:
+            connection_factory: Función que abre la conexión propia del hilo escritor
+            max_batch: Máximo de operaciones por transacción
+        """
+        self._connection_factory = connection_factory
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+        # Estadísticas de agrupamiento
+        self.transactions = 0
+        self.operations = 0
+
+        # Daemon: el flush final lo hace close() desde el hook atexit
+        self._thread = threading.Thread(
+            target=self._run, name='db-write-behind', daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, operation: WriteOperation) -> Future:
+        """
+        Encola una operación de escritura.
+
+        Args:
+            operation: Función que recibe la conexión y ejecuta la escritura
+
+        Returns:
+            Future: Se resuelve con el resultado de la operación tras el commit
+        """
+        if self._closed:
+            raise RuntimeError("La cola de escritura está cerrada")
+        future = Future()
+        self._queue.put((operation, future))
+        return future
+
+    def flush(self, timeout: float = None):
+        """
+        Espera a que todas las escrituras encoladas hasta ahora estén confirmadas.
+
+        Args:
+            timeout: Segundos máximos de espera (None = sin límite)
+        """
+        if self._closed or not self._thread.is_alive():
+            return
+        # Una operación vacía actúa como barrera: la cola es FIFO
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Vacía la cola y detiene el hilo escritor.
+
+        Args:
+            timeout: Segundos máximos de espera (None = sin límite)
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put((_STOP, None))
+        self._thread.join(timeout)
+
+    def pending(self) -> int:
+        """Número aproximado de operaciones en espera."""
+        return self._queue.qsize()
+
+    def _run(self):
+        """Bucle del hilo escritor."""
+        conn = self._connection_factory()
+        try:
+            self._process(conn)
+        finally:
+            conn.close()
+
+    def _process(self, conn: sqlite3.Connection):
+        """
+        Atiende la cola hasta recibir la marca de parada.
+
+        Args:
+            conn: Conexión exclusiva del hilo escritor
+        """
+        while True:
+            batch: List[Tuple[Any, Future]] = [self._queue.get()]
+
+            # Agrupar lo que ya esté esperando, sin bloquear
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(operation is _STOP for operation, _ in batch)
+            work = [(operation, future) for operation, future in batch if operation is not _STOP]
+            if work:
+                self._apply_batch(conn, work)
+            if stop:
+                # Aplicar lo que haya quedado detrás de la marca de parada
+                remaining = []
+                while True:
+                    try:
+                        remaining.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if remaining:
+                    self._apply_batch(conn, remaining)
+                return
+
+    def _apply_batch(self, conn: sqlite3.Connection, batch: List[Tuple[WriteOperation, Future]]):
+        """
+        Aplica un lote de operaciones en una sola transacción.
+
+        Args:
+            conn: Conexión exclusiva del hilo escritor
+            batch: Pares (operación, future)
+        """
+        # Descartar operaciones cuyo Future fue cancelado mientras esperaba
+        batch = [(operation, future) for operation, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for operation, future in batch:
+                conn.execute('SAVEPOINT write_op')
+                try:
+                    results.append((future, operation(conn), None))
+                    conn.execute('RELEASE SAVEPOINT write_op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO SAVEPOINT write_op')
+                    conn.execute('RELEASE SAVEPOINT write_op')
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            # Falló la transacción completa: ninguna operación quedó guardada
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.transactions += 1
+        self.operations += len(batch)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,183 @@
+"""
+Benchmark del Historial en Ventana
+Simula sesiones largas y mide los tokens de entrada por turno del Agente
+Principal con el historial completo vs la ventana de últimos turnos más
+el resumen acumulado (ConversationWindow).
+
+Usa un LLM simulado (respuestas de longitud realista y una latencia fija),
+así no consume la API y los resultados son reproducibles. Los tokens del
+resumidor se reportan aparte: se gastan fuera del flujo del chat.
+
+Uso:
+    python benchmark_conversation.py
+    python benchmark_conversation.py --turns 50 --sessions 5 --window 4 6 10
+    python benchmark_conversation.py --latency 0.2
+"""
+
+import argparse
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from backend.agents.main_agent import MainAgent
+from backend.agents.summarizer_agent import SummarizerAgent
+from backend.utils.conversation_window import ConversationWindow
+from backend.utils.prompt_budget import PromptAssembler, TokenCounter
+
+
+QUESTIONS = [
+    "¿Qué garantía tienen los autos?",
+    "¿Cuánto cuesta un Mazda 3 2020?",
+    "¿Qué requisitos piden para el financiamiento?",
+    "¿Puedo devolver el auto si no me gusta?",
+    "¿Tienen SUVs familiares por menos de $400,000?",
+    "¿Cómo funciona la inspección de 240 puntos?",
+    "¿Hacen entregas a domicilio en Guadalajara?",
+    "¿Qué tasa de interés manejan a 48 meses?",
+    "¿Cuánto me dan por mi Versa 2015?",
+    "¿Puedo apartar un auto mientras me aprueban el crédito?",
+]
+
+ANSWER_SENTENCES = [
+    "Todos nuestros autos incluyen garantía de 3 meses o 3,000 km, lo que ocurra primero.",
+    "El financiamiento tiene tasas desde 12.9% anual y plazos de 12 a 72 meses.",
+    "El enganche mínimo es del 10% del precio del auto.",
+    "Cada auto pasa una inspección de 240 puntos antes de publicarse.",
+    "Tienes 7 días o 300 km para devolver el auto con reembolso del 100%.",
+    "Tenemos opciones como Mazda CX-5, Toyota RAV4 y Honda CR-V en ese rango.",
+    "La entrega a domicilio es sin costo en la zona metropolitana en 2-3 días.",
+    "La aprobación del crédito tarda de 24 a 48 horas.",
+    "¿Qué tipo de uso le darías al auto y cuál es tu presupuesto máximo?",
+]
+
+
+class _ScriptedLLM:
+    """
+    LLM simulado: responde con frases de ANSWER_SENTENCES y, si recibe el
+    prompt de resumen, con un resumen de longitud acotada.
+    """
+
+    def __init__(self, latency: float, seed: int):
+        self.latency = latency
+        self.random = random.Random(seed)
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        if messages[0].content.startswith(SummarizerAgent.ROLLING_PROMPT[:40]):
+            content = ("Usuario busca SUV familiar con presupuesto de $350,000 a $400,000 MXN y "
+                       "financiamiento a 48 meses. Ya se le explicó la garantía de 3 meses o 3,000 km, "
+                       "la devolución de 7 días y la inspección de 240 puntos. Pendiente: cotizar su "
+                       "Versa 2015 y agendar la prueba de manejo.")
+        else:
+            content = ' '.join(self.random.sample(ANSWER_SENTENCES, self.random.randint(3, 6)))
+        return type('Response', (), {'content': content})()
+
+
+def run_session(turns: int, window_turns: int, latency: float, seed: int) -> Dict:
+    """
+    Simula una sesión y mide cada turno.
+
+    Args:
+        turns: Turnos de la sesión
+        window_turns: Turnos textuales (0 = historial completo)
+        latency: Segundos de cada llamada al LLM simulado
+        seed: Semilla de las respuestas
+
+    Returns:
+        Dict: Tokens del Agente Principal por turno, tokens del resumidor
+            y latencia del turno (respuesta + actualización de la ventana)
+    """
+    llm = _ScriptedLLM(latency, seed)
+    counter = TokenCounter()
+    # Presupuesto amplio: se mide el crecimiento real, sin recortes
+    assembler = PromptAssembler(max_tokens=10**9, counter=counter)
+    main_agent = MainAgent(llm, assembler=assembler)
+    summarizer_agent = SummarizerAgent(llm, assembler=assembler)
+    window = ConversationWindow(summarizer_agent, window_turns=window_turns)
+
+    summary_tokens = []
+    update = summarizer_agent.update_conversation_summary
+
+    def counted_update(summary, messages):
+        # Tokens de entrada del resumidor, fuera del flujo del chat
+        summary_tokens.append(sum(counter.count_message(m) for m in messages)
+                              + counter.count(SummarizerAgent.ROLLING_PROMPT + summary))
+        return update(summary, messages)
+
+    summarizer_agent.update_conversation_summary = counted_update
+
+    prompt = main_agent.build_system_prompt('', "HISTORIAL DE MEMORIA DEL USUARIO:\n- Busca SUV familiar")
+    chat_history = [SystemMessage(content=prompt)]
+    tokens, latencies = [], []
+    rng = random.Random(seed)
+
+    for _ in range(turns):
+        chat_history.append(HumanMessage(content=rng.choice(QUESTIONS)))
+        start = time.perf_counter()
+        history, summary = window.view(chat_history)
+        answer = main_agent.respond(history, summary=summary)
+        chat_history.append(AIMessage(content=answer))
+        window.update(chat_history)
+        latencies.append(time.perf_counter() - start)
+        tokens.append(main_agent.last_prompt_report['tokens'])
+
+    window.wait()
+    window.shutdown()
+    return {'tokens': tokens, 'summary_tokens': summary_tokens, 'latencies': latencies}
+
+
+def main():
+    """
+    Ejecuta el benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Tokens por turno: historial completo vs ventana + resumen")
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--window', type=int, nargs='+', default=[6],
+                        help="Turnos textuales a comparar contra el historial completo")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Segundos por llamada del LLM simulado")
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("BENCHMARK: Historial completo vs ventana + resumen acumulado")
+    print("="*70)
+    print(f"   Sesiones: {args.sessions} | Turnos por sesión: {args.turns} | "
+          f"Latencia LLM simulada: {args.latency * 1000:.0f} ms")
+
+    checkpoints = sorted({1, 10, 25, args.turns} & set(range(1, args.turns + 1)))
+    header = ''.join(f"{'t=' + str(t):>8}" for t in checkpoints)
+    print(f"\n   {'Modo':<14}{header}{'Total':>10}{'Resumen':>10}{'Turno p50':>11}{'p95':>8}")
+    print("   " + "─"*(14 + 8 * len(checkpoints) + 39))
+
+    baseline_total = None
+    for window_turns in [0] + args.window:
+        runs = [run_session(args.turns, window_turns, args.latency, seed) for seed in range(args.sessions)]
+        per_turn = [statistics.mean(run['tokens'][t - 1] for run in runs) for t in checkpoints]
+        total = statistics.mean(sum(run['tokens']) for run in runs)
+        summary_total = statistics.mean(sum(run['summary_tokens']) for run in runs)
+        latencies: List[float] = sorted(l for run in runs for l in run['latencies'])
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+
+        label = 'completo' if window_turns == 0 else f'ventana {window_turns}'
+        row = ''.join(f"{tokens:>8.0f}" for tokens in per_turn)
+        print(f"   {label:<14}{row}{total:>10.0f}{summary_total:>10.0f}{p50:>9.0f}ms{p95:>6.0f}ms")
+
+        if baseline_total is None:
+            baseline_total = total
+        else:
+            saved = (1 - total / baseline_total) * 100
+            print(f"   {'':<14}tokens del chat −{saved:.1f}% "
+                  f"(−{(1 - (total + summary_total) / baseline_total) * 100:.1f}% contando el resumidor)")
+
+    print("\n   t=N: tokens de entrada del Agente Principal en el turno N (promedio)")
+    print("   Resumen: tokens de entrada del resumidor, en segundo plano")
+    print("\n" + "="*70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,633 @@
+"""
+Benchmarks de la capa de persistencia (DatabaseManager)
+Mide latencias por llamada bajo sesiones concurrentes simuladas.
+
+Uso:
+    python benchmark_database.py connections --threads 8 --calls 500
+    python benchmark_database.py stats --rows 100000
+    python benchmark_database.py bulk --rows 1000
+    python benchmark_database.py contention --threads 16 --writes 200
+    python benchmark_database.py search --rows 200000
+    python benchmark_database.py backends --rows 2000 --calls 500
+    python benchmark_database.py shards --threads 16 --writes 200 --shards 4
+    python benchmark_database.py snapshot --rows 1000000
+    python benchmark_database.py instrumentation --rows 2000 --calls 500
+    python benchmark_database.py retention --rows 200000 --calls 500
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+from backend.utils.database import DatabaseManager
+from backend.utils.retention import RetentionPolicy, RetentionSweeper
+from backend.utils.storage import StorageBackend, create_storage
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    """Percentil simple sobre una lista de muestras."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _print_latencies(label: str, samples: List[float], elapsed: float):
+    """Imprime un resumen de latencias en microsegundos."""
+    micros = [s * 1e6 for s in samples]
+    print(f"\n   {label}")
+    print(f"      Llamadas:    {len(micros)}")
+    print(f"      Promedio:    {statistics.mean(micros):8.1f} µs")
+    print(f"      p50:         {_percentile(micros, 50):8.1f} µs")
+    print(f"      p95:         {_percentile(micros, 95):8.1f} µs")
+    print(f"      Throughput:  {len(micros) / elapsed:8.0f} llamadas/s")
+
+
+def _seed_database(db_manager: StorageBackend, users: int, rules: int, memories_per_user: int):
+    """Llena la BD con datos sintéticos para los benchmarks."""
+    for i in range(rules):
+        db_manager.save_rule(f"REGLA {i}: mencionar garantía de 3 meses o 3,000 km", 'incompleto', 1.0)
+    for u in range(users):
+        user_id = f"bench_{u}"
+        db_manager.create_user(user_id, user_id)
+        for m in range(memories_per_user):
+            db_manager.save_user_memory(user_id, f"Usuario busca SUV familiar, presupuesto {m}00k")
+
+
+def _run_concurrent(threads: int, worker: Callable[[int], List[float]]) -> Dict:
+    """Ejecuta `worker` en N hilos y junta las muestras de latencia."""
+    samples: List[float] = []
+    lock = threading.Lock()
+
+    def run(index: int):
+        local_samples = worker(index)
+        with lock:
+            samples.extend(local_samples)
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {'samples': samples, 'elapsed': elapsed}
+
+
+# ==================== CONEXIONES ====================
+
+def bench_connections(args):
+    """
+    Compara conexión por llamada (comportamiento anterior) contra
+    conexiones persistentes por hilo, con N sesiones concurrentes.
+    """
+    print("\n" + "="*70)
+    print("BENCHMARK: Conexiones por llamada vs persistentes por hilo")
+    print("="*70)
+    print(f"   Hilos: {args.threads} | Llamadas por hilo: {args.calls}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        seed = DatabaseManager(db_path)
+        _seed_database(seed, users=args.threads, rules=50, memories_per_user=10)
+        seed.close()
+
+        for persistent in (False, True):
+            db_manager = DatabaseManager(db_path, persistent_connections=persistent)
+
+            def worker(index: int) -> List[float]:
+                user_id = f"bench_{index}"
+                local_samples = []
+                for call in range(args.calls):
+                    start = time.perf_counter()
+                    # Misma mezcla de lecturas que un rerun de Streamlit
+                    if call % 4 == 0:
+                        db_manager.get_all_rules()
+                    elif call % 4 == 1:
+                        db_manager.get_user_memory(user_id)
+                    elif call % 4 == 2:
+                        db_manager.user_exists(user_id)
+                    else:
+                        db_manager.get_system_stats()
+                    local_samples.append(time.perf_counter() - start)
+                return local_samples
+
+            result = _run_concurrent(args.threads, worker)
+            label = "Persistentes por hilo (nuevo)" if persistent else "Conexión por llamada (anterior)"
+            _print_latencies(label, result['samples'], result['elapsed'])
+            db_manager.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== ESTADÍSTICAS ====================
+
+def _legacy_system_stats(conn) -> Dict:
+    """Las cinco consultas agregadas que usaba get_system_stats antes de system_counters."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM prompt_rules')
+    total_rules = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM users')
+    total_users = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM user_memory')
+    total_memories = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT error_category, COUNT(*) FROM prompt_rules
+        WHERE error_category IS NOT NULL GROUP BY error_category
+    ''')
+    error_distribution = dict(cursor.fetchall())
+    cursor.execute('SELECT AVG(validation_score) FROM prompt_rules WHERE validation_score > 0')
+    avg_validation = cursor.fetchone()[0] or 0.0
+    return {
+        'total_rules': total_rules,
+        'total_users': total_users,
+        'total_memories': total_memories,
+        'error_distribution': error_distribution,
+        'avg_validation_score': avg_validation
+    }
+
+
+def bench_stats(args):
+    """
+    Compara get_system_stats (lectura de system_counters) contra las
+    consultas agregadas anteriores a medida que crecen las tablas.
+    """
+    print("\n" + "="*70)
+    print("BENCHMARK: get_system_stats con contadores vs agregados")
+    print("="*70)
+
+    categories = ['vago', 'incorrecto', 'incompleto', 'fuera_contexto', 'general']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        inserted = 0
+
+        for size in (args.rows // 100, args.rows // 10, args.rows):
+            with db_manager._transaction() as conn:
+                conn.executemany(
+                    'INSERT INTO prompt_rules (rule_text, error_category, validation_score, content_hash) '
+                    'VALUES (?, ?, ?, ?)',
+                    ((f"regla {i}", categories[i % len(categories)], (i % 3) / 2, f"h{i}")
+                     for i in range(inserted, size))
+                )
+                conn.executemany(
+                    'INSERT INTO user_memory (user_id, context) VALUES (?, ?)',
+                    ((f"user_{i % 500}", f"memoria {i}") for i in range(inserted, size))
+                )
+            inserted = size
+
+            conn = db_manager._get_connection()
+            for label, func in (("Agregados (anterior)", lambda: _legacy_system_stats(conn)),
+                                ("system_counters (nuevo)", db_manager.get_system_stats)):
+                samples = []
+                start = time.perf_counter()
+                for _ in range(args.calls):
+                    call_start = time.perf_counter()
+                    func()
+                    samples.append(time.perf_counter() - call_start)
+                _print_latencies(f"{label} - {size:,} filas", samples, time.perf_counter() - start)
+
+        db_manager.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== ESCRITURAS EN LOTE ====================
+
+def bench_bulk(args):
+    """
+    Compara importar N reglas y memorias con save_rule/save_user_memory
+    en bucle (un commit por fila) contra save_rules_bulk/save_memories_bulk.
+    """
+    print("\n" + "="*70)
+    print(f"BENCHMARK: Importación de {args.rows:,} reglas y memorias")
+    print("="*70)
+
+    rules = [(f"REGLA {i}: dar datos concretos del tema {i}", 'general', 1.0) for i in range(args.rows)]
+    memories = [(f"user_{i % 50}", f"Usuario interesado en el modelo {i}") for i in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, bulk in (("Fila por fila (anterior)", False), ("En lote (nuevo)", True)):
+            db_manager = DatabaseManager(os.path.join(tmp, f"bench_{bulk}.db"))
+
+            start = time.perf_counter()
+            if bulk:
+                db_manager.save_rules_bulk(rules)
+                db_manager.save_memories_bulk(memories)
+            else:
+                for rule in rules:
+                    db_manager.save_rule(*rule)
+                for memory in memories:
+                    db_manager.save_user_memory(*memory)
+            elapsed = time.perf_counter() - start
+
+            print(f"\n   {label}")
+            print(f"      Tiempo total:  {elapsed * 1000:8.1f} ms")
+            print(f"      Por fila:      {elapsed / (2 * args.rows) * 1e6:8.1f} µs")
+            db_manager.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== CONTENCIÓN DE ESCRITURA ====================
+
+def bench_contention(args):
+    """
+    N hilos escribiendo memorias a la vez: transacción por escritura en
+    cada hilo contra la cola write-behind con un solo escritor.
+    """
+    print("\n" + "="*70)
+    print("BENCHMARK: Contención de escritura con N hilos")
+    print("="*70)
+    print(f"   Hilos: {args.threads} | Escrituras por hilo: {args.writes}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for write_behind in (False, True):
+            db_manager = DatabaseManager(
+                os.path.join(tmp, f"bench_{write_behind}.db"), write_behind=write_behind
+            )
+            errors = []
+
+            def worker(index: int) -> List[float]:
+                local_samples = []
+                for i in range(args.writes):
+                    start = time.perf_counter()
+                    try:
+                        db_manager.save_user_memory(f"user_{index}", f"memoria {i} del hilo {index}")
+                    except Exception as e:
+                        errors.append(e)
+                    local_samples.append(time.perf_counter() - start)
+                return local_samples
+
+            result = _run_concurrent(args.threads, worker)
+            label = "Cola write-behind (nuevo)" if write_behind else "Transacción por hilo (anterior)"
+            _print_latencies(label, result['samples'], result['elapsed'])
+            print(f"      Errores:     {len(errors):8d}")
+            if write_behind:
+                queue = db_manager._write_queue
+                print(f"      Transacciones: {queue.transactions} "
+                      f"({queue.operations / max(queue.transactions, 1):.1f} escrituras por commit)")
+            db_manager.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== FRAGMENTACIÓN ====================
+
+def bench_shards(args):
+    """
+    N hilos guardando memorias de usuarios distintos: una sola BD contra
+    la BD fragmentada por usuario, con y sin write-behind.
+    """
+    print("\n" + "="*70)
+    print(f"BENCHMARK: Escrituras con 1 BD vs {args.shards} fragmentos")
+    print("="*70)
+    print(f"   Hilos: {args.threads} | Escrituras por hilo: {args.writes}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for write_behind in (False, True):
+            for shards in (None, args.shards):
+                db_path = os.path.join(tmp, f"bench_{write_behind}_{shards}.db")
+                storage = create_storage('sqlite', db_path, shards=shards, write_behind=write_behind)
+                errors = []
+
+                def worker(index: int) -> List[float]:
+                    local_samples = []
+                    for i in range(args.writes):
+                        start = time.perf_counter()
+                        try:
+                            storage.save_user_memory(f"user_{index}_{i % 10}", f"memoria {i} del hilo {index}")
+                        except Exception as e:
+                            errors.append(e)
+                        local_samples.append(time.perf_counter() - start)
+                    return local_samples
+
+                result = _run_concurrent(args.threads, worker)
+                mode = "write-behind" if write_behind else "transacción por hilo"
+                layout = f"{shards} fragmentos" if shards else "1 BD"
+                _print_latencies(f"{layout}, {mode}", result['samples'], result['elapsed'])
+                print(f"      Errores:     {len(errors):8d}")
+                storage.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== SNAPSHOTS ====================
+
+def bench_snapshot(args):
+    """
+    Exporta e importa un estado de N filas (1/4 reglas, 3/4 memorias)
+    en JSON por líneas comprimido y como copia SQLite, y compara el
+    reseteo masivo con el DELETE fila por fila con triggers.
+    """
+    print("\n" + "="*70)
+    print(f"BENCHMARK: Snapshots con {args.rows:,} filas")
+    print("="*70)
+
+    def timed(label: str, func: Callable):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        print(f"   {label:<38} {elapsed:8.2f} s")
+        return result
+
+    rules = args.rows // 4
+    memories = args.rows - rules
+    with tempfile.TemporaryDirectory() as tmp:
+        source = DatabaseManager(os.path.join(tmp, 'source.db'))
+        timed("Carga inicial (save_*_bulk)", lambda: (
+            source.save_rules_bulk([(f"REGLA {i}: mencionar garantía y financiamiento", 'general', 1.0)
+                                    for i in range(rules)]),
+            source.save_memories_bulk([(f"user_{i % 10000}", f"Usuario busca SUV familiar, presupuesto {i}")
+                                       for i in range(memories)]),
+        ))
+
+        jsonl_path = os.path.join(tmp, 'snapshot.jsonl.gz')
+        sqlite_path = os.path.join(tmp, 'snapshot.db')
+        timed("export_snapshot (.jsonl.gz)", lambda: source.export_snapshot(jsonl_path))
+        timed("export_snapshot (.db, backup API)", lambda: source.export_snapshot(sqlite_path))
+        print(f"   {'Tamaño .jsonl.gz / .db':<38} {os.path.getsize(jsonl_path) / 1e6:8.1f} MB / "
+              f"{os.path.getsize(sqlite_path) / 1e6:.1f} MB")
+        source.close()
+
+        target = DatabaseManager(os.path.join(tmp, 'target.db'))
+        timed("import_snapshot (.jsonl.gz)", lambda: target.import_snapshot(jsonl_path))
+        timed("import_snapshot (.db, ATTACH)", lambda: target.import_snapshot(sqlite_path))
+
+        def legacy_reset():
+            # Reseteo anterior: DELETE con triggers de contadores y FTS por fila
+            with target._transaction() as conn:
+                for table in ('prompt_rules', 'user_memory', 'users'):
+                    conn.execute(f'DELETE FROM {table}')
+
+        timed("Reseteo anterior (DELETE con triggers)", legacy_reset)
+        target.import_snapshot(sqlite_path)
+        timed("reset_database (vaciado masivo)", lambda: target.reset_database(verbose=False))
+        target.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== BÚSQUEDA ====================
+
+def bench_search(args):
+    """
+    Latencia de search_rules y search_user_memory (FTS5 + BM25) con
+    cientos de miles de filas. El texto combina un tema del dominio con
+    vocabulario variado, para que cada término coincida con una fracción
+    realista de las filas.
+    """
+    print("\n" + "="*70)
+    print(f"BENCHMARK: Búsqueda FTS5 con {args.rows:,} reglas y memorias")
+    print("="*70)
+
+    rng = random.Random(42)
+    topics = ['garantía', 'financiamiento', 'enganche', 'inspección', 'venta', 'precio',
+              'Jetta', 'Versa', 'Corolla', 'Civic', 'SUV', 'sedán', 'kilometraje', 'entrega',
+              'documentos', 'tasa', 'plazo', 'apartado', 'devolución', 'seguro', 'placas',
+              'tenencia', 'hub', 'cotización', 'oferta', 'pago', 'SPEI', 'buró', 'motor',
+              'transmisión', 'frenos', 'suspensión', 'híbrido', 'eléctrico', 'pickup']
+    vocabulary = [f"palabra{n}" for n in range(5000)]
+    questions = ["¿Qué garantías tienen los autos?", "Requisitos de financiamiento y enganche",
+                 "¿Cuánto cuesta un Jetta?", "Quiero vender mi SUV"]
+
+    def text(i: int) -> str:
+        words = rng.sample(vocabulary, 10) + [topics[i % len(topics)]]
+        rng.shuffle(words)
+        return ' '.join(words)
+
+    user_ids = [f"cliente{n}_{n * 2654435761 % 16**8:08x}" for n in range(1000)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        db_manager.save_rules_bulk([(f"REGLA {i}: {text(i)}", 'general', 1.0) for i in range(args.rows)])
+        db_manager.save_memories_bulk([(user_ids[i % len(user_ids)], text(i)) for i in range(args.rows)])
+
+        for label, func in (
+            ("search_rules (k=5)", lambda q: db_manager.search_rules(q, k=5)),
+            ("search_user_memory (k=5)", lambda q: db_manager.search_user_memory(user_ids[7], q, k=5)),
+        ):
+            samples = []
+            start = time.perf_counter()
+            for i in range(args.calls):
+                call_start = time.perf_counter()
+                func(questions[i % len(questions)])
+                samples.append(time.perf_counter() - call_start)
+            _print_latencies(label, samples, time.perf_counter() - start)
+
+        db_manager.close()
+
+    print("\n" + "="*70)
+
+
+# ==================== BACKENDS ====================
+
+def bench_backends(args):
+    """
+    Ejecuta la misma carga (escrituras, lecturas de prompt y estadísticas)
+    sobre el backend SQLite en archivo y sobre el backend en memoria.
+    """
+    print("\n" + "="*70)
+    print("BENCHMARK: Backend SQLite vs backend en memoria")
+    print("="*70)
+    print(f"   Reglas/memorias: {args.rows} | Lecturas: {args.calls}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in ('sqlite', 'memory'):
+            storage = create_storage(kind, os.path.join(tmp, 'bench.db'))
+            print(f"\n   [{kind}]")
+
+            start = time.perf_counter()
+            _seed_database(storage, users=20, rules=args.rows // 2, memories_per_user=args.rows // 40)
+            elapsed = time.perf_counter() - start
+            print(f"      Carga inicial: {elapsed * 1000:8.1f} ms")
+
+            for label, func in (
+                ("get_all_rules + get_user_memory", lambda i: (
+                    storage.get_all_rules(), storage.get_user_memory(f"bench_{i % 20}"))),
+                ("save_user_memory", lambda i: storage.save_user_memory(f"bench_{i % 20}", "Pregunta por garantía")),
+                ("get_system_stats", lambda i: storage.get_system_stats()),
+            ):
+                samples = []
+                start = time.perf_counter()
+                for i in range(args.calls):
+                    call_start = time.perf_counter()
+                    func(i)
+                    samples.append(time.perf_counter() - call_start)
+                _print_latencies(label, samples, time.perf_counter() - start)
+
+            storage.close()
+
+    print("\n" + "="*70)
+
+
+def bench_instrumentation(args):
+    """
+    Mide el costo de la instrumentación de SQL: la misma carga con
+    KAVAK_DB_INSTRUMENT apagado y encendido, y el reporte resultante.
+    """
+    print("\n" + "="*70)
+    print("BENCHMARK: Costo de la instrumentación de SQL")
+    print("="*70)
+    print(f"   Reglas/memorias: {args.rows} | Llamadas: {args.calls}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for instrument in (False, True):
+            db_path = os.path.join(tmp, f"bench_{int(instrument)}.db")
+            db_manager = DatabaseManager(db_path, instrument=instrument)
+            _seed_database(db_manager, users=20, rules=args.rows // 2, memories_per_user=args.rows // 40)
+            if instrument:
+                db_manager.instrumentation.reset()
+            print(f"\n   [instrumentación {'encendida' if instrument else 'apagada'}]")
+
+            for label, func in (
+                ("get_user_memory", lambda i: db_manager.get_user_memory(f"bench_{i % 20}")),
+                ("save_user_memory", lambda i: db_manager.save_user_memory(f"bench_{i % 20}", "Pregunta por garantía")),
+                ("get_system_stats", lambda i: db_manager.get_system_stats()),
+            ):
+                samples = []
+                start = time.perf_counter()
+                for i in range(args.calls):
+                    call_start = time.perf_counter()
+                    func(i)
+                    samples.append(time.perf_counter() - call_start)
+                _print_latencies(label, samples, time.perf_counter() - start)
+
+            if instrument:
+                report = db_manager.get_instrumentation_report(top_statements=3)
+                print("\n   Reporte (método: llamadas, p50, p95, sentencias, filas)")
+                for name, method in report['methods'].items():
+                    print(f"      {name:<20} {method['calls']:>6} {method['p50_ms']:>7.2f} ms "
+                          f"{method['p95_ms']:>7.2f} ms {method['statements']:>7} {method['rows']:>8}")
+            db_manager.close()
+
+    print("\n" + "="*70)
+
+
+def bench_retention(args):
+    """
+    Latencia del chat (get_user_memory + save_user_memory) mientras se
+    eliminan memorias vencidas: un DELETE único vs el barrido por lotes
+    con incremental_vacuum en un hilo aparte.
+    """
+    print("\n" + "="*70)
+    print("BENCHMARK: Retención, DELETE único vs barrido incremental")
+    print("="*70)
+    print(f"   Memorias vencidas: {args.rows} | Llamadas del chat: {args.calls}")
+
+    policy = RetentionPolicy(memory_max_age_days=30)
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('DELETE único', 'barrido por lotes'):
+            db_path = os.path.join(tmp, f"bench_{len(mode)}.db")
+            db_manager = DatabaseManager(db_path, write_behind=True, retention=RetentionPolicy())
+            for u in range(100):
+                db_manager.create_user(f"bench_{u}", f"bench_{u}")
+            context = "Usuario busca SUV familiar con garantía y financiamiento " * 4
+            db_manager.save_memories_bulk([(f"bench_{i % 100}", context) for i in range(args.rows)])
+            db_manager.flush()
+            conn = sqlite3.connect(db_path)
+            conn.execute("UPDATE user_memory SET created_at = datetime('now', '-90 days')")
+            conn.commit()
+            conn.close()
+            db_manager.retention = policy
+
+            def sweep():
+                if mode == 'DELETE único':
+                    db_manager.sweep_expired(batch_size=args.rows)
+                    db_manager.incremental_vacuum()
+                else:
+                    RetentionSweeper(db_manager, batch_size=500, pause=0.005).run_once()
+
+            sweeper = threading.Thread(target=sweep)
+            samples = []
+            start = time.perf_counter()
+            sweeper.start()
+            i = 0
+            while sweeper.is_alive() or i < args.calls:
+                call_start = time.perf_counter()
+                db_manager.get_user_memory(f"bench_{i % 100}", limit=10)
+                db_manager.save_user_memory(f"bench_{i % 100}", "Pregunta por garantía")
+                samples.append(time.perf_counter() - call_start)
+                i += 1
+            sweeper.join()
+            sweep_elapsed = time.perf_counter() - start
+
+            print(f"\n   [{mode}] barrido: {sweep_elapsed * 1000:8.1f} ms, "
+                  f"memorias restantes: {db_manager.get_system_stats()['total_memories']}")
+            _print_latencies("Chat durante el barrido", samples, sweep_elapsed)
+            print(f"      máx:         {max(samples) * 1e6:8.1f} µs")
+            db_manager.close()
+
+    print("\n" + "="*70)
+
+
+def main():
+    """
+    Punto de entrada de los benchmarks.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks de DatabaseManager")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    connections = subparsers.add_parser('connections', help="Latencia por llamada con N sesiones")
+    connections.add_argument('--threads', type=int, default=8)
+    connections.add_argument('--calls', type=int, default=500)
+    connections.set_defaults(func=bench_connections)
+
+    stats = subparsers.add_parser('stats', help="get_system_stats según tamaño de tablas")
+    stats.add_argument('--rows', type=int, default=100000)
+    stats.add_argument('--calls', type=int, default=200)
+    stats.set_defaults(func=bench_stats)
+
+    bulk = subparsers.add_parser('bulk', help="Importación fila por fila vs en lote")
+    bulk.add_argument('--rows', type=int, default=1000)
+    bulk.set_defaults(func=bench_bulk)
+
+    contention = subparsers.add_parser('contention', help="N hilos escritores, directo vs write-behind")
+    contention.add_argument('--threads', type=int, default=16)
+    contention.add_argument('--writes', type=int, default=200)
+    contention.set_defaults(func=bench_contention)
+
+    search = subparsers.add_parser('search', help="Latencia de búsqueda FTS5")
+    search.add_argument('--rows', type=int, default=200000)
+    search.add_argument('--calls', type=int, default=200)
+    search.set_defaults(func=bench_search)
+
+    shards = subparsers.add_parser('shards', help="N hilos escritores, 1 BD vs fragmentos por usuario")
+    shards.add_argument('--threads', type=int, default=16)
+    shards.add_argument('--writes', type=int, default=200)
+    shards.add_argument('--shards', type=int, default=4)
+    shards.set_defaults(func=bench_shards)
+
+    snapshot = subparsers.add_parser('snapshot', help="Exportar/importar el estado aprendido")
+    snapshot.add_argument('--rows', type=int, default=1000000)
+    snapshot.set_defaults(func=bench_snapshot)
+
+    backends = subparsers.add_parser('backends', help="Misma carga en SQLite y en memoria")
+    backends.add_argument('--rows', type=int, default=2000)
+    backends.add_argument('--calls', type=int, default=500)
+    backends.set_defaults(func=bench_backends)
+
+    instrumentation = subparsers.add_parser('instrumentation', help="Costo de medir cada sentencia SQL")
+    instrumentation.add_argument('--rows', type=int, default=2000)
+    instrumentation.add_argument('--calls', type=int, default=500)
+    instrumentation.set_defaults(func=bench_instrumentation)
+
+    retention = subparsers.add_parser('retention', help="Latencia del chat durante el barrido de retención")
+    retention.add_argument('--rows', type=int, default=200000)
+    retention.add_argument('--calls', type=int, default=500)
+    retention.set_defaults(func=bench_retention)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Benchmark de la Base de Conocimiento con Recuperación
+Compara el prompt del agente de consola con TODA la información de Kavak
+(como el PROMPT_BASE monolítico) contra el prompt con solo las secciones
+recuperadas por BM25 para cada pregunta.
+
+Sin conexión mide, por pregunta: tokens del prompt, tiempo de armado
+(recuperación incluida) y cobertura, es decir, si el prompt contiene el
+dato que responde la pregunta. También mide la construcción del índice
+contra su carga desde disco.
+Con --llm envía ambos prompts a la API y compara latencia y tokens de
+entrada reportados por el proveedor.
+
+Uso:
+    python benchmark_knowledge.py
+    python benchmark_knowledge.py --k 2 3 4
+    python benchmark_knowledge.py --llm --k 3
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from backend.utils.knowledge_base import KNOWLEDGE_HEADER, KnowledgeBase
+from backend.utils.prompt_budget import TokenCounter
+from console_agent import PROMPT_BASE
+
+
+# Preguntas de evaluación con el dato de kavak.md que las responde
+LABELED_QUESTIONS: List[Tuple[str, str]] = [
+    ("¿Qué garantía tienen los autos?", "3 meses o 3,000 km"),
+    ("¿Qué cubre la garantía si falla el motor?", "Motor: bloque"),
+    ("¿Qué no cubre la garantía?", "Desgaste normal"),
+    ("¿Cómo hago válida la garantía?", "800-KAVAK-01"),
+    ("¿Cuánto cuesta un Mazda 3?", "$120,000 - $800,000 MXN"),
+    ("¿Qué marcas de autos tienen?", "Marcas: Nissan"),
+    ("¿Puedo devolver el auto si no me gusta?", "7 días devolución"),
+    ("¿Hacen entregas a domicilio?", "Entrega a domicilio sin costo"),
+    ("¿Cuánto cuesta apartar un auto?", "Apartado con $5,000 MXN"),
+    ("¿Qué requisitos piden para el financiamiento?", "Ingresos mínimos"),
+    ("¿Qué tasa de interés manejan?", "Tasa anual: 12.9% - 24.9%"),
+    ("¿Cuánto es el enganche mínimo?", "Enganche desde: 10%"),
+    ("¿Cuánto tarda la aprobación del crédito?", "Análisis: 24-48 horas"),
+    ("¿Cómo vendo mi auto en Kavak?", "Cotización online"),
+    ("¿Compran autos con adeudos?", "NO aceptamos"),
+    ("¿En cuánto tiempo me pagan si vendo mi auto?", "Transferencia SPEI: 24-48 hrs"),
+    ("¿Qué revisan en la inspección de 240 puntos?", "Motor (40 puntos)"),
+    ("¿Cuánto dura la inspección?", "Duración: 2-3 horas"),
+    ("¿En cuántos países está Kavak?", "Presencia en 7 países"),
+    ("¿Qué trámites incluye la compra?", "Trámites incluidos"),
+]
+
+
+def build_prompt(knowledge_base: KnowledgeBase, query: str) -> str:
+    """Prompt del agente de consola (sin reglas ni memoria) para una pregunta."""
+    knowledge = knowledge_base.render(knowledge_base.retrieve(query))
+    if not knowledge:
+        return PROMPT_BASE
+    return f"{PROMPT_BASE}\n\n{KNOWLEDGE_HEADER}\n" + "\n\n".join(knowledge)
+
+
+def evaluate_offline(k_values: List[int], repeats: int = 200) -> List[Dict]:
+    """
+    Tokens, tiempo de armado y cobertura para cada k (0 = todo el conocimiento).
+
+    Args:
+        k_values: Secciones por pregunta a evaluar
+        repeats: Repeticiones para medir el tiempo de armado
+
+    Returns:
+        List[Dict]: Por k: avg_tokens, build_us (mediana), coverage, sections y misses
+    """
+    counter = TokenCounter()
+    results = []
+    for k in k_values:
+        knowledge_base = KnowledgeBase(index_path='', top_k=k).load()
+        tokens, timings, sections, misses = [], [], [], []
+        for question, fact in LABELED_QUESTIONS:
+            prompt = build_prompt(knowledge_base, question)
+            tokens.append(counter.count(prompt))
+            sections.append(len(knowledge_base.last_section_ids))
+            if fact not in prompt:
+                misses.append(question)
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                build_prompt(knowledge_base, question)
+            timings.append((time.perf_counter() - start) / repeats)
+
+        results.append({
+            'k': k,
+            'avg_tokens': statistics.mean(tokens),
+            'build_us': statistics.median(timings) * 1e6,
+            'coverage': 1 - len(misses) / len(LABELED_QUESTIONS),
+            'sections': statistics.mean(sections),
+            'misses': misses,
+        })
+    return results
+
+
+def measure_index_load(repeats: int = 20) -> Dict:
+    """
+    Construcción del índice desde el fuente contra su carga desde disco.
+
+    Returns:
+        Dict: build_ms y load_ms (medianas) y tamaño del archivo en KB
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'index.json')
+        build, load = [], []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            KnowledgeBase(index_path=path).build()
+            build.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            knowledge_base = KnowledgeBase(index_path=path).load()
+            load.append(time.perf_counter() - start)
+            assert knowledge_base.loaded_from == 'disk'
+        size_kb = os.path.getsize(path) / 1024
+    return {'build_ms': statistics.median(build) * 1000, 'load_ms': statistics.median(load) * 1000,
+            'size_kb': size_kb}
+
+
+def evaluate_with_llm(k: int) -> Dict[str, Dict]:
+    """
+    Envía cada pregunta con todo el conocimiento y con las k secciones
+    recuperadas, y mide latencia y tokens de entrada del proveedor.
+
+    Args:
+        k: Secciones por pregunta en la variante con recuperación
+
+    Returns:
+        Dict[str, Dict]: Por variante: p50_ms, avg_ms e input_tokens (promedio)
+    """
+    from backend.utils.llm_config import LLMConfig
+
+    llm = LLMConfig.create_default().get_llm()
+    results = {}
+    for label, top_k in (('completo', 0), (f'top-{k}', k)):
+        knowledge_base = KnowledgeBase(index_path='', top_k=top_k).load()
+        latencies, input_tokens = [], []
+        for question, _ in LABELED_QUESTIONS:
+            messages = [SystemMessage(content=build_prompt(knowledge_base, question)),
+                        HumanMessage(content=question)]
+            start = time.perf_counter()
+            response = llm.invoke(messages)
+            latencies.append(time.perf_counter() - start)
+            input_tokens.append((getattr(response, 'usage_metadata', None) or {}).get('input_tokens', 0))
+        results[label] = {
+            'p50_ms': statistics.median(latencies) * 1000,
+            'avg_ms': statistics.mean(latencies) * 1000,
+            'input_tokens': statistics.mean(input_tokens),
+        }
+    return results
+
+
+def main():
+    """
+    Ejecuta el benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Prompt completo vs secciones recuperadas de la base de conocimiento")
+    parser.add_argument('--k', type=int, nargs='+', default=[2, 3],
+                        help="Secciones por pregunta a comparar contra todo el conocimiento")
+    parser.add_argument('--llm', action='store_true',
+                        help="Medir también latencia y tokens reales con el LLM (usa la API)")
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("BENCHMARK: Conocimiento completo vs secciones recuperadas (BM25)")
+    print("="*70)
+    print(f"   Preguntas: {len(LABELED_QUESTIONS)} | "
+          f"Secciones en la base: {len(KnowledgeBase(index_path='').sections)} | "
+          f"Tokenizador {'exacto' if TokenCounter().exact else 'aproximado'}")
+
+    results = evaluate_offline([0] + args.k)
+    baseline = results[0]['avg_tokens']
+    print(f"\n   {'k':>8}{'Secciones':>11}{'Tokens prompt':>15}{'Reducción':>11}"
+          f"{'Armado':>10}{'Cobertura':>11}")
+    print("   " + "─"*66)
+    for row in results:
+        reduction = (1 - row['avg_tokens'] / baseline) * 100
+        print(f"   {row['k'] or 'completo':>8}{row['sections']:>11.1f}{row['avg_tokens']:>15.0f}"
+              f"{reduction:>10.1f}%{row['build_us']:>8.0f}µs{row['coverage'] * 100:>10.1f}%")
+    for row in results:
+        for question in row['misses']:
+            print(f"   k={row['k']}: sin el dato para \"{question}\"")
+
+    index = measure_index_load()
+    print(f"\n   Índice: construir {index['build_ms']:.2f} ms | cargar de disco {index['load_ms']:.2f} ms | "
+          f"{index['size_kb']:.1f} KB")
+
+    if args.llm:
+        k = args.k[-1]
+        print(f"\n   Llamadas al LLM (completo vs top-{k})...")
+        for label, row in evaluate_with_llm(k).items():
+            print(f"   {label:>9}: p50 {row['p50_ms']:.0f} ms | promedio {row['avg_ms']:.0f} ms | "
+                  f"tokens de entrada {row['input_tokens']:.0f}")
+
+    print("\n   Cobertura: preguntas cuyo prompt contiene el dato que las responde")
+    print("\n" + "="*70)
+
+
+if __name__ == "__main__":
+    main()
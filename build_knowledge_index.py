@@ -0,0 +1,46 @@
+"""
+Script de construcción del índice de la base de conocimiento
+Divide backend/knowledge/kavak.md en secciones, construye el índice BM25
+y lo guarda en disco para que los agentes lo carguen al iniciar.
+"""
+
+import argparse
+
+from backend.utils.knowledge_base import KnowledgeBase
+
+
+def main():
+    """
+    Construye el índice y lo prueba con una pregunta opcional.
+    """
+    parser = argparse.ArgumentParser(description="Construye el índice de la base de conocimiento")
+    parser.add_argument('--source', default=None,
+                        help="Archivo fuente (por defecto KAVAK_KNOWLEDGE_PATH o backend/knowledge/kavak.md)")
+    parser.add_argument('--index', default=None,
+                        help="Archivo del índice (por defecto KAVAK_KNOWLEDGE_INDEX o kavak_knowledge_index.json)")
+    parser.add_argument('--query', default=None,
+                        help="Pregunta de prueba: muestra las secciones que se recuperarían")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("CONSTRUCCIÓN DEL ÍNDICE DE CONOCIMIENTO")
+    print("="*60)
+
+    knowledge_base = KnowledgeBase(source_path=args.source, index_path=args.index)
+    report = knowledge_base.build()
+
+    print(f"\n   Fuente: {knowledge_base.source_path}")
+    print(f"   Secciones: {report['sections']} | Términos: {report['terms']}")
+    print(f"   Índice: {report['index_path'] or '(solo en memoria)'}")
+    print(f"   Tiempo: {report['elapsed_seconds'] * 1000:.1f} ms")
+
+    if args.query:
+        print(f"\n   Pregunta: {args.query}")
+        for section in knowledge_base.retrieve(args.query):
+            print(f"      - {section['title']}")
+
+    print("\n✅ Índice construido")
+
+
+if __name__ == "__main__":
+    main()
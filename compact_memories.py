@@ -0,0 +1,55 @@
+"""
+Script de compactación de memorias de usuarios
+Consolida las memorias antiguas de los usuarios que superan el límite
+usando el Agente Resumidor, y reporta el throughput del proceso.
+"""
+
+import argparse
+
+from backend.utils.llm_config import LLMConfig
+from backend.utils.storage import create_storage
+from backend.utils.memory_compaction import MemoryCompactor
+from backend.agents.summarizer_agent import SummarizerAgent
+
+
+def main():
+    """
+    Ejecuta la compactación en lote.
+    """
+    parser = argparse.ArgumentParser(description="Compacta las memorias de usuarios")
+    parser.add_argument('--max-memories', type=int, default=20,
+                        help="Compactar usuarios con más de N memorias")
+    parser.add_argument('--keep-recent', type=int, default=5,
+                        help="Memorias recientes que se conservan intactas")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Solo listar los usuarios que se compactarían")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("COMPACTACIÓN DE MEMORIAS DE USUARIOS")
+    print("="*60)
+
+    db_manager = create_storage()
+
+    if args.dry_run:
+        candidates = db_manager.get_users_over_memory_limit(args.max_memories)
+        print(f"\nUsuarios con más de {args.max_memories} memorias: {len(candidates)}")
+        for user_id, total in candidates:
+            print(f"   - {user_id}: {total} memorias")
+        return
+
+    llm = LLMConfig.create_default().get_llm()
+    compactor = MemoryCompactor(
+        db_manager,
+        SummarizerAgent(llm),
+        max_memories=args.max_memories,
+        keep_recent=args.keep_recent
+    )
+    compactor.run_batch()
+
+    print("\n✅ Compactación completada")
+    print("   Los originales quedan en la tabla user_memory_archive")
+
+
+if __name__ == "__main__":
+    main()
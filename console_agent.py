@@ -1,10 +1,12 @@
 import os
-import sqlite3
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
 import httpx
 
+from backend.utils.knowledge_base import KNOWLEDGE_HEADER, KnowledgeBase
+from backend.utils.storage import create_storage
+
 
 # Configuración inicial
 load_dotenv()
@@ -16,10 +18,53 @@ os.environ.pop('http_proxy', None)
 os.environ.pop('https_proxy', None)
 
 
+# Instrucciones base: la información de Kavak está en la base de conocimiento
+# (backend/knowledge/kavak.md) y se inyecta por secciones según la pregunta
+PROMPT_BASE = """Eres un asistente virtual experto de Kavak, la plataforma líder de compra y venta de autos seminuevos en Latinoamérica.
+
+SIEMPRE proporciona información ESPECÍFICA, DETALLADA y con DATOS CONCRETOS. Nunca des respuestas vagas o genéricas.
+
+Temas que cubres: compra de autos, venta de autos, financiamiento, garantía mecánica e inspección de 240 puntos.
+
+INSTRUCCIONES CRÍTICAS:
+- SIEMPRE menciona números, plazos, montos específicos
+- NUNCA digas solo "tenemos garantías" - especifica 3 meses/3,000 km
+- NUNCA digas "varios modelos" - menciona marcas y modelos concretos
+- Si preguntan por precio, da rangos reales ($120k-$800k MXN)
+- Si preguntan por financiamiento, menciona tasas (12.9%-24.9%)
+- Sé amigable pero SIEMPRE con datos concretos
+- Si no sabes algo MUY específico, ofrece conectar con asesor"""
+
+
 # Funciones de Base de Datos (Lectura)
-def get_db_connection():
-    """Helper para obtener conexión a la base de datos"""
-    return sqlite3.connect('kavak_memory.db')
+_db_manager = None
+
+
+def get_db_manager():
+    """
+    Helper para obtener el backend de almacenamiento compartido
+    (SQLite por defecto, o el indicado en KAVAK_STORAGE).
+    Al crearse aplica las migraciones pendientes del esquema.
+    """
+    global _db_manager
+    if _db_manager is None:
+        _db_manager = create_storage(db_path='kavak_memory.db')
+    return _db_manager
+
+
+_knowledge_base = None
+
+
+def get_knowledge_base():
+    """
+    Helper para obtener la base de conocimiento de Kavak. Al crearse
+    carga el índice BM25 de disco (o lo construye si el archivo fuente
+    cambió).
+    """
+    global _knowledge_base
+    if _knowledge_base is None:
+        _knowledge_base = KnowledgeBase().load()
+    return _knowledge_base
 
 
 def get_all_rules():
@@ -27,18 +72,7 @@ def get_all_rules():
     Obtiene todas las reglas de la tabla prompt_rules.
     Retorna un string con todas las reglas unidas por saltos de línea.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT rule_text FROM prompt_rules')
-    results = cursor.fetchall()
-    
-    conn.close()
-    
-    if results:
-        # Unir todas las reglas con saltos de línea
-        return '\n'.join([row[0] for row in results])
-    return ''
+    return get_db_manager().get_all_rules()
 
 
 def get_user_memory(user_id):
@@ -46,22 +80,7 @@ def get_user_memory(user_id):
     Obtiene TODA la memoria histórica del usuario (todas las conversaciones previas).
     Retorna un string formateado con todos los contextos acumulados.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'SELECT context FROM user_memory WHERE user_id = ? ORDER BY id ASC',
-        (user_id,)
-    )
-    results = cursor.fetchall()
-    
-    conn.close()
-    
-    if results:
-        # Combinar todas las memorias en un solo contexto
-        all_memories = '\n'.join([f"- {row[0]}" for row in results])
-        return f"HISTORIAL DE MEMORIA DEL USUARIO:\n{all_memories}"
-    return ''
+    return get_db_manager().get_user_memory(user_id)
 
 
 def save_user_memory(user_id, chat_history_list, llm_instance):
@@ -79,16 +98,7 @@ def save_user_memory(user_id, chat_history_list, llm_instance):
     summary_text = response.content
     
     # Guardar en la base de datos
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'INSERT INTO user_memory (user_id, context) VALUES (?, ?)',
-        (user_id, summary_text)
-    )
-    
-    conn.commit()
-    conn.close()
+    get_db_manager().save_user_memory(user_id, summary_text)
     
     print("\n[Sistema: ✓ Memoria guardada exitosamente. Esta información se recordará en futuras conversaciones.]")
 
@@ -215,16 +225,7 @@ Genera la nueva REGLA:"""
     
     # PASO 4: Guardar solo si la validación es positiva
     if validation_score >= 0.5:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'INSERT INTO prompt_rules (rule_text, error_category, validation_score) VALUES (?, ?, ?)',
-            (new_rule_text, error_category, validation_score)
-        )
-        
-        conn.commit()
-        conn.close()
+        get_db_manager().save_rule(new_rule_text, error_category, validation_score)
         
         print(f"\n[Sistema: ✓ Regla validada (score: {validation_score:.1f}) y guardada. Categoría: {error_category}]")
     else:
@@ -322,10 +323,8 @@ def auto_learn_from_conversation(chat_history, user_id, llm_instance):
         '800-KAVAK', 'SPEI', '24-48 horas', '5 minutos'
     ]
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    learned_something = False
+    db_manager = get_db_manager()
+    new_rules = []
     
     for interaction in interactions:
         keyword_count = sum(1 for kw in keywords_especificos if kw.lower() in interaction['answer'].lower())
@@ -345,27 +344,26 @@ Ejemplo: 'REGLA: Si preguntan por garantías, siempre mencionar 3 meses/3,000 km
                 response = llm_instance.invoke([HumanMessage(content=learning_prompt)])
                 new_rule = response.content.strip()
                 
-                # Verificar que no sea una regla duplicada
-                cursor.execute('SELECT COUNT(*) FROM prompt_rules WHERE rule_text = ?', (new_rule,))
-                if cursor.fetchone()[0] == 0:
-                    cursor.execute('INSERT INTO prompt_rules (rule_text) VALUES (?)', (new_rule,))
-                    learned_something = True
+                # Verificar que no sea una regla duplicada (búsqueda por hash indexado)
+                if not db_manager.rule_exists(new_rule):
+                    new_rules.append((new_rule, 'general', 0.0))
             except:
                 pass  # Si falla, continuar sin romper el flujo
     
+    # Guardar todas las reglas nuevas en una sola transacción
+    db_manager.save_rules_bulk(new_rules)
+    learned_something = bool(new_rules)
+    
     # Guardar memoria del usuario automáticamente
     if interactions:
         memory_prompt = f"Resume en UNA frase el interés principal del usuario basado en estas preguntas: {', '.join([i['question'] for i in interactions[:3]])}"
         try:
             response = llm_instance.invoke([HumanMessage(content=memory_prompt)])
             summary = response.content.strip()
-            cursor.execute('INSERT INTO user_memory (user_id, context) VALUES (?, ?)', (user_id, summary))
+            db_manager.save_user_memory(user_id, summary)
         except:
             pass
     
-    conn.commit()
-    conn.close()
-    
     if learned_something:
         print("\n[Sistema: El bot aprendió automáticamente de esta conversación]")
 
@@ -373,43 +371,14 @@ Ejemplo: 'REGLA: Si preguntan por garantías, siempre mencionar 3 meses/3,000 km
 def get_system_evolution_metrics():
     """
     Calcula métricas de evolución del sistema a lo largo del tiempo.
+    total_users cuenta los usuarios con memorias (los que han contribuido);
+    registered_users, los registrados en la tabla users.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Contar reglas aprendidas
-    cursor.execute('SELECT COUNT(*) FROM prompt_rules')
-    total_rules = cursor.fetchone()[0]
-    
-    # Contar memorias de usuarios
-    cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_memory')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM user_memory')
-    total_memories = cursor.fetchone()[0]
-    
-    # Análisis de errores por categoría
-    cursor.execute('''
-        SELECT error_category, COUNT(*) as count 
-        FROM prompt_rules 
-        WHERE error_category IS NOT NULL
-        GROUP BY error_category
-    ''')
-    error_distribution = dict(cursor.fetchall())
-    
-    # Score promedio de validación
-    cursor.execute('SELECT AVG(validation_score) FROM prompt_rules WHERE validation_score > 0')
-    avg_validation = cursor.fetchone()[0] or 0.0
-    
-    conn.close()
-    
-    return {
-        'total_rules': total_rules,
-        'total_users': total_users,
-        'total_memories': total_memories,
-        'error_distribution': error_distribution,
-        'avg_validation_score': avg_validation
-    }
+    db_manager = get_db_manager()
+    stats = db_manager.get_system_stats()
+    stats['registered_users'] = stats['total_users']
+    stats['total_users'] = db_manager.count_users_with_memories()
+    return stats
 
 
 def display_metrics(metrics):
@@ -518,146 +487,28 @@ def display_metrics(metrics):
     print("="*70 + "\n")
 
 
-def build_system_prompt(user_id):
+def build_system_prompt(user_id, query=None, include_rules=True):
     """
     Construye el prompt del sistema combinando:
     - PROMPT_BASE (instrucciones base)
-    - Reglas de la BD
+    - Secciones de la base de conocimiento relevantes a la pregunta
+      (todas si no hay pregunta, p. ej. el primer prompt o la evaluación)
+    - Reglas de la BD (se omiten con include_rules=False, p. ej. el
+      baseline de la evaluación, sin tocar la BD)
     - Memoria del usuario
     """
-    PROMPT_BASE = """Eres un asistente virtual experto de Kavak, la plataforma líder de compra y venta de autos seminuevos en Latinoamérica.
-
-SIEMPRE proporciona información ESPECÍFICA, DETALLADA y con DATOS CONCRETOS. Nunca des respuestas vagas o genéricas.
-
-INFORMACIÓN CORPORATIVA:
-- Fundada en 2016 en México
-- Presencia en 7 países: México, Argentina, Chile, Brasil, Colombia, Perú y Turquía
-- Más de 20 centros de distribución (Hubs)
-- Inventario de +10,000 autos disponibles
-- +300,000 autos vendidos desde fundación
-
-1. COMPRA DE AUTOS - DATOS ESPECÍFICOS:
-
-INVENTARIO:
-- Marcas: Nissan, VW, Chevrolet, Toyota, Honda, Mazda, Ford, Hyundai, KIA, Seat
-- Modelos populares: Versa, Jetta, Aveo, Vento, Sentra, March, Corolla, Civic, Mazda 3
-- Precios: $120,000 - $800,000 MXN
-- Años: 2015-2022 típicamente
-- Kilometraje: 30,000 - 120,000 km
-
-PROCESO (7 PASOS):
-1. Búsqueda online con filtros
-2. Agenda prueba de manejo (sin compromiso)
-3. Revisión del auto (inspección 240 puntos)
-4. Simulación de crédito (respuesta en 5 min)
-5. Apartado con $5,000 MXN (reembolsable en 7 días)
-6. Firma de contrato (digital o presencial)
-7. Entrega mismo día o a domicilio (gratis)
-
-BENEFICIOS:
-- Garantía mecánica: 3 meses o 3,000 km
-- Garantía de satisfacción: 7 días devolución sin preguntas
-- Entrega a domicilio sin costo
-- Trámites incluidos: placas, tenencia, verificación
-- Seguro incluido primer mes (cobertura amplia)
-
-2. VENTA DE AUTOS - PROCESO DETALLADO:
-
-PASOS (6 ETAPAS):
-1. Cotización online (2 minutos): marca, modelo, año, km
-2. Valuación inicial: rango de precio inmediato
-3. Inspección física en Hub (30-45 min)
-4. Oferta final al terminar inspección
-5. Pago en 24-48 horas si aceptas
-6. Kavak hace todos los trámites
-
-CRITERIOS:
-- Años: 2010 en adelante generalmente
-- Kilometraje máximo: 200,000 km
-- Documentos: factura, tarjeta circulación, verificaciones
-- NO aceptamos: adeudos, robados, daños estructurales graves
-
-PAGO:
-- Transferencia SPEI: 24-48 hrs
-- Cheque certificado: mismo día
-- Efectivo: solo hasta $100,000 MXN
-
-3. FINANCIAMIENTO - INFORMACIÓN PRECISA:
-
-OPCIONES:
-- Enganche desde: 10% del valor
-- Plazos: 12, 24, 36, 48, 60 meses
-- Tasa anual: 12.9% - 24.9% (según perfil)
-- Monto máximo: $600,000 MXN
-- Comisión apertura: 3% del monto
-
-REQUISITOS:
-- Edad: 18-70 años
-- Ingresos mínimos: $8,000 MXN/mes comprobables
-- Antigüedad laboral: 6 meses mínimo
-- Score buró: mínimo 550
-- Docs: INE, comprobante domicilio, 3 últimos recibos
-
-APROBACIÓN:
-- Pre-aprobación: 5 minutos online
-- Análisis: 24-48 horas
-- Alianzas: Santander, BBVA, Scotiabank, Crédito Kavak
-
-4. GARANTÍA MECÁNICA (3 MESES/3,000 KM):
-
-CUBRE:
-- Motor: bloque, cigüeñal, pistones, bielas, válvulas
-- Transmisión: caja completa (manual/automática)
-- Sistema eléctrico: alternador, marcha, computadora
-- Dirección: caja, bomba hidráulica
-- Suspensión: amortiguadores, brazos
-- Frenos: bomba, booster
-
-NO CUBRE:
-- Desgaste normal: balatas, llantas, filtros
-- Daños por mal uso o accidentes
-- Mantenimiento preventivo
-
-CÓMO USAR GARANTÍA:
-1. Llama al 800-KAVAK-01
-2. Describe el problema
-3. Agenda cita en taller autorizado
-4. Kavak cubre reparación si aplica
-
-5. INSPECCIÓN 240 PUNTOS:
-
-CATEGORÍAS:
-- Motor (40 puntos): compresión, fugas, ruidos
-- Transmisión (25 puntos): cambios, sincronización
-- Frenos (20 puntos): discos, balatas, líquido
-- Suspensión (25 puntos): amortiguadores, rótulas
-- Eléctrico (30 puntos): batería, luces, sensores
-- Carrocería (40 puntos): pintura, abolladuras, óxido
-- Interior (30 puntos): asientos, tablero, clima
-- Documentación (30 puntos): factura, adeudos, historial
-
-PROCESO:
-- Duración: 2-3 horas por auto
-- Mecánicos certificados
-- Reporte digital disponible para cada auto
-- Solo pasan autos en buen estado (70% rechazados)
-
-INSTRUCCIONES CRÍTICAS:
-- SIEMPRE menciona números, plazos, montos específicos
-- NUNCA digas solo "tenemos garantías" - especifica 3 meses/3,000 km
-- NUNCA digas "varios modelos" - menciona marcas y modelos concretos
-- Si preguntan por precio, da rangos reales ($120k-$800k MXN)
-- Si preguntan por financiamiento, menciona tasas (12.9%-24.9%)
-- Sé amigable pero SIEMPRE con datos concretos
-- Si no sabes algo MUY específico, ofrece conectar con asesor"""
-
-    # Obtener reglas y memoria
-    rules = get_all_rules()
+    # Obtener conocimiento relevante, reglas y memoria
+    knowledge_base = get_knowledge_base()
+    knowledge = knowledge_base.render(knowledge_base.retrieve(query, k=None if query else 0))
+    rules = get_all_rules() if include_rules else ''
     memory = get_user_memory(user_id)
     
     # Combinar todo en el prompt final
     final_prompt = PROMPT_BASE
     
+    if knowledge:
+        final_prompt += f"\n\n{KNOWLEDGE_HEADER}\n" + "\n\n".join(knowledge)
+    
     if rules:
         final_prompt += f"\n\nREGLAS ADICIONALES:\n{rules}"
     
@@ -698,7 +549,8 @@ def main():
         http_async_client=async_client
     )
     
-    # Construir el prompt del sistema
+    # Cargar la base de conocimiento y construir el prompt del sistema
+    get_knowledge_base()
     system_prompt = build_system_prompt(user_id)
     
     # Inicializar historial de chat
@@ -740,6 +592,9 @@ def main():
         # Añadir mensaje del usuario al historial
         chat_history.append(HumanMessage(content=user_input))
         
+        # Inyectar solo las secciones de conocimiento relevantes a esta pregunta
+        chat_history[0] = SystemMessage(content=build_system_prompt(user_id, user_input))
+        
         # Mostrar mensaje de espera
         print("\n🤖 Kavak pensando...")
         
@@ -764,7 +619,7 @@ def main():
                 optimize_prompt_rule(chat_history, llm)
                 # Reconstruir el prompt con la nueva regla para mejorar en esta misma conversación
                 print("\n[Sistema: Aplicando mejora al asistente...]")
-                system_prompt = build_system_prompt(user_id)
+                system_prompt = build_system_prompt(user_id, user_input)
                 # Actualizar el system message en el historial
                 chat_history[0] = SystemMessage(content=system_prompt)
                 print("[Sistema: ✓ Asistente mejorado. Continuemos...]")
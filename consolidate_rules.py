@@ -0,0 +1,42 @@
+"""
+Script de consolidación de reglas casi duplicadas
+Fusiona las reglas que dicen lo mismo con otras palabras en una regla
+canónica y reporta los tokens de prompt que se ahorran.
+"""
+
+import argparse
+
+from backend.utils.storage import create_storage
+from backend.utils.rule_consolidation import RuleConsolidator
+
+
+def main():
+    """
+    Ejecuta la consolidación en lote.
+    """
+    parser = argparse.ArgumentParser(description="Consolida las reglas casi duplicadas")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="Similitud de Jaccard mínima (por defecto KAVAK_RULE_DEDUP_THRESHOLD o 0.5)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Solo listar los grupos que se fusionarían")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("CONSOLIDACIÓN DE REGLAS CASI DUPLICADAS")
+    print("="*60)
+
+    db_manager = create_storage()
+    consolidator = RuleConsolidator(db_manager, threshold=args.threshold)
+    report = consolidator.run_batch(dry_run=args.dry_run)
+
+    if args.dry_run:
+        print("\n   (simulación: la BD no se modificó)")
+        return
+
+    print("\n✅ Consolidación completada")
+    if report['rules_merged']:
+        print("   Las reglas absorbidas quedan en la tabla prompt_rules_archive")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import sqlite3
+from backend.utils.database import DatabaseManager
 
 
 def setup_database():
@@ -6,36 +6,12 @@ def setup_database():
     Crea el archivo kavak_memory.db y las tablas necesarias.
     Este script debe ejecutarse antes de usar console_agent.py
     """
-    # Conectar a la base de datos (se crea si no existe)
-    conn = sqlite3.connect('kavak_memory.db')
-    cursor = conn.cursor()
-    
-    # Crear tabla user_memory
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_memory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            context TEXT NOT NULL
-        )
-    ''')
-    
-    # Crear tabla prompt_rules con categorización de errores
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS prompt_rules (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            rule_text TEXT NOT NULL,
-            error_category TEXT DEFAULT 'general',
-            validation_score REAL DEFAULT 0.0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Guardar cambios y cerrar conexión
-    conn.commit()
-    conn.close()
+    # El gestor crea las tablas y aplica las migraciones del esquema
+    with DatabaseManager('kavak_memory.db') as db_manager:
+        version = db_manager.get_schema_version()
     
     print("✅ Base de datos 'kavak_memory.db' configurada correctamente.")
-    print("   Tablas creadas: 'user_memory' y 'prompt_rules'")
+    print(f"   Tablas creadas: 'users', 'user_memory' y 'prompt_rules' (esquema v{version})")
 
 
 if __name__ == "__main__":
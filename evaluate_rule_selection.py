@@ -0,0 +1,262 @@
+"""
+Evaluación de la Selección de Reglas por Relevancia
+Compara el prompt con TODAS las reglas contra el prompt con solo las
+top-k reglas relevantes a la pregunta (BM25 local en MainAgent).
+
+Sin conexión mide, sobre un conjunto de reglas etiquetadas por tema:
+tamaño del prompt, cobertura de las reglas relevantes (recall@k) y
+precisión, con y sin el enrutamiento por tema (TopicRouter). El
+enrutamiento se mide dos veces: con la categoría de cada regla como tema
+y con las categorías ocultas, como en la BD real (el clasificador asigna
+el tema a partir del texto).
+Con --llm genera además las respuestas con ambos prompts y compara la
+tasa de resolución y la densidad de datos específicos (MetricsCalculator).
+
+Uso:
+    python evaluate_rule_selection.py
+    python evaluate_rule_selection.py --k 3 5 8 12
+    python evaluate_rule_selection.py --no-route
+    python evaluate_rule_selection.py --db kavak_memory.db
+    python evaluate_rule_selection.py --llm --k 8
+"""
+
+import argparse
+from typing import Dict, List, Tuple
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from backend.agents.main_agent import MainAgent
+from backend.utils.metrics import MetricsCalculator
+from backend.utils.topic_router import TopicRouter
+
+
+# Reglas de ejemplo (tema, texto), como las que genera el Agente Optimizador
+LABELED_RULES: List[Tuple[str, str]] = [
+    ('garantia', "Al hablar de garantía, mencionar siempre que es de 3 meses o 3,000 km, lo que ocurra primero."),
+    ('garantia', "Si preguntan qué cubre la garantía, explicar que incluye motor, transmisión y sistema eléctrico."),
+    ('garantia', "Ofrecer la garantía extendida de hasta 12 meses cuando el usuario pregunte por la garantía."),
+    ('garantia', "Indicar que la garantía se hace válida en cualquier Hub Kavak con cita previa."),
+    ('devolucion', "Ante dudas de devolución, aclarar que hay 7 días o 300 km para devolver el auto."),
+    ('devolucion', "Explicar que la devolución reembolsa el 100% del pago si el auto está en las mismas condiciones."),
+    ('devolucion', "Si al usuario no le gusta el auto después de comprarlo, ofrecer primero el cambio por otro auto."),
+    ('financiamiento', "En financiamiento, dar la tasa desde 12.9% anual y hasta 24.9% según el perfil."),
+    ('financiamiento', "Mencionar que el enganche mínimo del crédito es del 10% del precio del auto."),
+    ('financiamiento', "Los plazos de financiamiento van de 12 a 72 meses; preguntar cuál prefiere el usuario."),
+    ('financiamiento', "Sobre requisitos de crédito: INE vigente, comprobante de domicilio e ingresos de 3 meses."),
+    ('financiamiento', "Aclarar que la aprobación del crédito tarda de 24-48 horas y la precalificación 5 minutos."),
+    ('precios', "Cuando pregunten precios, dar rangos concretos: Versa desde $180,000 MXN y Jetta desde $280,000 MXN."),
+    ('precios', "Explicar que el precio publicado es final, sin comisiones ocultas."),
+    ('precios', "Si el usuario pregunta cuánto cuesta un modelo, pedir año y versión para dar un precio exacto."),
+    ('inventario', "Mencionar que hay más de 5,000 autos en inventario, incluidos Toyota, Mazda, Honda y Nissan."),
+    ('inventario', "Si preguntan por autos híbridos o eléctricos, indicar que hay Prius y RAV4 híbridos disponibles."),
+    ('inventario', "Los autos tienen como máximo 150,000 km de kilometraje y 10 años de antigüedad."),
+    ('inspeccion', "Explicar que cada auto pasa una inspección de 240 puntos antes de publicarse."),
+    ('inspeccion', "La inspección de 240 puntos revisa motor, frenos, suspensión, carrocería e interiores."),
+    ('venta', "Para vender un auto, ofrecer la cotización en línea en 5 minutos con placas y kilometraje."),
+    ('venta', "Al vender su auto, el usuario recibe el pago por SPEI en 24-48 horas tras la inspección."),
+    ('venta', "Explicar que Kavak compra autos de 2010 en adelante con menos de 150,000 km."),
+    ('pagos', "Las formas de pago aceptadas son transferencia SPEI, tarjeta y financiamiento Kavak."),
+    ('pagos', "Aclarar que no se aceptan pagos en efectivo por seguridad."),
+    ('entrega', "Ofrecer entrega a domicilio sin costo en la zona metropolitana en 2-3 días."),
+    ('entrega', "Para recoger el auto en un Hub, agendar cita en la app o al 800-KAVAK."),
+    ('documentos', "Para comprar se necesita INE, comprobante de domicilio y RFC si se factura."),
+    ('documentos', "Los trámites de cambio de propietario y placas los realiza Kavak sin costo adicional."),
+    ('apartado', "El apartado del auto cuesta $5,000 MXN reembolsables y lo reserva por 72 horas."),
+    ('general', "Responder siempre con datos concretos: cifras, plazos y montos."),
+    ('general', "Terminar cada respuesta con una pregunta para entender mejor la necesidad del usuario."),
+]
+
+# Preguntas de evaluación con el tema de las reglas que deberían aplicarse
+LABELED_QUESTIONS: List[Tuple[str, str]] = [
+    ("¿Qué garantías tienen los autos?", 'garantia'),
+    ("¿Qué cubre la garantía si falla el motor?", 'garantia'),
+    ("¿Cuánto cuesta un Jetta?", 'precios'),
+    ("¿Qué modelos de Toyota tienen disponibles?", 'inventario'),
+    ("¿Cuáles son los requisitos para financiamiento?", 'financiamiento'),
+    ("¿Qué tasa de interés tiene el crédito?", 'financiamiento'),
+    ("¿Cuánto tiempo tarda la aprobación del crédito?", 'financiamiento'),
+    ("¿Qué cubre la inspección de 240 puntos?", 'inspeccion'),
+    ("¿Puedo vender mi auto en Kavak?", 'venta'),
+    ("¿En cuánto tiempo me pagan si vendo mi auto?", 'venta'),
+    ("¿Qué formas de pago aceptan?", 'pagos'),
+    ("¿Qué pasa si no me gusta el auto después de comprarlo?", 'devolucion'),
+    ("¿Tienen autos híbridos o eléctricos?", 'inventario'),
+    ("¿Cuál es el kilometraje máximo de los autos?", 'inventario'),
+    ("¿Ofrecen entrega a domicilio?", 'entrega'),
+    ("¿Qué documentos necesito para comprar un auto?", 'documentos'),
+    ("¿Puedo apartar un auto sin compromiso?", 'apartado'),
+]
+
+
+def _estimate_tokens(text: str) -> int:
+    """Estimación aproximada de tokens (~4 caracteres por token)."""
+    return (len(text) + 3) // 4
+
+
+def _rules_snapshot(rules: List[Tuple[str, str]], hide_categories: bool = False) -> Tuple[Dict, ...]:
+    """
+    Snapshot con el mismo formato que get_rules_snapshot.
+    Con hide_categories todas las reglas quedan en 'general', como las del
+    Agente Optimizador, cuyas categorías son tipos de error y no temas.
+    """
+    return tuple(
+        {'id': i + 1, 'rule_text': text, 'error_category': 'general' if hide_categories else topic,
+         'validation_score': 1.0}
+        for i, (topic, text) in enumerate(rules)
+    )
+
+
+def evaluate_offline(k_values: List[int], route: bool = False,
+                     hide_categories: bool = False) -> List[Dict]:
+    """
+    Tamaño del prompt, recall@k y precisión de las reglas por pregunta.
+
+    Args:
+        k_values: Valores de k a evaluar (0 = todas las reglas)
+        route: Enrutar por tema (TopicRouter) antes de elegir las top-k
+        hide_categories: Ocultar las categorías de las reglas al enrutador
+
+    Returns:
+        List[Dict]: Una fila de resultados por k
+    """
+    snapshot = _rules_snapshot(LABELED_RULES, hide_categories)
+    topics = {text: topic for topic, text in LABELED_RULES}
+    results = []
+
+    for k in k_values:
+        agent = MainAgent(llm=None, rules_top_k=k, prompt_layout='default',
+                          topic_router=TopicRouter() if route else None)
+        tokens, recalls, precisions, hits = [], [], [], 0
+        for question, topic in LABELED_QUESTIONS:
+            prompt = agent.build_system_prompt(snapshot, '', query=question)
+            tokens.append(_estimate_tokens(prompt))
+
+            relevant = {text for text, rule_topic in topics.items() if rule_topic == topic}
+            injected = [rule for rule in snapshot if rule['id'] in agent.last_rule_ids]
+            included = {text for text in relevant if text in prompt}
+            # Con k pequeño no caben todas: el máximo alcanzable es min(k, relevantes)
+            reachable = min(k, len(relevant)) if k else len(relevant)
+            recalls.append(min(1.0, len(included) / reachable))
+            precisions.append(len(included) / len(injected) if injected else 0.0)
+            hits += bool(included)
+
+        results.append({
+            'k': k,
+            'avg_tokens': sum(tokens) / len(tokens),
+            'recall': sum(recalls) / len(recalls),
+            'precision': sum(precisions) / len(precisions),
+            'hit_rate': hits / len(LABELED_QUESTIONS),
+        })
+
+    return results
+
+
+def evaluate_with_llm(k: int) -> Dict[str, Dict]:
+    """
+    Genera respuestas con todas las reglas y con top-k, y calcula las
+    métricas de MetricsCalculator para cada variante.
+
+    Args:
+        k: Reglas por pregunta en la variante seleccionada
+
+    Returns:
+        Dict[str, Dict]: Métricas por variante
+    """
+    from backend.utils.llm_config import LLMConfig
+
+    llm = LLMConfig.create_default().get_llm()
+    snapshot = _rules_snapshot(LABELED_RULES)
+    metrics = {}
+
+    for label, top_k in (('todas', 0), (f'top-{k}', k)):
+        agent = MainAgent(llm, rules_top_k=top_k, prompt_layout='default')
+        chat = []
+        for question, _ in LABELED_QUESTIONS:
+            prompt = agent.build_system_prompt(snapshot, '', query=question)
+            answer = agent.respond([SystemMessage(content=prompt), HumanMessage(content=question)])
+            chat.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        metrics[label] = MetricsCalculator.calculate_metrics(chat)
+
+    return metrics
+
+
+def evaluate_database(db_path: str, k_values: List[int]):
+    """
+    Tamaño del prompt con las reglas reales de la BD (sin etiquetas).
+
+    Args:
+        db_path: Ruta de la BD
+        k_values: Valores de k a evaluar
+    """
+    from backend.utils.storage import create_storage
+
+    db_manager = create_storage('sqlite', db_path)
+    snapshot = db_manager.get_rules_snapshot()
+    db_manager.close()
+
+    print(f"\n   Reglas en {db_path}: {len(snapshot)}")
+    for k in k_values:
+        agent = MainAgent(llm=None, rules_top_k=k, prompt_layout='default')
+        tokens = [
+            _estimate_tokens(agent.build_system_prompt(snapshot, '', query=question))
+            for question, _ in LABELED_QUESTIONS
+        ]
+        print(f"   k={k or 'todas':>5}: {sum(tokens) / len(tokens):8.0f} tokens promedio")
+
+
+def main():
+    """
+    Ejecuta la evaluación.
+    """
+    parser = argparse.ArgumentParser(description="Evalúa la selección de reglas por relevancia")
+    parser.add_argument('--k', type=int, nargs='+', default=[3, 5, 8, 12],
+                        help="Valores de k a comparar contra todas las reglas")
+    parser.add_argument('--db', help="Medir también el tamaño del prompt con las reglas de esta BD")
+    parser.add_argument('--no-route', action='store_true',
+                        help="No medir el enrutamiento por tema")
+    parser.add_argument('--llm', action='store_true',
+                        help="Generar respuestas con el LLM y comparar su calidad (usa la API)")
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("EVALUACIÓN: Selección de reglas por relevancia")
+    print("="*70)
+    print(f"   Reglas etiquetadas: {len(LABELED_RULES)} | Preguntas: {len(LABELED_QUESTIONS)}")
+
+    variants = [('Top-k sobre todas las reglas', {})]
+    if not args.no_route:
+        variants += [
+            ('Enrutado por tema (categorías = temas)', {'route': True}),
+            ('Enrutado por tema (categorías ocultas)', {'route': True, 'hide_categories': True}),
+        ]
+
+    baseline = None
+    for title, options in variants:
+        results = evaluate_offline([0] + args.k, **options)
+        if baseline is None:
+            baseline = results[0]['avg_tokens']
+        print(f"\n   {title}")
+        print(f"   {'k':>6}{'Tokens prompt':>16}{'Reducción':>12}{'Recall@k':>11}{'Precisión':>11}{'Aciertos':>10}")
+        print("   " + "─"*66)
+        for row in results:
+            reduction = (1 - row['avg_tokens'] / baseline) * 100
+            print(f"   {row['k'] or 'todas':>6}{row['avg_tokens']:>16.0f}{reduction:>11.1f}%"
+                  f"{row['recall'] * 100:>10.1f}%{row['precision'] * 100:>10.1f}%"
+                  f"{row['hit_rate'] * 100:>9.1f}%")
+
+    if args.db:
+        evaluate_database(args.db, [0] + args.k)
+
+    if args.llm:
+        k = args.k[0]
+        print(f"\n   Generando respuestas (todas vs top-{k})...")
+        for label, metrics in evaluate_with_llm(k).items():
+            print(f"   {label:>8}: resolución {metrics['resolution_rate']:.1f}% | "
+                  f"densidad de datos {metrics['keyword_density']:.2f} | "
+                  f"longitud {metrics['avg_response_length']:.0f} caracteres")
+
+    print("\n" + "="*70)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,39 +3,26 @@ Script de Evaluación Comparativa con LLM-as-Judge
 Demuestra científicamente la mejora del sistema con métricas cuantitativas.
 """
 
-import sqlite3
-import os
-import httpx
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain.schema import SystemMessage, HumanMessage
 import json
 from datetime import datetime
 
 # Importar funciones del agente
-from console_agent import build_system_prompt, get_db_connection
+from console_agent import build_system_prompt, get_db_manager
+from backend.utils.llm_config import LLMConfig
 
 
-# Configuración inicial
-load_dotenv()
+# Inicializar LLM (carga .env y limpia las variables de proxy).
+# Las respuestas se muestrean de nuevo en cada corrida: cachearlas con
+# temperatura 0.7 congelaría una sola muestra y ocultaría la varianza
+# que la evaluación debe medir
+llm_config = LLMConfig(model="gpt-3.5-turbo", temperature=0.7)
+llm = llm_config.get_llm()
 
-# Limpiar variables de proxy
-os.environ.pop('HTTP_PROXY', None)
-os.environ.pop('HTTPS_PROXY', None)
-os.environ.pop('http_proxy', None)
-os.environ.pop('https_proxy', None)
-
-# Configurar clientes HTTP
-sync_client = httpx.Client(timeout=30.0)
-async_client = httpx.AsyncClient(timeout=30.0)
-
-# Inicializar LLM
-llm = ChatOpenAI(
-    model="gpt-3.5-turbo",
-    temperature=0.7,
-    http_client=sync_client,
-    http_async_client=async_client
-)
+# El juez usa temperatura 0; con KAVAK_LLM_CACHE definida, el veredicto
+# de una respuesta idéntica ya juzgada se sirve desde la caché
+judge_config = LLMConfig(model="gpt-3.5-turbo", temperature=0)
+judge_llm = judge_config.get_llm()
 
 
 # PREGUNTAS DE EVALUACIÓN ESTÁNDAR
@@ -107,9 +94,10 @@ Responde SOLO en formato JSON:
             return 2, "Respuesta genérica"
 
 
-def run_evaluation(prompt_system, questions, llm_instance, label=""):
+def run_evaluation(prompt_system, questions, llm_instance, label="", judge_llm_instance=None):
     """
     Ejecuta evaluación completa con un conjunto de preguntas.
+    El juez es judge_llm_instance (por defecto, el mismo llm_instance).
     Retorna resultados detallados.
     """
     print(f"\n{'='*80}")
@@ -133,7 +121,7 @@ def run_evaluation(prompt_system, questions, llm_instance, label=""):
         answer = response.content
         
         # Evaluar con LLM-as-Judge
-        score, razon = llm_as_judge(question, answer, llm_instance)
+        score, razon = llm_as_judge(question, answer, judge_llm_instance or llm_instance)
         total_score += score
         
         results.append({
@@ -175,17 +163,8 @@ def insert_sample_rules():
         "REGLA: Si preguntan por tiempos, ser específico: aprobación crédito 24-48 hrs, pago venta 24-48 hrs, inspección 30-45 min."
     ]
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for rule in sample_rules:
-        # Verificar si ya existe
-        cursor.execute('SELECT COUNT(*) FROM prompt_rules WHERE rule_text = ?', (rule,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('INSERT INTO prompt_rules (rule_text) VALUES (?)', (rule,))
-    
-    conn.commit()
-    conn.close()
+    # Una sola transacción; las reglas ya existentes se ignoran (índice UNIQUE por hash)
+    get_db_manager().save_rules_bulk([(rule, 'general', 0.0) for rule in sample_rules])
     
     print(f"\n[Sistema: {len(sample_rules)} reglas de ejemplo insertadas en la BD]")
 
@@ -194,41 +173,17 @@ def clear_rules():
     """
     Limpia todas las reglas para baseline.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM prompt_rules')
-    conn.commit()
-    conn.close()
+    get_db_manager().clear_all_rules()
     print("\n[Sistema: Reglas limpiadas para evaluación baseline]")
 
 
 def get_baseline_prompt():
     """
     Obtiene el prompt base sin reglas ni memoria.
+    Las reglas se omiten al armar el prompt: la BD (reglas, archivo y
+    contadores de uso) no se modifica.
     """
-    from console_agent import build_system_prompt
-    
-    # Temporalmente limpiar reglas
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT rule_text FROM prompt_rules')
-    saved_rules = [row[0] for row in cursor.fetchall()]
-    cursor.execute('DELETE FROM prompt_rules')
-    conn.commit()
-    conn.close()
-    
-    # Construir prompt baseline
-    baseline = build_system_prompt("eval_baseline")
-    
-    # Restaurar reglas
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    for rule in saved_rules:
-        cursor.execute('INSERT INTO prompt_rules (rule_text) VALUES (?)', (rule,))
-    conn.commit()
-    conn.close()
-    
-    return baseline
+    return build_system_prompt("eval_baseline", include_rules=False)
 
 
 def generate_comparison_report(baseline_results, improved_results):
@@ -369,7 +324,8 @@ def main():
         baseline_prompt,
         EVALUATION_QUESTIONS,
         llm,
-        "BASELINE - Sin Reglas"
+        "BASELINE - Sin Reglas",
+        judge_llm
     )
     
     # PASO 2: Insertar reglas de aprendizaje
@@ -389,7 +345,8 @@ def main():
         improved_prompt,
         EVALUATION_QUESTIONS,
         llm,
-        "MEJORADO - Con Reglas"
+        "MEJORADO - Con Reglas",
+        judge_llm
     )
     
     # PASO 4: Generar reporte comparativo
@@ -398,6 +355,11 @@ def main():
     # PASO 5: Guardar resultados
     save_results_to_file(baseline_results, improved_results)
     
+    if judge_config.response_cache_active:
+        stats = judge_config.response_cache.stats()
+        print(f"\n[Sistema: caché del juez: {stats['hits']} aciertos, {stats['misses']} fallos, "
+              f"{stats['saved_seconds']:.1f} s de latencia ahorrados]")
+    
     print("\n✅ Evaluación completada exitosamente\n")
 
 
@@ -28,7 +28,7 @@ def render_login_screen(db_manager):
     Renderiza la pantalla de login/registro.
     
     Args:
-        db_manager: Instancia de DatabaseManager para validar usuarios
+        db_manager: Backend de almacenamiento para validar usuarios
     
     Returns:
         str: user_id si el usuario se autenticó, None en caso contrario
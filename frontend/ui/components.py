@@ -123,6 +123,65 @@ def render_metrics_sidebar(stats: dict):
     st.sidebar.markdown(badge, unsafe_allow_html=True)
 
 
+def render_database_metrics_sidebar(report: dict):
+    """
+    Renderiza las mediciones de acceso a datos en el sidebar.
+    
+    Args:
+        report: Reporte de get_instrumentation_report()
+    """
+    with st.sidebar.expander("🗄️ Acceso a Datos"):
+        st.caption(f"Conexiones abiertas: {report['connections_opened']}")
+        st.table([
+            {
+                'Método': name,
+                'Llamadas': method['calls'],
+                'p50 ms': round(method['p50_ms'], 2),
+                'p95 ms': round(method['p95_ms'], 2),
+                'SQL': method['statements'],
+                'Filas': method['rows'],
+            }
+            for name, method in report['methods'].items()
+        ])
+
+
+def render_prompt_cache_sidebar(stats: dict):
+    """
+    Renderiza los contadores de la caché de prompts en el sidebar.
+    
+    Args:
+        stats: Estado de PromptCache.stats()
+    """
+    with st.sidebar.expander("🧩 Caché de Prompts"):
+        col1, col2 = st.columns(2)
+        col1.metric("Aciertos", stats['hits'])
+        col2.metric("Fallos", stats['misses'])
+        st.caption(f"Tasa de aciertos: {stats['hit_rate'] * 100:.0f}% · "
+                   f"Entradas: {stats['entries']}/{stats['max_entries']}")
+
+
+def render_llm_usage_sidebar(report: dict):
+    """
+    Renderiza el uso de tokens del LLM y la caché del proveedor en el sidebar.
+    
+    Args:
+        report: Reporte de LLMConfig.get_usage_report()
+    """
+    with st.sidebar.expander("🧾 Uso del LLM"):
+        col1, col2 = st.columns(2)
+        col1.metric("Tokens de entrada", report['input_tokens'])
+        col2.metric("Desde caché", f"{report['cached_ratio'] * 100:.0f}%")
+        st.caption(f"Llamadas: {report['calls']} · Tokens de salida: {report['output_tokens']}")
+        if report['cached_calls']:
+            st.caption(f"Latencia: {report['avg_ms_cached']:.0f} ms con caché · "
+                       f"{report['avg_ms_uncached']:.0f} ms sin caché")
+        if report.get('response_cache'):
+            response_cache = report['response_cache']
+            st.caption(f"Caché de respuestas: {response_cache['hits']} aciertos · "
+                       f"{response_cache['misses']} fallos · "
+                       f"{response_cache['saved_seconds']:.1f} s ahorrados")
+
+
 def render_info_sidebar():
     """
     Renderiza información adicional en el sidebar.
@@ -7,8 +7,15 @@ from langchain.schema import SystemMessage, HumanMessage, AIMessage
 
 # Importar módulos del backend
 from backend.utils.llm_config import LLMConfig
-from backend.utils.database import DatabaseManager
+from backend.utils.storage import create_storage
 from backend.utils.metrics import MetricsCalculator
+from backend.utils.memory_compaction import MemoryCompactor
+from backend.utils.prompt_budget import PromptAssembler
+from backend.utils.conversation_window import ConversationWindow
+from backend.utils.rule_consolidation import RuleConsolidator
+from backend.utils.knowledge_base import KnowledgeBase
+from backend.utils.rule_usage import ActiveRuleSet, RuleUsageTracker
+from backend.utils.topic_router import TopicRouter
 from backend.agents.main_agent import MainAgent
 from backend.agents.summarizer_agent import SummarizerAgent
 from backend.agents.optimizer_agent import OptimizerAgent
@@ -69,18 +76,26 @@ def main():
     llm_config = LLMConfig.create_default()
     llm = llm_config.get_llm()
     
-    db_manager = DatabaseManager()
+    db_manager = create_storage()
     metrics_calculator = MetricsCalculator()
     
-    # Inicializar agentes
-    main_agent = MainAgent(llm)
-    summarizer_agent = SummarizerAgent(llm)
-    optimizer_agent = OptimizerAgent(llm)
+    # Inicializar agentes (un mismo presupuesto de tokens para los tres)
+    assembler = PromptAssembler()
+    # Solo las secciones de conocimiento relevantes entran al prompt (índice BM25 en disco)
+    main_agent = MainAgent(llm, assembler=assembler, active_rules=ActiveRuleSet(),
+                           topic_router=TopicRouter(), knowledge_base=KnowledgeBase().load())
+    summarizer_agent = SummarizerAgent(llm, assembler=assembler)
+    optimizer_agent = OptimizerAgent(llm, assembler=assembler)
+    # Las reglas nuevas casi duplicadas se fusionan con las existentes
+    rule_consolidator = RuleConsolidator(db_manager)
+    # Uso y feedback de cada regla inyectada, escritos por lotes
+    rule_usage = RuleUsageTracker(db_manager)
     
-    # Construir prompt del sistema
-    rules = db_manager.get_all_rules()
-    memory = db_manager.get_user_memory(user_id)
-    system_prompt = main_agent.build_system_prompt(rules, memory)
+    # Últimos turnos textuales; los anteriores se resumen en segundo plano
+    window = ConversationWindow(summarizer_agent)
+    
+    # Construir prompt del sistema (las reglas se eligen en cada pregunta)
+    system_prompt = main_agent.build_user_prompt(db_manager, user_id)
     
     # Inicializar historial de chat
     chat_history = [SystemMessage(content=system_prompt)]
@@ -96,6 +111,7 @@ def main():
         
         # Verificar comando de salida
         if user_input.lower() == 'salir':
+            rule_usage.flush()
             # Aprendizaje automático de la conversación
             if len(chat_history) > 1:
                 print("\n" + "="*70)
@@ -108,12 +124,24 @@ def main():
                     summarizer_agent, db_manager
                 )
                 
+                # Consolidar memorias antiguas si el usuario superó el límite
+                compaction = MemoryCompactor(db_manager, summarizer_agent).compact_user(user_id)
+                if compaction['folded']:
+                    print(f"[Sistema: {compaction['folded']} memorias antiguas consolidadas en una]")
+                
                 # Calcular y mostrar métricas
                 print("\nGenerando reporte de métricas...\n")
                 metrics = metrics_calculator.calculate_metrics(chat_history)
                 system_stats = db_manager.get_system_stats()
                 metrics_calculator.display_metrics(metrics, system_stats)
+                
+                # Mediciones de SQL (solo con KAVAK_DB_INSTRUMENT=1)
+                db_report = db_manager.get_instrumentation_report()
+                if db_report is not None:
+                    metrics_calculator.display_database_metrics(db_report)
+                metrics_calculator.display_llm_usage(llm_config.get_usage_report())
             
+            window.shutdown(wait=False)
             print("\n👋 ¡Gracias por usar el asistente de Kavak! Hasta pronto.")
             break
         
@@ -122,6 +150,11 @@ def main():
             print("⚠️  Por favor, escribe algo.")
             continue
         
+        # Inyectar solo las reglas y el conocimiento relevantes para esta pregunta
+        chat_history[0] = SystemMessage(content=main_agent.build_user_prompt(
+            db_manager, user_id, query=user_input
+        ))
+        
         # Añadir mensaje del usuario al historial
         chat_history.append(HumanMessage(content=user_input))
         
@@ -129,40 +162,50 @@ def main():
         print("\n🤖 Kavak pensando...")
         
         try:
-            # Llamar al Agente Principal
-            ai_response_content = main_agent.respond(chat_history)
+            # Llamar al Agente Principal con la ventana reciente y el resumen
+            history, summary = window.view(chat_history)
+            ai_response_content = main_agent.respond(history, summary=summary)
+            turn_rule_ids = main_agent.last_rule_ids
+            rule_usage.record_injection(turn_rule_ids)
+            
+            # Avisar si el prompt no cupo en el presupuesto de tokens
+            trimmed = main_agent.last_prompt_report['trimmed']
+            if trimmed:
+                detail = ', '.join(f"{name}: {count}" for name, count in trimmed.items())
+                print(f"\n[Sistema: prompt recortado a {assembler.max_tokens} tokens ({detail})]")
             
             # Mostrar respuesta
             print(f"\n🚗 Kavak: {ai_response_content}")
             
             # Añadir respuesta del bot al historial
             chat_history.append(AIMessage(content=ai_response_content))
+            window.update(chat_history)
             
             # Sistema de feedback OPCIONAL
             print("\n¿Quieres dar feedback? (si/no para forzar aprendizaje, Enter para continuar)")
             feedback = input("Tu feedback: ").strip().lower()
             
             if feedback == 'si' or feedback == 's':
+                rule_usage.record_feedback(turn_rule_ids, positive=True)
                 # Usar Agente Resumidor
                 summary = summarizer_agent.summarize_conversation(chat_history)
                 db_manager.save_user_memory(user_id, summary)
                 print("\n[Sistema: ✓ Memoria guardada exitosamente. Esta información se recordará en futuras conversaciones.]")
                 
             elif feedback == 'no' or feedback == 'n':
+                rule_usage.record_feedback(turn_rule_ids, positive=False)
                 # Usar Agente Optimizador
                 try:
                     rule_text, error_category, validation_score = optimizer_agent.optimize(chat_history)
                     
                     # Guardar solo si la validación es positiva
                     if validation_score >= 0.5:
-                        db_manager.save_rule(rule_text, error_category, validation_score)
+                        rule_consolidator.save_rule(rule_text, error_category, validation_score)
                         print(f"\n[Sistema: ✓ Regla validada (score: {validation_score:.1f}) y guardada. Categoría: {error_category}]")
                         
                         # Reconstruir el prompt con la nueva regla
                         print("\n[Sistema: Aplicando mejora al asistente...]")
-                        rules = db_manager.get_all_rules()
-                        memory = db_manager.get_user_memory(user_id)
-                        system_prompt = main_agent.build_system_prompt(rules, memory)
+                        system_prompt = main_agent.build_user_prompt(db_manager, user_id, query=user_input)
                         chat_history[0] = SystemMessage(content=system_prompt)
                         print("[Sistema: ✓ Asistente mejorado. Continuemos...]")
                     else:
@@ -174,6 +217,7 @@ def main():
         except Exception as e:
             print(f"\n❌ Error al comunicarse con la IA: {str(e)}")
             print("Por favor, verifica tu configuración de API key en el archivo .env")
+            rule_usage.flush()
             break
 
 
@@ -3,7 +3,7 @@ Script para resetear la base de datos a estado inicial (0)
 Elimina todas las reglas y memorias aprendidas
 """
 
-from backend.utils.database import DatabaseManager
+from backend.utils.storage import create_storage
 
 
 def main():
@@ -22,8 +22,8 @@ def main():
     confirmacion = input("\n¿Estás seguro? Escribe 'RESETEAR' para confirmar: ").strip()
     
     if confirmacion == 'RESETEAR':
-        # Crear instancia del gestor (crea BD automáticamente si no existe)
-        db_manager = DatabaseManager()
+        # Crear el backend configurado (crea la BD automáticamente si no existe)
+        db_manager = create_storage()
         
         # Resetear
         db_manager.reset_database()
@@ -0,0 +1,40 @@
+"""
+Script de refragmentación de la base de datos
+Redistribuye usuarios y memorias en N archivos SQLite según el hash
+del user_id. Sirve tanto para fragmentar una BD existente como para
+cambiar el número de fragmentos cuando crece la carga.
+"""
+
+import argparse
+
+from backend.utils.database import DatabaseManager
+from backend.utils.sharding import reshard
+
+
+def main():
+    """
+    Ejecuta la refragmentación.
+    """
+    parser = argparse.ArgumentParser(description="Cambia el número de fragmentos de usuarios")
+    parser.add_argument('--shards', type=int, required=True,
+                        help="Número de fragmentos deseado")
+    parser.add_argument('--db-path', default=DatabaseManager.DB_PATH,
+                        help="Ruta de la BD principal")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("REFRAGMENTACIÓN DE USUARIOS Y MEMORIAS")
+    print("="*60)
+    print("\n⚠️  Detén la aplicación antes de continuar: las escrituras")
+    print("   concurrentes durante la copia se perderían.")
+
+    report = reshard(args.db_path, args.shards)
+
+    if report['old_shards'] == report['new_shards']:
+        print(f"\nLa BD ya tiene {args.shards} fragmentos. No se realizaron cambios.")
+    else:
+        print("\n✅ Refragmentación completada")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Pruebas del barrido de retención sobre memorias compactadas.
+"""
+
+import sqlite3
+
+import pytest
+
+from backend.utils.database import DatabaseManager
+from backend.utils.retention import RetentionPolicy, RetentionSweeper
+
+
+USER_ID = 'retention_user'
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(db_path=str(tmp_path / 'retention.db'), retention=RetentionPolicy())
+    yield manager
+    manager.close()
+
+
+def _set_created_at(db, created_at):
+    conn = sqlite3.connect(db.db_path)
+    with conn:
+        conn.executemany('UPDATE user_memory SET created_at = ? WHERE id = ?',
+                         [(timestamp, memory_id) for memory_id, timestamp in created_at.items()])
+    conn.close()
+
+
+def _sweep(db, max_per_user):
+    # Política explícita, como apply_retention.py: el gestor no tiene barrido propio
+    assert db._sweeper is None
+    return RetentionSweeper(db, RetentionPolicy(memory_max_per_user=max_per_user), pause=0).run_once()
+
+
+def test_max_per_user_keeps_consolidated_memory(db):
+    ids = [db.save_user_memory(USER_ID, f"Memoria {i}") for i in range(3)]
+    _set_created_at(db, {ids[0]: '2026-01-01 00:00:00',
+                         ids[1]: '2026-01-02 00:00:00',
+                         ids[2]: '2026-01-03 00:00:00'})
+
+    # La consolidada queda con el ID más antiguo y la fecha más reciente
+    consolidated_id = db.compact_user_memory(USER_ID, [ids[0], ids[2]], "Resumen de 0 y 2")
+    assert consolidated_id == ids[0]
+
+    assert _sweep(db, max_per_user=1)['memories_over_limit'] == 1
+    remaining = list(db.iter_user_memory(USER_ID))
+    assert remaining == [{'id': consolidated_id, 'context': "Resumen de 0 y 2"}]
+
+
+def test_max_per_user_prefers_originals_on_same_timestamp(db):
+    ids = [db.save_user_memory(USER_ID, f"Memoria {i}") for i in range(4)]
+    _set_created_at(db, {memory_id: '2026-01-01 00:00:00' for memory_id in ids})
+
+    consolidated_id = db.compact_user_memory(USER_ID, ids[:2], "Resumen de 0 y 1")
+
+    assert _sweep(db, max_per_user=2)['memories_over_limit'] == 1
+    remaining = [memory['id'] for memory in db.iter_user_memory(USER_ID)]
+    assert remaining == [consolidated_id, ids[3]]
+
+
+def test_legacy_memories_expire_on_first_sweep(db):
+    db.save_user_memory(USER_ID, "Memoria anterior a v7")
+    db.close()
+
+    # Se vuelve al esquema v6: user_memory sin created_at
+    conn = sqlite3.connect(db.db_path)
+    with conn:
+        conn.execute('DROP INDEX idx_user_memory_created_at')
+        conn.execute('ALTER TABLE user_memory DROP COLUMN created_at')
+        conn.execute('PRAGMA user_version = 6')
+    conn.close()
+
+    migrated = DatabaseManager(db_path=db.db_path, retention=RetentionPolicy())
+    try:
+        new_id = migrated.save_user_memory(USER_ID, "Memoria nueva")
+        policy = RetentionPolicy(memory_max_age_days=30)
+        assert RetentionSweeper(migrated, policy, pause=0).run_once()['memories_expired'] == 1
+        assert [memory['id'] for memory in migrated.iter_user_memory(USER_ID)] == [new_id]
+    finally:
+        migrated.close()
+
+
+def test_rules_below_min_score_need_min_age(db):
+    rule_id = db.save_rule("REGLA: Si preguntan por garantía, mencionar 3 meses o 3,000 km.")
+    policy = RetentionPolicy(rule_min_score=0.5)
+
+    # Recién guardada (validation_score 0.0): aún no se puede juzgar
+    assert RetentionSweeper(db, policy, pause=0).run_once()['rules_expired'] == 0
+
+    conn = sqlite3.connect(db.db_path)
+    with conn:
+        conn.execute("UPDATE prompt_rules SET created_at = datetime('now', '-8 days') WHERE id = ?", (rule_id,))
+    conn.close()
+    assert RetentionSweeper(db, policy, pause=0).run_once()['rules_expired'] == 1
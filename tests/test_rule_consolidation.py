@@ -0,0 +1,83 @@
+"""
+Pruebas de la consolidación de reglas casi duplicadas con el umbral por defecto.
+"""
+
+import pytest
+
+from backend.utils.memory_storage import InMemoryStorage
+from backend.utils.rule_consolidation import (
+    DEFAULT_RULE_DEDUP_THRESHOLD, RULE_DEDUP_THRESHOLD_ENV_VAR, RuleConsolidator, jaccard, rule_shingles,
+)
+
+
+WARRANTY_RULE = "REGLA: Si preguntan por garantía, mencionar 3 meses o 3,000 km."
+
+# Paráfrasis de la misma instrucción (Jaccard exacta de 0.52 a 0.78)
+PARAPHRASES = [
+    "REGLA: Si preguntan sobre garantía, decir 3 meses o 3,000 km.",
+    "REGLA: Si preguntan por garantía, indicar 3 meses o 3,000 km de cobertura.",
+    "REGLA: Si preguntan por la garantía, siempre mencionar que cubre 3 meses o 3,000 km.",
+    "REGLA: Cuando pregunten por garantía, mencionar 3 meses o 3000 km.",
+]
+
+# Misma plantilla, otra instrucción (Jaccard exacta de 0.30 a 0.41)
+DISTINCT_PAIRS = [
+    ("REGLA: Si preguntan por garantía, mencionar 3 meses.",
+     "REGLA: Si preguntan por garantía, mencionar el 800-KAVAK-01."),
+    (WARRANTY_RULE, "REGLA: Si preguntan por garantía, mencionar que no cubre desgaste normal."),
+]
+
+
+@pytest.fixture(autouse=True)
+def default_threshold(monkeypatch):
+    monkeypatch.delenv(RULE_DEDUP_THRESHOLD_ENV_VAR, raising=False)
+
+
+@pytest.mark.parametrize('paraphrase', PARAPHRASES)
+def test_paraphrases_are_merged(paraphrase):
+    assert jaccard(rule_shingles(WARRANTY_RULE), rule_shingles(paraphrase)) >= DEFAULT_RULE_DEDUP_THRESHOLD
+
+    db = InMemoryStorage()
+    consolidator = RuleConsolidator(db)
+    canonical_id = consolidator.save_rule(WARRANTY_RULE, 'garantia', 0.8)
+
+    assert consolidator.save_rule(paraphrase, 'garantia', 0.5) == canonical_id
+    assert [rule['rule_text'] for rule in db.get_rules_snapshot()] == [WARRANTY_RULE]
+    assert [rule['rule_text'] for rule in db.get_rule_provenance(canonical_id)] == [paraphrase]
+
+
+@pytest.mark.parametrize('first, second', DISTINCT_PAIRS)
+def test_distinct_instructions_are_kept(first, second):
+    assert jaccard(rule_shingles(first), rule_shingles(second)) < DEFAULT_RULE_DEDUP_THRESHOLD
+
+    db = InMemoryStorage()
+    consolidator = RuleConsolidator(db)
+    consolidator.save_rule(first)
+    consolidator.save_rule(second)
+
+    assert [rule['rule_text'] for rule in db.get_rules_snapshot()] == [first, second]
+
+
+def test_batch_merges_paraphrases_only():
+    db = InMemoryStorage()
+    distinct = [second for _, second in DISTINCT_PAIRS]
+    db.save_rules_bulk([(text, 'general', 0.0) for text in [WARRANTY_RULE, *PARAPHRASES, *distinct]])
+
+    report = RuleConsolidator(db).run_batch(verbose=False)
+
+    assert report['clusters'] == 1
+    assert report['rules_merged'] == len(PARAPHRASES)
+    remaining = [rule['rule_text'] for rule in db.get_rules_snapshot()]
+    assert remaining == [WARRANTY_RULE, *distinct]
+
+
+def test_threshold_from_environment(monkeypatch):
+    monkeypatch.setenv(RULE_DEDUP_THRESHOLD_ENV_VAR, '0.8')
+
+    db = InMemoryStorage()
+    consolidator = RuleConsolidator(db)
+    consolidator.save_rule(WARRANTY_RULE)
+    consolidator.save_rule(PARAPHRASES[0])
+
+    assert consolidator.threshold == 0.8
+    assert len(db.get_rules_snapshot()) == 2
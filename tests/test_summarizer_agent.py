@@ -0,0 +1,40 @@
+"""
+Pruebas de los mensajes que el Agente Resumidor envía al LLM.
+"""
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from backend.agents.summarizer_agent import SummarizerAgent
+
+
+class RecordingLLM:
+    """LLM falso que guarda los mensajes recibidos."""
+
+    def __init__(self, reply="Usuario busca SUV familiar."):
+        self.reply = reply
+        self.calls = []
+
+    def invoke(self, messages):
+        self.calls.append(messages)
+        return AIMessage(content=self.reply)
+
+
+def test_summarize_conversation_excludes_system_messages():
+    llm = RecordingLLM()
+    agent = SummarizerAgent(llm)
+    chat_history = [
+        SystemMessage(content="Eres el asistente de Kavak.\n\nMEMORIA DEL USUARIO: busca sedán"),
+        HumanMessage(content="Busco una SUV familiar"),
+        AIMessage(content="Tenemos la RAV4 y la CX-5"),
+        HumanMessage(content="¿Qué garantía tienen?"),
+    ]
+
+    assert agent.summarize_conversation(chat_history) == "Usuario busca SUV familiar."
+
+    [messages] = llm.calls
+    # Un solo SystemMessage: el prompt del resumidor, no el del chatbot
+    assert [type(message) for message in messages] == [SystemMessage, HumanMessage, AIMessage, HumanMessage]
+    assert messages[0].content == SummarizerAgent.MEMORY_PROMPT
+    assert [message.content for message in messages[1:]] == [
+        message.content for message in chat_history[1:]
+    ]